@@ -1,8 +1,16 @@
+import gc
+import os
 import platform
+import threading
 import uptime
 from datetime import timedelta
 import time
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 _start_time = time.time()
 
 
@@ -23,4 +31,43 @@ def get_pretty_python_uptime(custom_name=''):
     delta = now - _start_time
     str_uptime = str(timedelta(seconds=int(delta)))
     pretty_uptime = "{custom_name} Uptime: {uptime}".format(custom_name=custom_name, uptime=str_uptime)
-    return pretty_uptime.strip()
\ No newline at end of file
+    return pretty_uptime.strip()
+
+
+def get_resident_memory():
+    """Resident set size in bytes, the peak one where the current one isn't available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def get_cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+def get_pretty_process_resources():
+    rss = get_resident_memory()
+    times = os.times()
+    return "Memory: {rss} MiB RSS, CPU: {user:.1f} s user {system:.1f} s system, Threads: {threads}".format(
+        rss='?' if rss is None else '%.1f' % (rss / 1024 / 1024), user=times.user, system=times.system,
+        threads=threading.active_count())
+
+
+def get_pretty_gc_stats():
+    generations = ["gen{generation} {pending} pending, {collections} runs, {collected} collected".format(
+        generation=generation, pending=pending, **stats)
+        for generation, (pending, stats) in enumerate(zip(gc.get_count(), gc.get_stats()))]
+    return "GC: " + "; ".join(generations) + "; {garbage} uncollectable".format(garbage=len(gc.garbage))
+
+
+def get_pretty_sizes(sizes):
+    """One line of (name, size) pairs, like the number of entries of some caches."""
+    return ", ".join("{name}: {size}".format(name=name, size=size) for name, size in sizes)
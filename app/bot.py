@@ -2,24 +2,25 @@
 This file handles a Telegram inline bot that sends voice messages from La Vida Moderna (radio program from La Ser)
 """
 
-import telebot
-import requests
-import string
-import telebot.types as types
 import argparse
 import logger
 import json
-import unidecode
-import random
-from time import sleep
-from persistence import *
-from persistence import tools
+from webhook import UpdateWorkers, WebhookServer
+from polling import Poller
+from recorder import UpdateRecorder
+import metrics
 import os
+import atexit
+import signal
+import sys
+import threading
 import PrettyUptime
 
+# Imported by load_dependencies, only once the arguments are valid
+Database = HistoryWriter = Retention = parse_sqlite_path = FileWatcher = SoundBot = None
+DEFAULT_PAGE_SIZE = MAX_PAGE_SIZE = None
+
 LOG = logger.get_logger('LaVidaModerna_Bot')
-REMOVE_CHARS = string.punctuation + string.whitespace
-TELEGRAM_INLINE_MAX_RESULTS = 48
 
 _ENV_TELEGRAM_BOT_TOKEN = "TELEGRAM_BOT_TOKEN"
 _ENV_TELEGRAM_USER_ALIAS = "TELEGRAM_USER_ALIAS"
@@ -28,6 +29,23 @@ _ENV_MYSQL_HOST = 'MYSQL_HOST'
 _ENV_MYSQL_PORT = 'MYSQL_PORT'
 _ENV_DATA_JSON = 'DATA_JSON'
 _ENV_LOGGING_FILE = 'LOGFILE'
+_ENV_MODE = 'BOT_MODE'
+_ENV_WEBHOOK_URL = 'WEBHOOK_URL'
+_ENV_WEBHOOK_PORT = 'WEBHOOK_PORT'
+_ENV_WEBHOOK_SECRET = 'WEBHOOK_SECRET'
+_ENV_WORKERS = 'WORKERS'
+_ENV_METRICS_PORT = 'METRICS_PORT'
+_ENV_RETENTION_DAYS = 'HISTORY_RETENTION_DAYS'
+_ENV_UPLOAD_CHAT = 'UPLOAD_CHAT_ID'
+_ENV_SOUNDS_DIR = 'SOUNDS_DIR'
+_ENV_CATALOG_SNAPSHOT = 'CATALOG_SNAPSHOT'
+_ENV_BOTS_CONFIG = 'BOTS_CONFIG'
+
+# Arguments each bot of a --config file can set, the rest are shared by all of them
+BOT_ARGUMENTS = ('name', 'token', 'admin', 'bucket', 'data', 'catalog_name', 'catalog_snapshot', 'page_size',
+                 'upload_chat', 'upload_pause', 'sounds_dir', 'watch_interval', 'popularity_half_life',
+                 'popularity_refresh', 'recommendations_refresh', 'query_window', 'webhook_url', 'webhook_path',
+                 'webhook_secret')
 
 
 parser = argparse.ArgumentParser()
@@ -35,229 +53,408 @@ parser.add_argument("-v", "--verbosity", help="Defines log verbosity",
                     choices=['CRITICAL', 'ERROR', 'WARN', 'INFO', 'DEBUG'], default='INFO')
 parser.add_argument("-b", "--bucket", help="Bucket or url where audios are stored",
                     default='https://github.com/dmcelectrico/SoundsTable/raw/master/LaVidaModerna/')
-parser.add_argument("--sqlite", help="SQLite file path")
+parser.add_argument("--sqlite", help="SQLite file path, optionally followed by tuning options like "
+                                      "db.sqlite?tuned or db.sqlite?journal_mode=wal&synchronous=normal")
 parser.add_argument("--mysql-host", help="mysql host")
 parser.add_argument("--mysql-port", type=str, help="mysql port", default='3306')
 parser.add_argument("--token", type=str, help="Telegram API token given by @botfather.")
-parser.add_argument("--admin", type=str, help="Alias of the admin user.")
+parser.add_argument("--admin", type=str, help="Alias of the admin user, the only one sent the /stats and /export "
+                                              "of every bot when hosting several.")
 parser.add_argument("--data", type=str, help="Data JSON path.", default='data.json')
 parser.add_argument("--logfile", type=str, help="Log to defined file.")
+parser.add_argument("--log-format", help="Format of the log lines.", choices=['text', 'json'], default='text')
+parser.add_argument("--log-queue-size", type=int, help="Log records waiting for the background writer, further ones "
+                                                       "are dropped. 0 writes them on the logging thread.",
+                    default=logger.DEFAULT_QUEUE_SIZE)
+parser.add_argument("--log-sample", action='append', metavar='LOGGER=N', default=[],
+                    help="Keep only one of every N info and debug records of a logger.")
+parser.add_argument("--log-rate-limit", action='append', metavar='LOGGER=N', default=[],
+                    help="Keep at most N info and debug records per second of a logger.")
+parser.add_argument("--config", type=str, help="JSON file hosting several bots in this process: "
+                                               "{\"bots\": [{\"name\": ..., \"token\": ..., \"data\": ..., "
+                                               "\"bucket\": ...}, ...]}. Each bot can override %s, the other "
+                                               "arguments are shared." % ', '.join(BOT_ARGUMENTS[1:]))
+parser.add_argument("--catalog-name", type=str, help="Namespace of the sounds in the database, only needed when "
+                                                    "several catalogs share it.", default='')
+parser.add_argument("--upload-chat", type=str, help="Chat the sounds are uploaded to once, so results are served "
+                                                    "from Telegram instead of the bucket.")
+parser.add_argument("--upload-pause", type=float, help="Seconds between sound uploads.", default=1.0)
+parser.add_argument("--sounds-dir", type=str, help="Local copy of the bucket, read instead of downloading the sounds "
+                                                   "to upload them.")
+parser.add_argument("--page-size", type=int, help="Inline results sent per answer, the next ones are sent as the user "
+                                                  "scrolls. 20 by default, 50 at most.")
+parser.add_argument("--catalog-snapshot", type=str, help="File the built catalog is saved to and loaded from while "
+                                                        "the data JSON doesn't change, next to it by default. Bots of "
+                                                        "a --config file add their name to it. Empty disables it.")
+parser.add_argument("--watch-interval", type=float, help="Seconds between data JSON change checks, 0 disables it.",
+                    default=10)
+parser.add_argument("--popularity-half-life", type=float, help="Days for a use to count half in the popularity.",
+                    default=7)
+parser.add_argument("--popularity-refresh", type=float, help="Seconds between popularity ranking refreshes.",
+                    default=60)
+parser.add_argument("--recommendations-refresh", type=float, help="Seconds between rebuilds of the sounds "
+                                                               "recommended from the ones used together, 0 "
+                                                               "disables recommendations.", default=10 * 60)
+parser.add_argument("--query-window", type=float, help="Seconds a user must stop typing for an inline query to be "
+                                                    "recorded, 0 records every one and answers superseded ones.",
+                    default=1.0)
+parser.add_argument("--history-queue-size", type=int, help="Max history events waiting to be written.",
+                    default=10000)
+parser.add_argument("--history-batch-size", type=int, help="Max history events written per transaction.",
+                    default=500)
+parser.add_argument("--history-flush-interval", type=float, help="Max seconds a history event waits to be written.",
+                    default=1.0)
+parser.add_argument("--history-overflow", help="What to do with history events when the queue is full: block, "
+                                                "drop or spill.", default='block')
+parser.add_argument("--history-spill-file", type=str, help="File where the spill overflow policy stores events, "
+                                                           "history.spill next to the database by default.")
+parser.add_argument("--retention-days", type=int, help="Days of raw history kept before being rolled up into daily "
+                                                        "totals, 0 keeps it forever.", default=0)
+parser.add_argument("--retention-batch-size", type=int, help="History rows rolled up per transaction.", default=500)
+parser.add_argument("--retention-interval", type=float, help="Seconds between history retention runs.",
+                    default=60 * 60)
+parser.add_argument("--mode", help="How updates are received from Telegram", choices=['polling', 'webhook'],
+                    default='polling')
+parser.add_argument("--workers", type=int, help="Threads handling updates.", default=4)
+parser.add_argument("--webhook-url", type=str, help="Public url Telegram posts updates to.")
+parser.add_argument("--webhook-listen", type=str, help="Address the webhook server binds to.", default='0.0.0.0')
+parser.add_argument("--webhook-port", type=int, help="Port the webhook server listens on.", default=8443)
+parser.add_argument("--webhook-path", type=str, help="Path the webhook server accepts updates on.", default='/')
+parser.add_argument("--webhook-secret", type=str, help="Secret token Telegram must send with every update.")
+parser.add_argument("--webhook-queue-size", type=int, help="Updates waiting for a free worker, webhook ones are "
+                                                         "rejected beyond it.",
+                    default=64)
+parser.add_argument("--webhook-cert", type=str, help="TLS certificate, when not behind a reverse proxy.")
+parser.add_argument("--webhook-key", type=str, help="TLS private key of --webhook-cert.")
+parser.add_argument("--record-updates", type=str, help="File every received update is appended to, gzipped, to "
+                                                      "replay them with tests/replay_updates.py.")
+parser.add_argument("--record-anonymize", action='store_true', help="Record hashed user and chat ids and no names.")
+parser.add_argument("--metrics-listen", type=str, help="Address the metrics endpoint binds to.", default='127.0.0.1')
+parser.add_argument("--metrics-port", type=int, help="Port of the Prometheus metrics endpoint, 0 disables it.",
+                    default=0)
+
+args = None
+database = None
+history = None
+retention = None
+recorder = None
+bots = []
+
+
+def load_dependencies():
+    """Imports telebot, pony and the modules using them, which take most of the start up."""
+    global Database, HistoryWriter, Retention, parse_sqlite_path, FileWatcher, SoundBot, DEFAULT_PAGE_SIZE, \
+        MAX_PAGE_SIZE
+    from persistence import Database
+    from persistence.writebehind import HistoryWriter
+    from persistence.sqlite import parse_sqlite_path
+    from persistence.retention import Retention
+    from catalog import FileWatcher
+    from catalog.pages import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+    from soundbot import SoundBot
+
+
+def parse_args(argv=None):
+    args = parser.parse_args(argv)
+
+    try:
+        args.logfile = os.environ[_ENV_LOGGING_FILE]
+    except KeyError:
+        pass
+
+    try:
+        args.config = os.environ[_ENV_BOTS_CONFIG]
+    except KeyError:
+        pass
+
+    try:
+        args.token = os.environ[_ENV_TELEGRAM_BOT_TOKEN]
+    except KeyError as key_error:
+        if not args.token and not args.config:
+            LOG.critical(
+                'No telegram bot token provided. Please do so using --token argument or %s environment variable.',
+                _ENV_TELEGRAM_BOT_TOKEN)
+            exit(1)
 
-args = parser.parse_args()
+    try:
+        args.admin = os.environ[_ENV_TELEGRAM_USER_ALIAS]
+    except KeyError as key_error:
+        if not args.admin:
+            LOG.warn(
+                'No admin user specified. Please do so using --admin argument or %s environment variable.',
+                _ENV_TELEGRAM_USER_ALIAS)
 
-BUCKET = args.bucket
+    try:
+        args.mysql_host = os.environ[_ENV_MYSQL_HOST]
+    except KeyError:
+        pass
 
+    try:
+        args.mysql_port = os.environ[_ENV_MYSQL_PORT]
+    except KeyError:
+        pass
 
-try:
-    args.logfile = os.environ[_ENV_LOGGING_FILE]
-except KeyError:
-    pass
+    try:
+        args.data = os.environ[_ENV_DATA_JSON]
+    except KeyError:
+        pass
 
-if args.logfile:
-    logger.add_file_handler(args.logfile, args.verbosity)
+    try:
+        args.sqlite = os.environ[_ENV_SQLITE_FILE]
+    except KeyError:
+        pass
 
-logger.set_log_level(args.verbosity)
+    try:
+        args.mode = os.environ[_ENV_MODE]
+    except KeyError:
+        pass
 
+    try:
+        args.workers = int(os.environ[_ENV_WORKERS])
+    except KeyError:
+        pass
 
-try:
-    args.token = os.environ[_ENV_TELEGRAM_BOT_TOKEN]
-except KeyError as key_error:
-    if not args.token:
-        LOG.critical(
-            'No telegram bot token provided. Please do so using --token argument or %s environment variable.',
-            _ENV_TELEGRAM_BOT_TOKEN)
-        exit(1)
+    try:
+        args.webhook_url = os.environ[_ENV_WEBHOOK_URL]
+    except KeyError:
+        pass
 
-try:
-    args.admin = os.environ[_ENV_TELEGRAM_USER_ALIAS]
-except KeyError as key_error:
-    if not args.admin:
-        LOG.warn(
-            'No admin user specified. Please do so using --admin argument or %s environment variable.',
-            _ENV_TELEGRAM_USER_ALIAS)
-
-try:
-    args.mysql_host = os.environ[_ENV_MYSQL_HOST]
-except KeyError:
-    pass
-
-try:
-    args.mysql_port = os.environ[_ENV_MYSQL_PORT]
-except KeyError:
-    pass
-
-try:
-    args.data = os.environ[_ENV_DATA_JSON]
-except KeyError:
-    pass
-
-try:
-    args.sqlite = os.environ[_ENV_SQLITE_FILE]
-except KeyError:
-    pass
-
-LOG.info('Starting up bot...')
-
-if args.mysql_host:
-    LOG.info('Using MySQL as persistence layer: host %s port %s', args.mysql_host, args.mysql_port)
-    # TODO: Pony migration
-else:
-    LOG.info('Using SQLite as persistence layer: %s', args.sqlite)
-    database = Database('sqlite', filename=args.sqlite)
-
-bot = telebot.TeleBot(args.token)
-
-
-@bot.message_handler(commands=['start'])
-def send_welcome(message):
-    LOG.debug(message)
-    cid = message.chat.id
-    bot.send_message(cid,
-                     "Este bot es inline. Teclea su nombre en una conversación/grupo y podras enviar un mensaje "
-                     "moderno.")
-    database.add_or_update_user(message.from_user)
-
-
-@bot.inline_handler(lambda query: query.query == '')
-def query_empty(inline_query):
-    LOG.debug(inline_query)
-    r = []
-    recently_used_sounds = tools.get_latest_used_sounds_from_user(inline_query.from_user.id)
-    for sound in recently_used_sounds:
-        r.append(types.InlineQueryResultVoice(
-            sound["id"], BUCKET + sound["filename"], '🕚 '+sound["text"], caption=sound["text"]))
-    for sound in sounds:
-        if sound in recently_used_sounds:
-            continue
-        r.append(types.InlineQueryResultVoice(
-            sound["id"], BUCKET + sound["filename"], sound["text"], caption=sound["text"]))
-        if len(r) > TELEGRAM_INLINE_MAX_RESULTS:  # https://core.telegram.org/bots/api#answerinlinequery
-            break
-    bot.answer_inline_query(inline_query.id, r, is_personal=True, cache_time=5)
-    on_query(inline_query)
-
-
-@bot.inline_handler(lambda query: query.query)
-def query_text(inline_query):
-    LOG.debug(inline_query)
     try:
-        text = unidecode.unidecode(inline_query.query.translate(REMOVE_CHARS).lower())
-        LOG.debug("Querying: " + text)
-        r = []
-        for sound in sounds:
-            if text in sound["tags"]:  # FIXME: Improve search
-                r.append(types.InlineQueryResultVoice(
-                    sound["id"], BUCKET + sound["filename"], sound["text"], caption=sound["text"]))
-            if len(r) > TELEGRAM_INLINE_MAX_RESULTS:
-                break
-        bot.answer_inline_query(inline_query.id, r, cache_time=5)
-        on_query(inline_query)
-    except Exception as e:
-        LOG.error("Query aborted" + str(e), e)
-
-
-@bot.chosen_inline_handler(func=lambda chosen_inline_result: True)
-def on_result(chosen_inline_result):
-    LOG.debug('Chosen result: %s', str(chosen_inline_result))
+        args.webhook_port = int(os.environ[_ENV_WEBHOOK_PORT])
+    except KeyError:
+        pass
+
+    try:
+        args.webhook_secret = os.environ[_ENV_WEBHOOK_SECRET]
+    except KeyError:
+        pass
+
+    try:
+        args.metrics_port = int(os.environ[_ENV_METRICS_PORT])
+    except KeyError:
+        pass
+
+    try:
+        args.retention_days = int(os.environ[_ENV_RETENTION_DAYS])
+    except KeyError:
+        pass
+
+    try:
+        args.upload_chat = os.environ[_ENV_UPLOAD_CHAT]
+    except KeyError:
+        pass
+
+    try:
+        args.sounds_dir = os.environ[_ENV_SOUNDS_DIR]
+    except KeyError:
+        pass
+
     try:
-        database.add_result(chosen_inline_result)
-    except Exception as e:
-        LOG.error("Couldn't save result" + str(e), e)
+        args.catalog_snapshot = os.environ[_ENV_CATALOG_SNAPSHOT]
+    except KeyError:
+        pass
+
+    args.bots = bot_arguments(args)
 
+    if args.mode == 'webhook' and not all(bot_args.webhook_url for bot_args in args.bots):
+        LOG.critical('Webhook mode needs a public url. Please provide it using --webhook-url argument or %s '
+                     'environment variable.', _ENV_WEBHOOK_URL)
+        exit(1)
 
-def on_query(query):
+    return args
+
+
+def bot_arguments(args):
+    """Arguments of every bot hosted, the ones of the --config file bots over the shared ones or just args."""
+    if args.config:
+        with open(args.config) as config_file:
+            configs = json.load(config_file)['bots']
+    else:
+        configs = [{'name': ''}]
+
+    names = set()
+    hosted = []
+    for config in configs:
+        unknown = set(config) - set(BOT_ARGUMENTS)
+        if unknown:
+            LOG.critical('Unknown bot arguments in %s: %s', args.config, ', '.join(sorted(unknown)))
+            exit(1)
+        name = config.get('name')
+        if name is None or name in names or (args.config and not name):
+            LOG.critical('Every bot in %s needs a different name.', args.config)
+            exit(1)
+        names.add(name)
+        if args.config and not config.get('token'):
+            LOG.critical('No telegram bot token provided for bot %s.', name)
+            exit(1)
+
+        bot_args = argparse.Namespace(**dict(vars(args), **config))
+        # Stats and exports cover every hosted bot, only the global admin is sent them
+        bot_args.host_admin = args.admin
+        if 'catalog_name' not in config and args.config:
+            bot_args.catalog_name = name
+        if bot_args.catalog_snapshot is None:
+            bot_args.catalog_snapshot = bot_args.data + '.snapshot'
+        # Bots sharing the data file or the global snapshot path don't overwrite each other's snapshot
+        if args.config and config.get('catalog_snapshot') is None and bot_args.catalog_snapshot:
+            bot_args.catalog_snapshot += '.' + name
+        if args.config and 'webhook_path' not in config:
+            bot_args.webhook_path = '/' + name
+            if 'webhook_url' not in config and args.webhook_url:
+                bot_args.webhook_url = args.webhook_url.rstrip('/') + bot_args.webhook_path
+        hosted.append(bot_args)
+
+    if len({bot_args.webhook_path for bot_args in hosted}) < len(hosted):
+        LOG.critical('Every bot needs a different webhook path.')
+        exit(1)
+    return hosted
+
+
+def setup(arguments, telegram_bot=None, stopwatch=None):
+    """
+    Builds the bots and everything they share. Handlers are only usable after calling it. telegram_bot replaces the
+    telebot bot of a single bot deployment.
+    """
+    global args, database, history, retention, recorder, bots
+    args = arguments
+    stopwatch = stopwatch or metrics.Stopwatch()
+    setup_logging()
+
+    LOG.info('Starting up bot...')
+    load_dependencies()
+    stopwatch.lap('imports')
+
+    for bot_args in args.bots:
+        if bot_args.page_size is None:
+            bot_args.page_size = DEFAULT_PAGE_SIZE
+        if not 1 <= bot_args.page_size <= MAX_PAGE_SIZE:
+            LOG.critical('Page size must be between 1 and %d.', MAX_PAGE_SIZE)
+            exit(1)
+
+    if args.mysql_host:
+        LOG.info('Using MySQL as persistence layer: host %s port %s', args.mysql_host, args.mysql_port)
+        # TODO: Pony migration
+    else:
+        LOG.info('Using SQLite as persistence layer: %s', args.sqlite)
+        sqlite_file, sqlite_options = parse_sqlite_path(args.sqlite)
+        database = Database('sqlite', filename=sqlite_file, sqlite_options=sqlite_options)
+    metrics.instrument(database, 'bot_database', 'Database method latency.', label='method')
+    stopwatch.lap('database')
+
+    if not args.history_spill_file:
+        # In the directory of the database, the /data volume of the container, so spilled events survive a restart
+        args.history_spill_file = os.path.join(os.path.dirname(parse_sqlite_path(args.sqlite)[0] or args.data),
+                                               'history.spill')
     try:
-        database.add_query(query)
-    except Exception as e:
-        LOG.error("Couldn't save query" + str(e), e)
-
-
-def synchronize_sounds():
-    db_sounds = database.get_sounds()
-    LOG.debug("Sounds in db (%d)", len(db_sounds))
-
-    b_data_json = open(args.data).read()
-    data_json = json.loads(b_data_json)
-
-    json_sounds = data_json["sounds"]
-    LOG.debug("Sounds in data.json (%d)", len(json_sounds))
-
-    # Adding new sounds to db
-    for jsound in json_sounds:
-        query = database.get_sound(filename=jsound["filename"])
-        if not query:
-            jsound["id"] = ''.join(random.choices(string.digits, k=8))
-            database.add_sound(jsound["id"], jsound["filename"], jsound["text"], jsound["tags"])
-
-    # Removing deleted sounds form db
-    db_sounds = database.get_sounds()
-    for db_sound in db_sounds:
-        found = None
-        for jsound in json_sounds:
-            if jsound["filename"] == db_sound["filename"]:
-                found = jsound
-                break
-        if not found:
-            database.delete_sound(db_sound)
-            db_sounds.remove(db_sound)
-
-    return db_sounds
-
-
-# ADMIN COMMANDS
-
-def message_is_from_admin(message):
-    from_user = message.from_user
-    return from_user.username == args.admin
-
-
-@bot.message_handler(commands=['stats'], func=lambda message: message_is_from_admin(message))
-def send_stats(message):
-    LOG.debug(message)
-    cid = message.chat.id
-    uptime = PrettyUptime.get_pretty_python_uptime(custom_name='Bot')
-    users = database.get_users()
-    queries = database.get_queries()
-    results = database.get_results()
-    bot.send_message(cid,
-                     '🤖 {uptime}\n'
-                     '*All time stats:*\n'
-                     '👥 Users: {num_users}\n'
-                     '🔎 Queries: {num_queries}\n'
-                     '🔊 Results: {num_results}\n'.format(num_users=len(users),
-                                                         num_queries=len(queries),
-                                                         num_results=len(results),
-                                                         uptime=uptime), parse_mode='Markdown')
-
-
-@bot.message_handler(commands=['uptime'], func=lambda message: message_is_from_admin(message))
-def send_uptime(message):
-    LOG.debug(message)
-    cid = message.chat.id
-    py_uptime = PrettyUptime.get_pretty_python_uptime(custom_name='Bot')
-    machine_uptime = PrettyUptime.get_pretty_machine_uptime_string()
-    machine_info = PrettyUptime.get_pretty_machine_info()
-    bot.send_message(cid,
-                     '💻 {machine_info}\n'
-                     '⌛ {machine_uptime}\n'
-                     '🤖 {py_uptime}\n'
-                     .format(machine_info=machine_info, machine_uptime=machine_uptime, py_uptime=py_uptime))
-
-
-sounds = synchronize_sounds()
-LOG.info('Serving %i sounds.', len(sounds))
-
-while True:
+        history = HistoryWriter(database, max_size=args.history_queue_size, batch_size=args.history_batch_size,
+                                flush_interval=args.history_flush_interval, overflow=args.history_overflow,
+                                spill_file=args.history_spill_file).start()
+        if args.retention_days:
+            retention = Retention(database, args.retention_days, batch_size=args.retention_batch_size)
+    except ValueError as e:
+        LOG.critical(str(e))
+        exit(1)
+    stopwatch.lap('history')
+
+    if args.record_updates:
+        recorder = UpdateRecorder(args.record_updates, anonymize=args.record_anonymize).start()
+    bots = [SoundBot(bot_args, database, history, telegram_bot=telegram_bot if len(args.bots) == 1 else None,
+                     name=bot_args.name, recorder=recorder) for bot_args in args.bots]
+    for sound_bot in bots:
+        sound_bot.hosted = bots
+    stopwatch.lap('bots')
+    for sound_bot in bots:
+        sound_bot.reload_catalog(use_snapshot=True)
+    stopwatch.lap('catalog')
+    register_gauges()
+    LOG.info('Started up %d bots in %.0f ms: %s.', len(bots), stopwatch.total * 1000, stopwatch)
+    metrics.REGISTRY.gauge('bot_startup_seconds', 'Seconds the start up took.', lambda: stopwatch.total)
+
+
+def setup_logging():
+    if args.logfile:
+        logger.add_file_handler(args.logfile, args.verbosity)
+    logger.set_log_level(args.verbosity)
+    if args.log_format == 'json':
+        logger.set_formatter(logger.JsonFormatter())
     try:
-        sleep(1)
-        LOG.debug("Polling started")
-        bot.polling()
-    except requests.exceptions.ConnectionError as connection_error:
-        LOG.error("ConnectionError: Cannot connect to server.")
-        LOG.debug(connection_error)
-    except requests.exceptions.ReadTimeout as read_timeout:
-        LOG.error("ReadTimeout: Lost connection to the server.")
-        LOG.debug(read_timeout)
-    except Exception as e:
-        LOG.critical(e)
-        raise e
+        for option, limit, parse in ((args.log_sample, logger.sample, int),
+                                     (args.log_rate_limit, logger.rate_limit, float)):
+            for name, value in (entry.rsplit('=', 1) for entry in option):
+                if parse(value) <= 0:
+                    raise ValueError(value)
+                limit(name, parse(value))
+    except ValueError:
+        LOG.critical('Log sampling and rate limits must be given as LOGGER=N, with N greater than 0.')
+        exit(1)
+    if args.log_queue_size > 0:
+        logger.start_async(args.log_queue_size)
+
+
+def register_gauges():
+    registry = metrics.REGISTRY
+    registry.gauge('bot_log_records_pending', 'Log records waiting to be written.', logger.pending)
+    registry.gauge('bot_log_records_dropped', 'Log records dropped because the writer fell behind.', logger.dropped)
+    registry.gauge('process_resident_memory_bytes', 'Resident memory size in bytes.', PrettyUptime.get_resident_memory)
+    registry.gauge('process_cpu_seconds_total', 'User and system CPU time in seconds.', PrettyUptime.get_cpu_seconds)
+    registry.gauge('process_threads', 'Threads running.', threading.active_count)
+    registry.gauge('bot_history_pending', 'History events waiting to be written.', history.pending)
+    for key in ('written', 'dropped', 'spilled', 'failed'):
+        registry.gauge('bot_history_events_' + key, 'History events ' + key + '.',
+                       lambda key=key: getattr(history, key))
+    if recorder is not None:
+        for key in ('recorded', 'dropped'):
+            registry.gauge('bot_updates_' + key, 'Updates ' + key + ' by the update recorder.',
+                           lambda key=key: getattr(recorder, key))
+
+
+def run_webhook(workers):
+    server = WebhookServer(host=args.webhook_listen, port=args.webhook_port, certificate=args.webhook_cert,
+                           private_key=args.webhook_key, pool=workers)
+    for sound_bot in bots:
+        bot_args = sound_bot.args
+        server.add_route(bot_args.webhook_path, sound_bot.process_update, bot_args.webhook_secret,
+                         on_receive=sound_bot.receive)
+        sound_bot.bot.remove_webhook()
+        sound_bot.bot.set_webhook(url=bot_args.webhook_url, secret_token=bot_args.webhook_secret,
+                                  certificate=open(args.webhook_cert) if args.webhook_cert else None,
+                                  max_connections=min(100, args.workers + args.webhook_queue_size),
+                                  allowed_updates=['message', 'inline_query', 'chosen_inline_result'])
+    server.serve_forever()
+
+
+def run_polling(workers):
+    pollers = [Poller(sound_bot.bot, workers, name=('Poller ' + sound_bot.name).strip(),
+                      on_receive=sound_bot.receive).start() for sound_bot in bots]
+    for poller in pollers:
+        poller.join()
+
+
+def main(argv=None):
+    stopwatch = metrics.Stopwatch()
+    setup(parse_args(argv), stopwatch=stopwatch)
+    atexit.register(history.close)
+    for sound_bot in bots:
+        # Registered after history.close so pending queries are recorded before it
+        atexit.register(sound_bot.coalescer.stop)
+    if recorder is not None:
+        atexit.register(recorder.close)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if retention is not None:
+        retention.start(args.retention_interval)
+    if args.metrics_port:
+        metrics.MetricsServer(host=args.metrics_listen, port=args.metrics_port).start()
+    for sound_bot in bots:
+        if sound_bot.args.watch_interval > 0:
+            FileWatcher(sound_bot.args.data, sound_bot.reload_catalog, interval=sound_bot.args.watch_interval).start()
+
+    # Every bot shares the same update workers
+    workers = UpdateWorkers(args.workers, args.webhook_queue_size)
+    if args.mode == 'webhook':
+        run_webhook(workers)
+    else:
+        run_polling(workers)
+
+
+if __name__ == '__main__':
+    main()
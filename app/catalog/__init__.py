@@ -0,0 +1,111 @@
+"""
+In memory sound catalog: search index and inline results prepared once per catalog load.
+"""
+
+import itertools
+import logging
+import telebot.types as types
+from .cache import LRUCache
+from .pages import DEFAULT_PAGE_SIZE, LazySequence, page, parse_offset
+from .popularity import Popularity
+from .recommendations import Recommendations
+from .search import SearchIndex, tokenize
+from .uploader import VoiceUploader
+from .watcher import FileWatcher
+
+LOG = logging.getLogger('LaVidaModerna_Bot.catalog')
+
+DEFAULT_CACHE_SIZE = 1024
+# Long enough for a user to scroll through the pages of a query
+DEFAULT_CACHE_TTL = 10 * 60
+RECENT_PREFIX = '🕚 '
+
+
+class PreparedResult(types.JsonSerializable):
+    """Inline result serialized once. Telebot only concatenates to_json() outputs when answering a query."""
+
+    def __init__(self, result):
+        self.result = result
+        self.json = result.to_json()
+
+    def to_json(self):
+        return self.json
+
+
+def build_voice_result(sound, bucket, title_prefix=''):
+    """Result of a voice already uploaded to Telegram when its file_id is known, of its bucket url otherwise."""
+    if sound.get("file_id"):
+        return types.InlineQueryResultCachedVoice(
+            sound["id"], sound["file_id"], title_prefix + sound["text"], caption=sound["text"])
+    return types.InlineQueryResultVoice(
+        sound["id"], bucket + sound["filename"], title_prefix + sound["text"], caption=sound["text"],
+        voice_duration=int(round(sound["duration"])) if sound.get("duration") else None)
+
+
+class Catalog:
+
+    def __init__(self, sounds, bucket, cache_size=DEFAULT_CACHE_SIZE, cache_ttl=DEFAULT_CACHE_TTL):
+        self.sounds = list(sounds)
+        self.bucket = bucket
+        self.by_id = {sound["id"]: sound for sound in self.sounds}
+        self.index = SearchIndex(self.sounds)
+        self.results = {sound["id"]: PreparedResult(build_voice_result(sound, bucket))
+                        for sound in self.sounds}
+        self.recent_results = {sound["id"]: PreparedResult(build_voice_result(sound, bucket, RECENT_PREFIX))
+                               for sound in self.sounds}
+        self.cache = LRUCache(cache_size, ttl=cache_ttl)
+        LOG.debug("Prepared %d inline results.", len(self.results))
+
+    def __len__(self):
+        return len(self.sounds)
+
+    def __getstate__(self):
+        # Cached query results are not worth keeping
+        state = dict(self.__dict__)
+        state['cache'] = (self.cache.max_size, self.cache.ttl)
+        return state
+
+    def __setstate__(self, state):
+        max_size, ttl = state.pop('cache')
+        self.__dict__.update(state)
+        self.cache = LRUCache(max_size, ttl=ttl)
+
+    def ranked(self, text):
+        """LazySequence of the ranked prepared results for text, shared by every query normalized like it."""
+        key = ' '.join(tokenize(text))
+        results = self.cache.get(key)
+        if results is None:
+            results = LazySequence(self.results[sound["id"]] for sound in self.index.ranked(key))
+            self.cache.put(key, results)
+        return results
+
+    def query(self, text, limit):
+        """Up to limit ranked prepared results for text."""
+        return self.ranked(text).slice(0, limit)
+
+    def query_page(self, text, offset=0, size=DEFAULT_PAGE_SIZE):
+        """(page of prepared results, next_offset) for text starting at offset."""
+        return page(self.ranked(text).slice(offset, offset + size + 1), offset, size)
+
+    def default_results(self, recent_ids, limit, popular_ids=()):
+        """Prepared results for the empty query: recently used sounds, then the popular ones, then the catalog."""
+        return list(itertools.islice(self._default_results(recent_ids, popular_ids), limit))
+
+    def default_page(self, recent_ids, offset=0, size=DEFAULT_PAGE_SIZE, popular_ids=()):
+        """(page of default_results, next_offset) starting at offset."""
+        return page(list(itertools.islice(self._default_results(recent_ids, popular_ids), offset, offset + size + 1)),
+                    offset, size)
+
+    def _default_results(self, recent_ids, popular_ids):
+        shown = set()
+        for sound_id in recent_ids:
+            if sound_id in self.recent_results and sound_id not in shown:
+                shown.add(sound_id)
+                yield self.recent_results[sound_id]
+        for sound_id in popular_ids:
+            if sound_id in self.results and sound_id not in shown:
+                shown.add(sound_id)
+                yield self.results[sound_id]
+        for sound in self.sounds:
+            if sound["id"] not in shown:
+                yield self.results[sound["id"]]
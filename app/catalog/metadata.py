@@ -0,0 +1,193 @@
+"""
+Catalog build tool: reads the Ogg/Opus headers of the sounds, checks them against the encoding described in the
+README and stores their duration, sample rate, channels and size in data.json, from where they reach the Sound
+entity on the next synchronization.
+
+    python -m app.catalog.metadata --data app/data.json --sounds-dir LaVidaModerna [--check]
+
+Run from the repository root, so it can share the METADATA_FIELDS of persistence.sync.
+
+Files are memory mapped, only their first pages and the last one are read, and they are parsed in a process pool.
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from ..persistence.sync import METADATA_FIELDS
+
+LOG = logging.getLogger('LaVidaModerna_Bot.catalog.metadata')
+
+CAPTURE_PATTERN = b'OggS'
+# capture pattern, version, header type, granule position, serial number, sequence number, checksum, segments
+PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+# magic, version, channels, pre-skip, input sample rate, output gain, channel mapping family
+OPUS_HEAD = struct.Struct('<8sBBHIhB')
+OPUS_TAGS = b'OpusTags'
+# Opus granule positions always count 48 kHz samples, whatever the input sample rate was
+GRANULE_RATE = 48000
+
+# ffmpeg -i $INPUT -map_metadata -1 -ac 1 -map 0:a -codec:a libopus -b:a 128k -vbr off -ar 48000 $OUTPUT
+SPEC_CHANNELS = 1
+SPEC_SAMPLE_RATE = 48000
+SPEC_BITRATE = 128000
+SPEC_BITRATE_TOLERANCE = 0.1
+SPEC_TAGS = ('encoder',)
+
+AudioMetadata = namedtuple('AudioMetadata', ['filename', 'duration', 'sample_rate', 'channels', 'size', 'bitrate',
+                                             'issues'])
+
+
+class InvalidAudio(ValueError):
+    pass
+
+
+def _page(data, offset):
+    """(header fields, payload offset, next page offset) of the Ogg page starting at offset."""
+    if offset + PAGE_HEADER.size > len(data):
+        raise InvalidAudio('Truncated Ogg page at %d' % offset)
+    header = PAGE_HEADER.unpack_from(data, offset)
+    if header[0] != CAPTURE_PATTERN or header[1] != 0:
+        raise InvalidAudio('No Ogg page at %d' % offset)
+    segments = header[7]
+    payload = offset + PAGE_HEADER.size + segments
+    return header, payload, payload + sum(data[offset + PAGE_HEADER.size:payload])
+
+
+def _last_granule(data, serial):
+    """Granule position of the last page of the stream, found searching the capture pattern backwards."""
+    position = data.rfind(CAPTURE_PATTERN)
+    while position >= 0:
+        try:
+            header, _, _ = _page(data, position)
+            if header[4] == serial and header[3] >= 0:
+                return header[3]
+        except InvalidAudio:
+            pass
+        position = data.rfind(CAPTURE_PATTERN, 0, position)
+    raise InvalidAudio('No final Ogg page')
+
+
+def _tags(data, offset, end):
+    """Field names of the OpusTags user comments, only when the packet fits in its page."""
+    if data[offset:offset + len(OPUS_TAGS)] != OPUS_TAGS:
+        raise InvalidAudio('Missing OpusTags header')
+    offset += len(OPUS_TAGS)
+    vendor_length, = struct.unpack_from('<I', data, offset)
+    offset += 4 + vendor_length
+    count, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    names = []
+    for _ in range(count):
+        if offset + 4 > end:
+            break
+        length, = struct.unpack_from('<I', data, offset)
+        names.append(bytes(data[offset + 4:offset + 4 + length]).split(b'=', 1)[0].decode('utf-8', 'replace').lower())
+        offset += 4 + length
+    return names
+
+
+def parse(data, filename=''):
+    """AudioMetadata of the Ogg/Opus file in data, a bytes-like object."""
+    header, payload, tags_page = _page(data, 0)
+    magic, version, channels, pre_skip, sample_rate, _, _ = OPUS_HEAD.unpack_from(data, payload)
+    if magic != b'OpusHead':
+        raise InvalidAudio('Not an Opus stream')
+    _, tags_payload, audio = _page(data, tags_page)
+    tags = _tags(data, tags_payload, audio)
+
+    duration = max(0, _last_granule(data, header[4]) - pre_skip) / GRANULE_RATE
+    size = len(data)
+    bitrate = (size - audio) * 8 / duration if duration else 0
+
+    issues = []
+    if channels != SPEC_CHANNELS:
+        issues.append('%d channels' % channels)
+    if sample_rate != SPEC_SAMPLE_RATE:
+        issues.append('%d Hz input' % sample_rate)
+    if abs(bitrate - SPEC_BITRATE) > SPEC_BITRATE * SPEC_BITRATE_TOLERANCE:
+        issues.append('%.0f kbps' % (bitrate / 1000))
+    extra_tags = sorted(set(tags) - set(SPEC_TAGS))
+    if extra_tags:
+        issues.append('metadata: ' + ', '.join(extra_tags))
+    return AudioMetadata(filename, round(duration, 3), sample_rate, channels, size, round(bitrate), issues)
+
+
+def read_metadata(path):
+    """AudioMetadata of an Ogg/Opus file, reading it through a memory map."""
+    with open(path, 'rb') as audio_file:
+        if os.fstat(audio_file.fileno()).st_size == 0:
+            raise InvalidAudio('Empty file')
+        with mmap.mmap(audio_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse(data, os.path.basename(path))
+
+
+def _read_or_error(path):
+    try:
+        return read_metadata(path)
+    except (InvalidAudio, OSError, struct.error) as e:
+        return AudioMetadata(os.path.basename(path), None, None, None, None, None, ['unreadable: %s' % e])
+
+
+def read_all(paths, workers=None):
+    """AudioMetadata of every path, in order. Unreadable files are reported as an issue."""
+    paths = list(paths)
+    if workers == 1 or len(paths) < 2:
+        return [_read_or_error(path) for path in paths]
+    chunk_size = max(1, len(paths) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_read_or_error, paths, chunksize=chunk_size))
+
+
+def apply_metadata(sounds, metadata):
+    """Copies the metadata fields of the readable files to their sounds, returns the number of sounds updated."""
+    by_filename = {entry.filename: entry for entry in metadata if entry.duration is not None}
+    updated = 0
+    for sound in sounds:
+        entry = by_filename.get(sound['filename'])
+        if entry is not None:
+            fields = {field: getattr(entry, field) for field in METADATA_FIELDS}
+            if any(sound.get(field) != value for field, value in fields.items()):
+                sound.update(fields)
+                updated += 1
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reads the audio metadata of the sounds into data.json.")
+    parser.add_argument("--data", type=str, help="Data JSON path.", default='data.json')
+    parser.add_argument("--sounds-dir", type=str, help="Directory of the sound files.", required=True)
+    parser.add_argument("--workers", type=int, help="Parsing processes, one per CPU by default.")
+    parser.add_argument("--check", action='store_true', help="Only report, fail if any file is off spec.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    with open(args.data) as data_json_file:
+        data = json.load(data_json_file)
+    sounds = data['sounds']
+    metadata = read_all((os.path.join(args.sounds_dir, sound['filename']) for sound in sounds), args.workers)
+
+    off_spec = [entry for entry in metadata if entry.issues]
+    for entry in off_spec:
+        LOG.warning('%s: %s', entry.filename, '; '.join(entry.issues))
+    LOG.info('%d sounds read, %d off spec, %.1f seconds of audio.', len(metadata), len(off_spec),
+             sum(entry.duration or 0 for entry in metadata))
+
+    if args.check:
+        return 1 if off_spec else 0
+    updated = apply_metadata(sounds, metadata)
+    if updated:
+        with open(args.data, 'w') as data_json_file:
+            json.dump(data, data_json_file, indent=2, ensure_ascii=False)
+            data_json_file.write('\n')
+    LOG.info('%d sounds updated in %s.', updated, args.data)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""
+Inline result pagination: Telegram asks for the next page with the next_offset of the previous answer.
+"""
+
+import threading
+
+DEFAULT_PAGE_SIZE = 20
+# https://core.telegram.org/bots/api#answerinlinequery
+MAX_PAGE_SIZE = 50
+
+
+def parse_offset(offset):
+    """Position of the first result asked for, 0 for the first page and for offsets this bot didn't send."""
+    try:
+        return max(0, int(offset))
+    except (TypeError, ValueError):
+        return 0
+
+
+def page(items, offset, size):
+    """(page, next_offset) from the items starting at offset, which must include one more to know if there is a next."""
+    if len(items) > size:
+        return items[:size], str(offset + size)
+    return items, ''
+
+
+class LazySequence:
+    """Items of an iterator consumed only as far as they are requested, kept for later requests. Thread safe."""
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._items = []
+        self._exhausted = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Items consumed so far."""
+        return len(self._items)
+
+    def slice(self, start, stop):
+        with self._lock:
+            while not self._exhausted and len(self._items) < stop:
+                try:
+                    self._items.append(next(self._iterator))
+                except StopIteration:
+                    self._exhausted = True
+            return self._items[start:stop]
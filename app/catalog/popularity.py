@@ -0,0 +1,89 @@
+"""
+Global popularity of the sounds: use counts decayed exponentially with time, served as a periodically refreshed
+top N snapshot.
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+LOG = logging.getLogger('LaVidaModerna_Bot.catalog.popularity')
+
+DEFAULT_HALF_LIFE = 7 * 24 * 60 * 60
+DEFAULT_TOP_SIZE = 48
+# Scores are kept relative to a reference time and rebased before 2 ** exponent overflows
+_MAX_EXPONENT = 512
+
+
+class Popularity:
+    """
+    Every use adds 2 ** ((t - reference) / half_life) to the score of its sound, reference being the time of the
+    first use seen. Decaying every score by the same factor does not change their order, so scores only grow and are
+    rebased from time to time.
+    """
+
+    def __init__(self, half_life=DEFAULT_HALF_LIFE, top_size=DEFAULT_TOP_SIZE):
+        self.half_life = half_life
+        self.top_size = top_size
+        self._reference = None
+        self._scores = {}
+        self._top = ()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def load(self, uses):
+        """Seeds the scores from (sound_id, epoch, count) tuples."""
+        with self._lock:
+            for sound_id, epoch, count in uses:
+                self._add(sound_id, epoch, count)
+        self.refresh()
+
+    def record(self, sound_id, epoch=None):
+        with self._lock:
+            self._add(sound_id, time.time() if epoch is None else epoch, 1)
+
+    def score(self, sound_id, now=None):
+        """Decayed use count of a sound at now."""
+        now = time.time() if now is None else now
+        with self._lock:
+            if sound_id not in self._scores:
+                return 0
+            return self._scores[sound_id] * 2 ** ((self._reference - now) / self.half_life)
+
+    def top(self):
+        """Sound ids of the last snapshot, most popular first."""
+        return self._top
+
+    def refresh(self):
+        with self._lock:
+            self._top = tuple(heapq.nlargest(self.top_size, self._scores, key=self._scores.__getitem__))
+        LOG.debug('Popularity snapshot refreshed: %d sounds.', len(self._top))
+        return self._top
+
+    def start(self, interval):
+        """Refreshes the snapshot every interval seconds from a background thread."""
+
+        def run():
+            while not self._stopping.wait(interval):
+                self.refresh()
+
+        threading.Thread(target=run, name='Popularity', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+
+    def _add(self, sound_id, epoch, count):
+        if self._reference is None:
+            self._reference = epoch
+        exponent = (epoch - self._reference) / self.half_life
+        if exponent > _MAX_EXPONENT:
+            self._rebase(epoch)
+            exponent = 0
+        self._scores[sound_id] = self._scores.get(sound_id, 0) + count * 2 ** exponent
+
+    def _rebase(self, reference):
+        factor = 2 ** ((self._reference - reference) / self.half_life)
+        self._scores = {sound_id: score * factor for sound_id, score in self._scores.items()}
+        self._reference = reference
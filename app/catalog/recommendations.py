@@ -0,0 +1,213 @@
+"""
+Personalized sound recommendations from the co-usage of sounds: two sounds are related when the same users chose
+both. The co-usage matrix is built with NumPy from the sounds every user chose and rebuilt periodically, while the
+sounds of a user are updated on every chosen result.
+"""
+
+import heapq
+import logging
+import threading
+import numpy
+from .cache import LRUCache
+
+LOG = logging.getLogger('LaVidaModerna_Bot.catalog.recommendations')
+
+DEFAULT_TOP_SIZE = 48
+DEFAULT_NEIGHBORS = 32
+# Bounds the pairs of sounds of a single user, their number grows with its square
+DEFAULT_MAX_USER_SOUNDS = 64
+# Bounds the pairs of sounds built at once, users are paired in chunks whose counts are then merged
+DEFAULT_CHUNK_PAIRS = 1 << 20
+DEFAULT_CACHE_SIZE = 10000
+
+
+class CoUsageModel:
+    """
+    Sparse sound by sound co-usage matrix kept as the neighbors most related to every sound. Sounds are numbered by
+    their position in sound_ids, and neighbors[i] holds the numbers of the sounds most related to sound i, padded
+    with len(sound_ids), with their cosine similarity in weights[i].
+    """
+
+    def __init__(self, sound_ids, neighbors, weights):
+        self.sound_ids = sound_ids
+        self.neighbors = neighbors
+        self.weights = weights
+        self.index = {sound_id: position for position, sound_id in enumerate(sound_ids.tolist())}
+
+    def __len__(self):
+        return len(self.sound_ids)
+
+    @classmethod
+    def build(cls, users, neighbors=DEFAULT_NEIGHBORS, max_user_sounds=DEFAULT_MAX_USER_SOUNDS,
+              chunk_pairs=DEFAULT_CHUNK_PAIRS):
+        """Model of users, a mapping of user ids to {sound id: uses}."""
+        sound_ids = numpy.array(sorted({sound_id for uses in users.values() for sound_id in uses}), dtype=numpy.int64)
+        size = len(sound_ids)
+        if not size:
+            return cls(sound_ids, numpy.zeros((0, neighbors), dtype=numpy.int64),
+                       numpy.zeros((0, neighbors), dtype=numpy.float32))
+
+        # (user, sound) entries grouped by user, the most used sounds of every user only
+        chosen = [heapq.nlargest(max_user_sounds, uses, key=uses.__getitem__) for uses in users.values() if uses]
+        counts = numpy.fromiter((len(sounds) for sounds in chosen), dtype=numpy.int64, count=len(chosen))
+        sounds = numpy.searchsorted(sound_ids, numpy.fromiter((sound_id for user_sounds in chosen
+                                                               for sound_id in user_sounds),
+                                                              dtype=numpy.int64, count=int(counts.sum())))
+        offsets = numpy.concatenate(([0], numpy.cumsum(counts)))
+
+        # Users of every pair of different sounds, counted a chunk of users at a time
+        merged = [(numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64))]
+        unmerged = 0
+        for first, last in _chunks(counts * counts, chunk_pairs):
+            merged.append(_pairs(sounds[offsets[first]:offsets[last]], counts[first:last], size))
+            unmerged += len(merged[-1][0])
+            # Merged once the chunks outgrow the counts merged so far, not after every chunk
+            if unmerged > len(merged[0][0]):
+                merged, unmerged = [_merge(merged)], 0
+        keys, co_users = _merge(merged)
+        lower, upper = numpy.divmod(keys, size)
+        rows, columns = numpy.concatenate((lower, upper)), numpy.concatenate((upper, lower))
+        co_users = numpy.concatenate((co_users, co_users))
+
+        # Cosine similarity of the sets of users of both sounds
+        users_per_sound = numpy.bincount(sounds, minlength=size)
+        similarity = co_users / numpy.sqrt(users_per_sound[rows] * users_per_sound[columns])
+
+        # Most similar neighbors of every row
+        order = numpy.lexsort((-similarity, rows))
+        rows, columns, similarity = rows[order], columns[order], similarity[order]
+        row_starts = numpy.searchsorted(rows, numpy.arange(size))
+        ranks = numpy.arange(len(rows)) - row_starts[rows]
+        kept = ranks < neighbors
+        neighbor_matrix = numpy.full((size, neighbors), size, dtype=numpy.int64)
+        weight_matrix = numpy.zeros((size, neighbors), dtype=numpy.float32)
+        neighbor_matrix[rows[kept], ranks[kept]] = columns[kept]
+        weight_matrix[rows[kept], ranks[kept]] = similarity[kept]
+        return cls(sound_ids, neighbor_matrix, weight_matrix)
+
+    def recommend(self, uses, top_size=DEFAULT_TOP_SIZE):
+        """Sound ids most related to the ones in uses, a {sound id: uses} mapping, best first, but for those."""
+        known = [(self.index[sound_id], count) for sound_id, count in uses.items() if sound_id in self.index]
+        if not known:
+            return ()
+        positions, counts = zip(*known)
+        positions = numpy.array(positions)
+        contributions = self.weights[positions] * numpy.log1p(numpy.array(counts, dtype=numpy.float32))[:, None]
+        candidates, inverse = numpy.unique(self.neighbors[positions], return_inverse=True)
+        scores = numpy.bincount(inverse.ravel(), weights=contributions.ravel())
+        # Neither the padding nor the sounds the user already uses
+        kept = (candidates < len(self.sound_ids)) & ~numpy.isin(candidates, positions)
+        candidates, scores = candidates[kept], scores[kept]
+        if len(scores) > top_size:
+            best = numpy.argpartition(-scores, top_size - 1)[:top_size]
+            candidates, scores = candidates[best], scores[best]
+        order = numpy.argsort(-scores, kind='stable')
+        return tuple(self.sound_ids[candidates[order]].tolist())
+
+
+def _chunks(pairs, max_pairs):
+    """(first, last) ranges of users, given their pairs, with up to max_pairs pairs unless a user has more."""
+    ends = numpy.cumsum(pairs)
+    first = 0
+    while first < len(pairs):
+        before = ends[first - 1] if first else 0
+        last = max(first + 1, int(numpy.searchsorted(ends, before + max_pairs, side='right')))
+        yield first, last
+        first = last
+
+
+def _pairs(sounds, counts, size):
+    """
+    Keys, lower * size + upper, of the pairs of different sounds chosen by the same user, and how many users chose
+    each, from the sounds chosen by consecutive users and the number chosen by every user.
+    """
+    starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    group_sizes = numpy.repeat(counts, counts)
+    left = numpy.repeat(numpy.arange(len(sounds)), group_sizes)
+    pair_starts = numpy.cumsum(group_sizes) - group_sizes
+    right = starts[left] + numpy.arange(len(left)) - pair_starts[left]
+    # Each pair once, a sound only appears once among the sounds of a user
+    once = left < right
+    left, right = sounds[left[once]], sounds[right[once]]
+    return numpy.unique(numpy.minimum(left, right) * size + numpy.maximum(left, right), return_counts=True)
+
+
+def _merge(counted):
+    """Single (keys, counts) of a list of (keys, counts) adding up the counts of equal keys."""
+    if len(counted) == 1:
+        return counted[0]
+    keys = numpy.concatenate([keys for keys, _ in counted])
+    counts = numpy.concatenate([counts for _, counts in counted])
+    if not len(keys):
+        return keys, counts
+    order = numpy.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order]
+    starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], numpy.add.reduceat(counts, starts)
+
+
+class Recommendations:
+    """
+    Sounds recommended to every user, computed from a CoUsageModel and cached until the user chooses a result or the
+    model is rebuilt. Chosen results update the sounds of their user right away and the model on the next rebuild.
+    """
+
+    def __init__(self, top_size=DEFAULT_TOP_SIZE, neighbors=DEFAULT_NEIGHBORS,
+                 max_user_sounds=DEFAULT_MAX_USER_SOUNDS, cache_size=DEFAULT_CACHE_SIZE):
+        self.top_size = top_size
+        self.neighbors = neighbors
+        self.max_user_sounds = max_user_sounds
+        self.cache = LRUCache(cache_size)
+        self.model = CoUsageModel.build({}, neighbors)
+        self._users = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def __len__(self):
+        return len(self._users)
+
+    def load(self, uses):
+        """Seeds the sounds of the users from (user_id, sound_id, count) tuples and builds the model."""
+        with self._lock:
+            for user_id, sound_id, count in uses:
+                user_uses = self._users.setdefault(user_id, {})
+                user_uses[sound_id] = user_uses.get(sound_id, 0) + count
+        return self.rebuild()
+
+    def record(self, user_id, sound_id):
+        with self._lock:
+            user_uses = self._users.setdefault(user_id, {})
+            user_uses[sound_id] = user_uses.get(sound_id, 0) + 1
+        self.cache.pop(user_id)
+
+    def recommend(self, user_id):
+        """Sound ids recommended to a user, best first."""
+        recommended = self.cache.get(user_id)
+        if recommended is None:
+            with self._lock:
+                uses = dict(self._users.get(user_id, ()))
+            recommended = self.model.recommend(uses, self.top_size)
+            self.cache.put(user_id, recommended)
+        return recommended
+
+    def rebuild(self):
+        """Builds the model again from the sounds chosen so far."""
+        with self._lock:
+            users = {user_id: dict(uses) for user_id, uses in self._users.items()}
+        self.model = CoUsageModel.build(users, self.neighbors, self.max_user_sounds)
+        self.cache.clear()
+        LOG.debug('Recommendations rebuilt: %d sounds of %d users.', len(self.model), len(users))
+        return self.model
+
+    def start(self, interval):
+        """Rebuilds the model every interval seconds from a background thread."""
+
+        def run():
+            while not self._stopping.wait(interval):
+                self.rebuild()
+
+        threading.Thread(target=run, name='Recommendations', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
@@ -0,0 +1,110 @@
+"""
+Inverted index over the tags of the sound catalog used to answer inline text queries.
+"""
+
+import heapq
+import itertools
+import logging
+import string
+import unidecode
+
+LOG = logging.getLogger('LaVidaModerna_Bot.catalog.search')
+
+NGRAM_SIZE = 3
+
+# Match kinds, higher is better
+SUBSTRING_MATCH = 1
+PREFIX_MATCH = 2
+WORD_MATCH = 3
+
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+
+def tokenize(text):
+    """Normalizes text the same way for sounds and queries: ascii, lowercase, no punctuation, split on whitespace."""
+    text = unidecode.unidecode(text).lower().translate(_PUNCTUATION_TABLE)
+    return text.split()
+
+
+def _ngrams(token, max_size=NGRAM_SIZE):
+    for size in range(1, min(max_size, len(token)) + 1):
+        for start in range(len(token) - size + 1):
+            yield token[start:start + size]
+
+
+class SearchIndex:
+
+    def __init__(self, sounds):
+        self.sounds = list(sounds)
+        # token -> positions of the sounds tagged with it, in catalog order
+        self._postings = {}
+        for position, sound in enumerate(self.sounds):
+            for token in dict.fromkeys(tokenize(sound["tags"])):
+                self._postings.setdefault(token, []).append(position)
+        # n-gram -> tokens containing it, covers every fragment up to NGRAM_SIZE characters
+        self._ngrams = {}
+        for token in self._postings:
+            for gram in set(_ngrams(token)):
+                self._ngrams.setdefault(gram, set()).add(token)
+        LOG.debug("Indexed %d sounds: %d tokens, %d n-grams", len(self.sounds), len(self._postings),
+                  len(self._ngrams))
+
+    def __len__(self):
+        return len(self.sounds)
+
+    def match_tokens(self, fragment):
+        """Returns a dict of indexed tokens containing fragment and how they match it."""
+        if len(fragment) <= NGRAM_SIZE:
+            candidates = self._ngrams.get(fragment, ())
+        else:
+            gram_sets = []
+            for start in range(len(fragment) - NGRAM_SIZE + 1):
+                tokens = self._ngrams.get(fragment[start:start + NGRAM_SIZE])
+                if not tokens:
+                    return {}
+                gram_sets.append(tokens)
+            gram_sets.sort(key=len)
+            candidates = (token for token in gram_sets[0] if fragment in token)
+
+        matches = {}
+        for token in candidates:
+            if token == fragment:
+                matches[token] = WORD_MATCH
+            elif token.startswith(fragment):
+                matches[token] = PREFIX_MATCH
+            else:
+                matches[token] = SUBSTRING_MATCH
+        return matches
+
+    def ranked(self, text):
+        """
+        Iterator over the sounds matching every word of text, best first. Whole word matches rank before prefix
+        matches and those before substring matches, ties keep catalog order. Only the consumed sounds are sorted.
+        """
+        scores = self._scores(text)
+        heap = [(-score, position) for position, score in scores.items()]
+        heapq.heapify(heap)
+        while heap:
+            yield self.sounds[heapq.heappop(heap)[1]]
+
+    def search(self, text, limit=None):
+        """Returns up to limit sounds matching every word of text, ranked like ranked()."""
+        return list(itertools.islice(self.ranked(text), limit))
+
+    def _scores(self, text):
+        """Catalog position -> summed match kinds of the sounds matching every word of text."""
+        scores = None
+        for fragment in dict.fromkeys(tokenize(text)):
+            fragment_scores = {}
+            for token, kind in self.match_tokens(fragment).items():
+                for position in self._postings[token]:
+                    if fragment_scores.get(position, 0) < kind:
+                        fragment_scores[position] = kind
+            if scores is None:
+                scores = fragment_scores
+            else:
+                scores = {position: score + fragment_scores[position]
+                          for position, score in scores.items() if position in fragment_scores}
+            if not scores:
+                return {}
+        return scores or {}
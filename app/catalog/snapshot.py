@@ -0,0 +1,58 @@
+"""
+On-disk snapshot of a built Catalog: sounds, search index and serialized inline results, pickled together with the
+version of the data.json, bucket and database sounds it was built from. Loading it replaces the sounds
+synchronization and the index build when none of them changed since it was written.
+"""
+
+import gc
+import hashlib
+import logging
+import os
+import pickle
+
+LOG = logging.getLogger('LaVidaModerna_Bot.catalog.snapshot')
+
+# Bumped whenever the pickled classes change
+SNAPSHOT_FORMAT = 1
+
+
+def data_version(data_path, *parts):
+    """Hash of the data.json contents and anything else the catalog was built from, like the bucket."""
+    digest = hashlib.sha1()
+    with open(data_path, 'rb') as data_file:
+        digest.update(data_file.read())
+    for part in parts:
+        digest.update(b'\0' + str(part).encode('utf-8'))
+    return '%d-%s' % (SNAPSHOT_FORMAT, digest.hexdigest())
+
+
+def save(catalog, path, version):
+    """Writes the snapshot atomically, a failed write only costs a rebuild on the next start."""
+    temporary = path + '.tmp'
+    try:
+        with open(temporary, 'wb') as snapshot_file:
+            pickle.dump((version, catalog), snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        LOG.debug('Catalog snapshot written to %s', path)
+    except OSError as e:
+        LOG.warning("Couldn't write catalog snapshot %s: %s", path, str(e))
+
+
+def load(path, version):
+    """The Catalog of the snapshot if it was built from version, None otherwise."""
+    # Unpickling allocates the whole catalog at once, collecting meanwhile only slows it down
+    gc.disable()
+    try:
+        with open(path, 'rb') as snapshot_file:
+            snapshot_version, catalog = pickle.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        LOG.warning("Couldn't read catalog snapshot %s: %s", path, str(e))
+        return None
+    finally:
+        gc.enable()
+    if snapshot_version != version:
+        LOG.info('Catalog snapshot %s is outdated.', path)
+        return None
+    return catalog
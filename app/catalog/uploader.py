@@ -0,0 +1,138 @@
+"""
+Warm-up of the Telegram file_id cache: sounds without a file_id, or whose local file changed since it was uploaded,
+are sent once to an upload chat so their inline results can reference the stored voice instead of the bucket url.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+LOG = logging.getLogger('LaVidaModerna_Bot.catalog.uploader')
+
+DEFAULT_PAUSE = 1.0
+DOWNLOAD_TIMEOUT = 30
+
+
+def file_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class VoiceUploader:
+    """
+    store(sound_id, file_id, file_hash) persists every upload. Sounds are read from sounds_dir when given, which also
+    allows detecting replaced files, otherwise they are downloaded from the bucket.
+    """
+
+    def __init__(self, bot, chat_id, store, bucket, sounds_dir=None, pause=DEFAULT_PAUSE):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.store = store
+        self.bucket = bucket
+        self.sounds_dir = sounds_dir
+        self.pause = pause
+        self.uploaded = 0
+        self.failed = 0
+        self._queued = None
+        self._running = False
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def read(self, sound):
+        if self.sounds_dir:
+            with open(os.path.join(self.sounds_dir, sound['filename']), 'rb') as sound_file:
+                return sound_file.read()
+        response = requests.get(self.bucket + sound['filename'], timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+
+    def pending(self, sounds):
+        """(sound, data) of the sounds to upload, data being None when it hasn't been read yet."""
+        pending = []
+        for sound in sounds:
+            if not sound.get('file_id'):
+                pending.append((sound, None))
+            elif self.sounds_dir:
+                try:
+                    data = self.read(sound)
+                except OSError as e:
+                    LOG.warning("Couldn't read %s: %s", sound['filename'], str(e))
+                    continue
+                if file_hash(data) != sound.get('file_hash'):
+                    pending.append((sound, data))
+        return pending
+
+    def upload(self, sound, data=None):
+        """Sends the sound to the upload chat and stores its file_id, which is returned."""
+        data = self.read(sound) if data is None else data
+        try:
+            message = self.bot.send_voice(self.chat_id, data)
+        except ApiTelegramException as e:
+            if e.error_code != 429:
+                raise
+            retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+            LOG.info('Upload rate limited, retrying in %s seconds.', retry_after)
+            self._stopping.wait(retry_after)
+            message = self.bot.send_voice(self.chat_id, data)
+        file_id = message.voice.file_id
+        self.store(sound['id'], file_id, file_hash(data))
+        try:
+            self.bot.delete_message(self.chat_id, message.message_id)
+        except Exception as e:
+            LOG.debug("Couldn't delete upload message: %s", str(e))
+        return file_id
+
+    def warm_up(self, sounds):
+        """Uploads every pending sound, pausing between uploads. Returns the number of sounds uploaded."""
+        pending = self.pending(sounds)
+        if not pending:
+            return 0
+        LOG.info('Uploading %d sounds to Telegram.', len(pending))
+        started = time.time()
+        uploaded = 0
+        for position, (sound, data) in enumerate(pending):
+            if self._stopping.is_set():
+                break
+            if position:
+                self._stopping.wait(self.pause)
+            try:
+                self.upload(sound, data)
+                uploaded += 1
+            except Exception as e:
+                self.failed += 1
+                LOG.error("Couldn't upload %s: %s", sound['filename'], str(e))
+        self.uploaded += uploaded
+        LOG.info('Uploaded %d of %d sounds in %.1f seconds.', uploaded, len(pending), time.time() - started)
+        return uploaded
+
+    def start(self, sounds, on_done=None):
+        """
+        Warms up sounds from a background thread, then calls on_done(uploaded) if anything was uploaded. Sounds given
+        while a warm-up is running are warmed up right after it, only the last ones given are kept.
+        """
+        with self._lock:
+            self._queued = (list(sounds), on_done)
+            if self._running:
+                return self
+            self._running = True
+        threading.Thread(target=self._run, name='VoiceUploader', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._queued is None or self._stopping.is_set():
+                    self._running = False
+                    return
+                sounds, on_done = self._queued
+                self._queued = None
+            uploaded = self.warm_up(sounds)
+            if uploaded and on_done is not None:
+                on_done(uploaded)
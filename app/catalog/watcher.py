@@ -0,0 +1,53 @@
+import logging
+import os
+import threading
+
+LOG = logging.getLogger('LaVidaModerna_Bot.catalog.watcher')
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher:
+    """Calls on_change() from a background thread whenever the mtime or size of path changes."""
+
+    def __init__(self, path, on_change, interval=10):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._signature = _signature(path)
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='FileWatcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def check(self):
+        """Returns whether the file changed since the last check, calling on_change() if so."""
+        signature = _signature(self.path)
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        LOG.info('%s changed, reloading.', self.path)
+        try:
+            self.on_change()
+        except Exception as e:
+            LOG.error("Couldn't reload %s: %s", self.path, str(e))
+        return True
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.check()
@@ -0,0 +1,167 @@
+"""
+Per user coalescing of the inline queries Telegram sends on almost every keystroke. Queries are registered as they
+are received, before waiting for a worker, so a handler can tell when the user already typed a newer one and skip
+it. Only the last query of a burst, the one not followed by another of the same user within the window, is recorded.
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+LOG = logging.getLogger('LaVidaModerna_Bot.coalescing')
+
+DEFAULT_WINDOW = 1.0
+
+
+def inline_query_of(update):
+    """(user id, inline query id) of a received update, as a dict or as a telebot Update, None for other updates."""
+    if isinstance(update, dict):
+        inline_query = update.get('inline_query')
+        return (inline_query['from']['id'], inline_query['id']) if inline_query else None
+    inline_query = getattr(update, 'inline_query', None)
+    return (inline_query.from_user.id, inline_query.id) if inline_query is not None else None
+
+
+class QueryCoalescer:
+    """
+    Latest inline query received from every user, and the query of each user waiting window seconds to be passed to
+    record(query) unless a newer one replaces it. A window of 0 records every query at once and never skips any.
+    """
+
+    def __init__(self, record, window=DEFAULT_WINDOW):
+        self.record = record
+        self.window = window
+        self.skipped = 0
+        self.coalesced = 0
+        self.recorded = 0
+        # user id -> (inline query id, received time), and the heap of their (received time, user id)
+        self._latest = {}
+        self._received = []
+        # user id -> (inline query, deadline), and the heap of their (deadline, user id)
+        self._pending = {}
+        self._deadlines = []
+        self._lock = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def receive(self, update):
+        """Registers an update as it is received."""
+        if not self.window:
+            return
+        key = inline_query_of(update)
+        if key is not None:
+            received = time.monotonic()
+            with self._lock:
+                self._latest[key[0]] = (key[1], received)
+                heapq.heappush(self._received, (received, key[0]))
+                if len(self._received) == 1:
+                    self._lock.notify()
+
+    def superseded(self, inline_query):
+        """True when a newer query of the same user was received, so answering this one is wasted work."""
+        latest = self._latest.get(inline_query.from_user.id)
+        if latest is not None and latest[0] != inline_query.id:
+            self.skipped += 1
+            return True
+        return False
+
+    def add(self, inline_query):
+        """Records inline_query once window seconds pass without a newer query of its user."""
+        if not self.window:
+            self._record(inline_query)
+            return
+        user_id = inline_query.from_user.id
+        deadline = time.monotonic() + self.window
+        with self._lock:
+            if user_id in self._pending:
+                self.coalesced += 1
+            self._pending[user_id] = (inline_query, deadline)
+            heapq.heappush(self._deadlines, (deadline, user_id))
+            if len(self._deadlines) == 1:
+                self._lock.notify()
+
+    def flush(self, user_id=None):
+        """Records the pending query of a user, or of every user, right away."""
+        with self._lock:
+            if user_id is None:
+                queries = [inline_query for inline_query, _ in self._pending.values()]
+                self._pending.clear()
+                self._deadlines = []
+            else:
+                entry = self._pending.pop(user_id, None)
+                queries = [entry[0]] if entry else []
+        for inline_query in queries:
+            self._record(inline_query)
+
+    def pending(self):
+        return len(self._pending)
+
+    def start(self):
+        if self.window:
+            self._thread = threading.Thread(target=self._run, name='QueryCoalescer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the recording thread and records every pending query."""
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._stopped:
+                    wake = self._next_wake()
+                    if wake is not None and wake <= time.monotonic():
+                        break
+                    self._lock.wait(wake - time.monotonic() if wake is not None else None)
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                self._expire(now)
+                due = self._due(now)
+            for inline_query in due:
+                self._record(inline_query)
+
+    def _next_wake(self):
+        """Earliest pending deadline or expiry of a latest query, None when there is nothing to wait for."""
+        wakes = []
+        if self._deadlines:
+            wakes.append(self._deadlines[0][0])
+        if self._received:
+            wakes.append(self._received[0][0] + self.window)
+        return min(wakes) if wakes else None
+
+    def _expire(self, now):
+        """Forgets the users who stopped typing, whether their query was recorded, flushed or never added."""
+        while self._received and self._received[0][0] <= now - self.window:
+            received, user_id = heapq.heappop(self._received)
+            latest = self._latest.get(user_id)
+            # Newer queries of the user leave their older received times behind
+            if latest is not None and latest[1] == received:
+                del self._latest[user_id]
+
+    def _due(self, now):
+        """Pops the pending queries whose deadline passed."""
+        due = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, user_id = heapq.heappop(self._deadlines)
+            entry = self._pending.get(user_id)
+            # Replaced entries leave their old deadlines behind
+            if entry is not None and entry[1] == deadline:
+                del self._pending[user_id]
+                due.append(entry[0])
+        return due
+
+    def _record(self, inline_query):
+        try:
+            self.record(inline_query)
+            self.recorded += 1
+        except Exception as e:
+            LOG.error("Couldn't record query: %s", e)
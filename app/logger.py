@@ -1,6 +1,14 @@
+import atexit
+import json
 import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
 DEFAULT_LOG_LEVEL = logging.DEBUG
 DEFAULT_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+DEFAULT_QUEUE_SIZE = 10000
 
 # create logger with 'spam_application'
 logger = logging.getLogger('LaVidaModerna_Bot')
@@ -13,13 +21,132 @@ ch.setFormatter(DEFAULT_FORMATTER)
 # add the handlers to the logger
 logger.addHandler(ch)
 
+# Background writer of the handlers once start_async is called
+_async_handler = None
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line with the UTC time, level, logger, thread and message of a record, its exception and the
+    fields passed as extra={'fields': {...}}.
+    """
+
+    def format(self, record):
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + '.%03dZ' % record.msecs,
+                 'level': record.levelname, 'logger': record.name, 'thread': record.threadName,
+                 'message': record.getMessage()}
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class AsyncHandler(QueueHandler):
+    """
+    Queues records for the background writer instead of emitting them on the logging thread. Messages are only
+    formatted by the writer, and records are dropped and counted when the queue is full instead of blocking.
+    """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__(queue.Queue(queue_size))
+        self.dropped = 0
+
+    def prepare(self, record):
+        # QueueHandler formats the message here, on the logging thread. Arguments are formatted later instead, so
+        # they must not be modified after being logged.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+
+    def enqueue_sentinel(self):
+        # The queue may be full, the sentinel must not be dropped
+        self.queue.put(self._sentinel)
+
+
+class SampleFilter(logging.Filter):
+    """Lets one of every `every` records of a logger through. Records above max_level always pass."""
+
+    def __init__(self, every, max_level=logging.INFO):
+        super().__init__()
+        self.every = every
+        self.max_level = max_level
+        self.filtered = 0
+        self._seen = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        with self._lock:
+            self._seen += 1
+            if (self._seen - 1) % self.every:
+                self.filtered += 1
+                return False
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most per_second records of a logger through, in bursts of up to burst. Records above max_level pass."""
+
+    def __init__(self, per_second, burst=None, max_level=logging.INFO):
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst or max(1, per_second)
+        self.max_level = max_level
+        self.filtered = 0
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.per_second)
+            self._last = now
+            if self._tokens < 1:
+                self.filtered += 1
+                return False
+            self._tokens -= 1
+        return True
+
+
+def handlers():
+    """Handlers writing the records, behind the background writer once started."""
+    return list(_listener.handlers) if _listener is not None else list(logger.handlers)
+
+
+def _add_handler(handler):
+    if _listener is not None:
+        _listener.handlers = _listener.handlers + (handler,)
+    else:
+        logger.addHandler(handler)
+
 
 def set_log_level(verbosity):
     numeric_level = get_numeric_log_level(verbosity)
-    for c_logger in logger.handlers:
+    # Records below the level are not even created
+    logger.setLevel(numeric_level)
+    for c_logger in handlers():
         c_logger.setLevel(numeric_level)
 
 
+def set_formatter(formatter):
+    for handler in handlers():
+        handler.setFormatter(formatter)
+
+
 def get_numeric_log_level(verbosity):
     numeric_level = getattr(logging, verbosity.upper(), None)
     if not isinstance(numeric_level, int):
@@ -35,4 +162,56 @@ def add_file_handler(file_path, log_level=DEFAULT_LOG_LEVEL, formatter=DEFAULT_F
     fh = logging.FileHandler(file_path)
     fh.setLevel(log_level)
     fh.setFormatter(formatter)
-    logger.addHandler(fh)
+    _add_handler(fh)
+
+
+def sample(name, every, max_level=logging.INFO):
+    """Keeps one of every `every` records logged by the logger name, up to max_level."""
+    sample_filter = SampleFilter(every, max_level)
+    logging.getLogger(name).addFilter(sample_filter)
+    return sample_filter
+
+
+def rate_limit(name, per_second, burst=None, max_level=logging.INFO):
+    """Keeps at most per_second records logged by the logger name, up to max_level."""
+    rate_limit_filter = RateLimitFilter(per_second, burst, max_level)
+    logging.getLogger(name).addFilter(rate_limit_filter)
+    return rate_limit_filter
+
+
+def start_async(queue_size=DEFAULT_QUEUE_SIZE):
+    """Moves the handlers to a background writer thread fed by an AsyncHandler, which is returned."""
+    global _async_handler, _listener
+    if _async_handler is not None:
+        return _async_handler
+    current = list(logger.handlers)
+    _async_handler = AsyncHandler(queue_size)
+    _listener = _Listener(_async_handler.queue, *current, respect_handler_level=True)
+    _listener.start()
+    logger.addHandler(_async_handler)
+    for handler in current:
+        logger.removeHandler(handler)
+    atexit.register(stop_async)
+    return _async_handler
+
+
+def stop_async():
+    """Writes the records still queued and moves the handlers back to the logger."""
+    global _async_handler, _listener
+    if _async_handler is None:
+        return
+    for handler in _listener.handlers:
+        logger.addHandler(handler)
+    logger.removeHandler(_async_handler)
+    _listener.stop()
+    _async_handler = _listener = None
+
+
+def dropped():
+    """Records dropped because the background writer fell behind."""
+    return _async_handler.dropped if _async_handler is not None else 0
+
+
+def pending():
+    """Records waiting for the background writer."""
+    return _async_handler.queue.qsize() if _async_handler is not None else 0
@@ -0,0 +1,253 @@
+"""
+Low overhead in process metrics: counters, gauges and latency histograms exposed in the Prometheus text format.
+"""
+
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+LOG = logging.getLogger('LaVidaModerna_Bot.metrics')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name + _format_labels(labels), self.value
+
+
+class Gauge:
+    """Value read from a callback when the metrics are collected."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    @property
+    def value(self):
+        return self.callback()
+
+    def samples(self, name, labels):
+        yield name + _format_labels(labels), self.value
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile, None without observations."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield name + '_bucket' + _format_labels(labels, [('le', _format_value(float(bound)))]), cumulative
+        yield name + '_bucket' + _format_labels(labels, [('le', '+Inf')]), self.count
+        yield name + '_sum' + _format_labels(labels), self.sum
+        yield name + '_count' + _format_labels(labels), self.count
+
+
+class Registry:
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, **labels):
+        return self._get(name, help, 'counter', Counter, labels)
+
+    def histogram(self, name, help, **labels):
+        return self._get(name, help, 'histogram', Histogram, labels)
+
+    def gauge(self, name, help, callback, **labels):
+        return self._get(name, help, 'gauge', lambda: Gauge(callback), labels, replace=True)
+
+    def collect(self):
+        """(name, help, type, [(labels, metric)]) of every registered family."""
+        with self._lock:
+            return [(name, help, kind, sorted(metrics.items(), key=lambda item: item[0]))
+                    for name, (help, kind, metrics) in sorted(self._families.items())]
+
+    def family(self, name):
+        """[(labels, metric)] registered under a name."""
+        with self._lock:
+            return sorted(self._families[name][2].items(), key=lambda item: item[0]) if name in self._families else []
+
+    def exposition(self):
+        lines = []
+        for name, help, kind, metrics in self.collect():
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, metric in metrics:
+                try:
+                    lines.extend('%s %s' % (sample, _format_value(value)) for sample, value in
+                                 metric.samples(name, labels))
+                except Exception as e:
+                    LOG.debug("Couldn't collect %s: %s", name, str(e))
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, name, help, kind, factory, labels, replace=False):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.setdefault(name, (help, kind, {}))
+            if family[1] != kind:
+                raise ValueError('Metric %s already registered as %s' % (name, family[1]))
+            metrics = family[2]
+            if replace or key not in metrics:
+                metrics[key] = factory()
+            return metrics[key]
+
+
+REGISTRY = Registry()
+
+
+def timed(name, help, registry=REGISTRY, **labels):
+    """Decorator recording the latency of every call in a histogram and failed calls in name_errors_total."""
+    histogram = registry.histogram(name + '_seconds', help, **labels)
+    errors = registry.counter(name + '_errors_total', 'Calls of %s_seconds raising an exception.' % name, **labels)
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+
+    return decorator
+
+
+def instrument(obj, name, help, label, methods=None, registry=REGISTRY, **labels):
+    """
+    Replaces methods of an instance, every public method by default, by timed versions labeled with their name and
+    any other given labels.
+    """
+    if methods is None:
+        methods = [attribute for attribute in dir(obj)
+                   if not attribute.startswith('_') and callable(getattr(obj, attribute))]
+    for method in methods:
+        method_labels = dict(labels, **{label: method})
+        setattr(obj, method, timed(name, help, registry=registry, **method_labels)(getattr(obj, method)))
+    return obj
+
+
+class Stopwatch:
+    """Seconds taken by consecutive phases, like the ones of a start up."""
+
+    def __init__(self):
+        self.phases = []
+        self._started = self._last = time.perf_counter()
+
+    def lap(self, phase):
+        """Ends phase, which started when the previous one ended."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+        return self.phases[-1][1]
+
+    @property
+    def total(self):
+        return self._last - self._started
+
+    def __str__(self):
+        return ', '.join('%s %.0f ms' % (phase, seconds * 1000) for phase, seconds in self.phases)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """Serves the registry exposition on GET /metrics."""
+
+    def __init__(self, host='127.0.0.1', port=9090, registry=REGISTRY):
+        self.registry = registry
+        self._server = _ThreadingHTTPServer((host, port), self._handler_class())
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        LOG.info('Serving metrics on port %d', self.port)
+        threading.Thread(target=self._server.serve_forever, name='MetricsServer', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = registry.exposition().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                LOG.debug('%s - %s', self.address_string(), format % args)
+
+        return MetricsHandler
@@ -1,8 +1,20 @@
 import logging
 import datetime
+import hashlib
+import itertools
+import random
+import string
+from collections import Counter, defaultdict
 from pony.orm import *
+from .stats import Statistics
+from .sqlite import ReadOnlyConnections, apply_pragmas
+from .migrations import add_missing_columns
+from .sync import METADATA_FIELDS
+from .users import UserFingerprints
 
 LOG = logging.getLogger('LaVidaModerna_Bot.persistence')
+# Catalog of the sounds of single bot deployments, stored before catalogs existed
+DEFAULT_CATALOG = ''
 db = Database()
 
 
@@ -12,7 +24,16 @@ class Sound(db.Entity):
     text = Required(str)
     tags = Required(str)
     uses = Set('ResultHistory')
+    daily_uses = Set('DailySoundUses')
     disabled = Required(bool)
+    file_id = Optional(str)
+    file_hash = Optional(str)
+    duration = Optional(float)
+    sample_rate = Optional(int)
+    channels = Optional(int)
+    size = Optional(int)
+    # Namespace of the bot serving the sound, DEFAULT_CATALOG for the single bot deployments
+    catalog = Optional(str)
 
 
 class User(db.Entity):
@@ -24,6 +45,7 @@ class User(db.Entity):
     language_code = Optional(str)
     queries = Set('QueryHistory')
     results = Set('ResultHistory')
+    daily_activity = Set('DailyUserActivity')
     first_seen = Required(datetime.datetime, sql_default='CURRENT_TIMESTAMP')
 
 
@@ -39,11 +61,42 @@ class ResultHistory(db.Entity):
     user = Required(User)
     sound = Required(Sound)
     timestamp = Required(datetime.datetime, sql_default='CURRENT_TIMESTAMP')
+    composite_index(user, timestamp)
+
+
+class DailySoundUses(db.Entity):
+    day = Required(datetime.date)
+    sound = Required(Sound)
+    uses = Required(int)
+    PrimaryKey(day, sound)
+
+
+class DailyUserActivity(db.Entity):
+    day = Required(datetime.date)
+    user = Required(User)
+    queries = Required(int)
+    results = Required(int)
+    PrimaryKey(day, user)
 
 
 class Database:
 
-    def __init__(self, provider, filename=None, host=None, user=None, password=None, database_name=None, ):
+    def __init__(self, provider, filename=None, host=None, user=None, password=None, database_name=None,
+                 sqlite_options=None):
+        self.stats = Statistics()
+        self.users = UserFingerprints()
+        self.reader = None
+        if db.provider is None:
+            self._bind(provider, filename, host, user, password, database_name, sqlite_options or {})
+        else:
+            LOG.debug('Persistence layer already bound, reusing it.')
+        if filename is not None and (sqlite_options or {}).get('readonly') in ('1', 'true', 'yes'):
+            LOG.info('Reading from read-only SQLite connections.')
+            self.reader = ReadOnlyConnections(filename, sqlite_options)
+        self.stats.load(self)
+
+    @staticmethod
+    def _bind(provider, filename, host, user, password, database_name, sqlite_options):
         if provider == 'mysql':
             LOG.info('Starting persistence layer using MySQL on %s db: %s', host, database_name)
             LOG.debug('MySQL data: host --> %s, user --> %s, db --> %s, password empty --> %s',
@@ -57,20 +110,74 @@ class Database:
                     create_db=True)
         elif filename is not None:
             LOG.info('Starting persistence layer on file %s using SQLite.', filename)
+            # Only effective on new files, existing ones need a VACUUM to change it
+            sqlite_options = dict({'auto_vacuum': 'incremental'}, **sqlite_options)
+            LOG.info('SQLite options: %s', sqlite_options)
+
+            @db.on_connect(provider='sqlite')
+            def tune_connection(db, connection):
+                apply_pragmas(connection, sqlite_options)
+
             db.bind(provider='sqlite', filename=filename, create_db=True)
         else:
             LOG.info('Starting persistence layer on memory using SQLite.')
             db.bind(provider='sqlite', filename=':memory:')
+        add_missing_columns(db)
         db.generate_mapping(create_tables=True)
 
     @db_session
-    def get_sounds(self, include_disabled=False):
-        query = Sound.select(lambda s: s.disabled is include_disabled)
+    def get_sounds(self, include_disabled=False, catalog=DEFAULT_CATALOG):
+        query = Sound.select(lambda s: s.disabled is include_disabled and s.catalog == catalog)
         sounds = [object_to_sound(db_object)
                   for db_object in query]
-        LOG.debug("get_sounds: Obtained: %s", str(sounds))
+        LOG.debug("get_sounds: Obtained: %s", sounds)
         return sounds
 
+    @db_session
+    def get_sounds_version(self, catalog=DEFAULT_CATALOG):
+        """Hash of the ids, state and file_ids of the sounds, which a catalog built from them depends on."""
+        digest = hashlib.sha1()
+        for row in select((s.id, s.disabled, s.file_id) for s in Sound if s.catalog == catalog).order_by(1):
+            digest.update(repr(row).encode('utf-8'))
+        return digest.hexdigest()
+
+    @db_session
+    def get_all_sounds(self, catalog=DEFAULT_CATALOG):
+        return [dict(object_to_sound(db_object), disabled=db_object.disabled)
+                for db_object in Sound.select(lambda s: s.catalog == catalog)]
+
+    @db_session
+    def apply_sound_diff(self, diff, catalog=DEFAULT_CATALOG):
+        """
+        Applies a sync.SoundDiff of the sounds of a catalog in a single transaction. Removed sounds are disabled to
+        keep their history.
+        """
+        LOG.info('Synchronizing sounds: %s', str(diff))
+        used_ids = set(select(s.id for s in Sound))
+        for sound in diff.added:
+            sound_id = random_sound_id()
+            while sound_id in used_ids:
+                sound_id = random_sound_id()
+            used_ids.add(sound_id)
+            LOG.info('Adding sound: %s %s', sound_id, sound['filename'])
+            Sound(id=sound_id, filename=stored_filename(catalog, sound['filename']), text=sound['text'],
+                  tags=sound['tags'], disabled=False, catalog=catalog,
+                  **{field: sound.get(field) for field in METADATA_FIELDS})
+        for sound in diff.removed:
+            LOG.info('Disabling sound %s', sound['filename'])
+            Sound[sound['id']].disabled = True
+        for sound in diff.changed:
+            LOG.info('Updating sound %s', sound['filename'])
+            Sound[sound['id']].set(text=sound['text'], tags=sound['tags'], disabled=sound['disabled'],
+                                   **{field: sound.get(field) for field in METADATA_FIELDS})
+        commit()
+
+    @db_session
+    def set_sound_file(self, id, file_id, file_hash):
+        """Stores the Telegram file_id of an uploaded sound and the hash of the uploaded file."""
+        Sound[id].set(file_id=file_id, file_hash=file_hash)
+        commit()
+
     @db_session
     def get_sound(self, id=None, filename=None):
         if not id:
@@ -100,40 +207,40 @@ class Database:
 
     @db_session
     def add_or_update_user(self, user):
+        """
+        Stores a user dict or telebot User with upsert_user, returning the user dict. Whether the user is new is
+        checked before, only for the stats. Nothing is done, and None returned, when the user is known to be stored
+        as is.
+        """
         if not isinstance(user, dict):
-            user = vars(user)
-            LOG.debug('Translated type: %s', str(user))
-        db_user = self.get_user(id=user['id'])
-        if db_user is not None and user != db_user:
-            LOG.info('Updating user: %s', str(db_user))
-            updated_user = User[user['id']]
-            updated_user.id = user['id']
-            updated_user.is_bot = user['is_bot']
-            updated_user.first_name = user['first_name']
-            updated_user.last_name = (user['last_name'] if user['last_name'] is not None else '')
-            updated_user.username = (user['username'] if user['username'] is not None else '')
-            updated_user.language_code = (user['language_code'] if user['language_code'] is not None else '')
-        elif db_user is None:
-            LOG.info('Adding user: %s', str(user))
-            User(id=user['id'], is_bot=user['is_bot'], first_name=user['first_name'],
-                 last_name=(user['last_name'] if user['last_name'] is not None else ''),
-                 username=(user['username'] if user['username'] is not None else ''),
-                 language_code=(user['language_code'] if user['language_code'] is not None else ''))
-        else:
+            user = telegram_user_to_dict(user)
+        if self.users.unchanged(user):
             LOG.debug('User %s already in database.', user['id'])
             return
+        # Only decides whether the stats count a new user, the upsert can't conflict with users inserted meanwhile
+        new = not User.exists(id=user['id'])
+        if new:
+            LOG.info('Adding user: %s', user)
+        upsert_user(user)
         commit()
-        return self.get_user(user['id'])
+        if new:
+            self.stats.record_user()
+        self.users.remember(user)
+        return user
 
     @db_session
     def get_users(self):
         query = User.select()
         users = [object_to_user(db_object) for db_object in query]
-        LOG.debug("get_users: Obtained: %s", str(users))
+        LOG.debug("get_users: Obtained: %s", users)
         return users
 
     @db_session
     def get_user(self, id=None, username=None):
+        if self.reader is not None and id and not username:
+            rows = self.reader.execute('SELECT id, is_bot, first_name, last_name, username, language_code '
+                                       'FROM User WHERE id = ?', (id,))
+            return row_to_user(rows[0]) if rows else None
         if not id:
             db_object = User.get(username=username)
         elif not username:
@@ -144,44 +251,291 @@ class Database:
         if db_object:
             return object_to_user(db_object)
 
+    def get_latest_used_sound_ids(self, user_id, limit=3, catalog=DEFAULT_CATALOG):
+        """Ids of the enabled sounds of a catalog last chosen by the user, newest first."""
+        if self.reader is None:
+            from .tools import get_latest_used_sounds_from_user
+            return [sound['id'] for sound in get_latest_used_sounds_from_user(user_id, limit=limit, catalog=catalog)]
+        rows = self.reader.execute('SELECT Sound.id '
+                                   'FROM Sound, (SELECT sound, MAX(timestamp) AS last_used '
+                                   '             FROM ResultHistory '
+                                   '             WHERE user = ? '
+                                   '             GROUP BY sound) AS recent '
+                                   'WHERE Sound.disabled = 0 AND Sound.catalog = ? AND '
+                                   'recent.sound = Sound.id '
+                                   'ORDER BY recent.last_used DESC '
+                                   'LIMIT ?;', (user_id, catalog, limit))
+        return [row[0] for row in rows]
+
     @db_session
     def add_query(self, query):
-        LOG.info("Adding query: %s", str(query))
-        from_user = query.from_user
-        db_user = self.get_user(from_user.id)
-        if not db_user:
-            db_user = self.add_or_update_user(from_user)
-        QueryHistory(user=User[db_user['id']], text=query.query)
+        LOG.debug("Adding query: %s", query)
+        user_id = query.from_user.id
+        self.add_or_update_user(query.from_user)
+        QueryHistory(user=user_id, text=query.query)
+        commit()
+        self.stats.record_query(user_id)
 
     @db_session
     def get_queries(self):
-        query = QueryHistory.select()
+        query = QueryHistory.select().prefetch(User)
         queries = [object_to_query(db_object) for db_object in query]
-        LOG.debug("get_queries: Obtained: %s", str(queries))
+        LOG.debug("get_queries: Obtained: %s", queries)
         return queries
 
     @db_session
     def add_result(self, result):
-        LOG.info("Adding result: %s", str(result))
-        from_user = result.from_user
-        db_user = self.get_user(from_user.id)
-        if not db_user:
-            db_user = self.add_or_update_user(from_user)
-        ResultHistory(user=User[db_user['id']], sound=Sound[result.result_id])
+        LOG.debug("Adding result: %s", result)
+        user_id = result.from_user.id
+        self.add_or_update_user(result.from_user)
+        ResultHistory(user=user_id, sound=Sound[result.result_id])
+        commit()
+        self.stats.record_result(user_id, int(result.result_id))
+
+    @db_session
+    def add_history(self, events):
+        """Inserts a batch of writebehind.HistoryEvent in a single transaction."""
+        LOG.debug("Adding %d history events", len(events))
+        # Latest profile of every user in the batch, only the ones not known to be stored are looked up
+        profiles = [user for user in {event.user['id']: event.user for event in events}.values()
+                    if not self.users.unchanged(user)]
+        user_ids = {user['id'] for user in profiles}
+        users = {db_user.id: object_to_user(db_user) for db_user in User.select(lambda u: u.id in user_ids)} \
+            if user_ids else {}
+        new_users = 0
+        for user in profiles:
+            stored = users.get(user['id'])
+            if stored is None:
+                LOG.info('Adding user: %s', user['id'])
+                new_users += 1
+            elif stored != user:
+                LOG.info('Updating user: %s', user['id'])
+            else:
+                continue
+            # Users added meanwhile, by add_or_update_user or another batch, are updated instead of failing the batch
+            upsert_user(user)
+        sound_ids = {event.value for event in events if event.kind == 'result'}
+        sounds = set(select(s.id for s in Sound if s.id in sound_ids)) if sound_ids else set()
+        recorded = []
+        for event in events:
+            if event.kind == 'query':
+                QueryHistory(user=event.user['id'], text=event.value, timestamp=event.timestamp)
+            elif event.value in sounds:
+                ResultHistory(user=event.user['id'], sound=event.value, timestamp=event.timestamp)
+            else:
+                LOG.warning('Discarding result of unknown sound %s', event.value)
+                continue
+            recorded.append(event)
+        commit()
+        for user in profiles:
+            self.users.remember(user)
+        for _ in range(new_users):
+            self.stats.record_user()
+        for event in recorded:
+            if event.kind == 'query':
+                self.stats.record_query(event.user['id'], event.timestamp)
+            else:
+                self.stats.record_result(event.user['id'], event.value, event.timestamp)
+
+    @db_session
+    def count_users(self):
+        return User.select().count()
+
+    @db_session
+    def count_queries(self, since=None):
+        """Queries since a timestamp, which must be newer than the retention period, or of all time."""
+        if since is None:
+            return QueryHistory.select().count() + (sum(a.queries for a in DailyUserActivity) or 0)
+        return select(q for q in QueryHistory if q.timestamp >= since).count()
+
+    @db_session
+    def count_results(self, since=None):
+        """Results since a timestamp, which must be newer than the retention period, or of all time."""
+        if since is None:
+            return ResultHistory.select().count() + (sum(a.results for a in DailyUserActivity) or 0)
+        return select(r for r in ResultHistory if r.timestamp >= since).count()
+
+    @db_session
+    def count_sound_uses(self):
+        uses = Counter(dict(select((u.sound.id, sum(u.uses)) for u in DailySoundUses)))
+        uses.update(dict(select((r.sound.id, count(r)) for r in ResultHistory)))
+        return dict(uses)
+
+    @db_session
+    def get_query_times(self, since):
+        return select((q.user.id, q.timestamp) for q in QueryHistory if q.timestamp >= since).order_by(2)[:]
+
+    @db_session
+    def get_result_times(self, since):
+        return select((r.user.id, r.timestamp) for r in ResultHistory if r.timestamp >= since).order_by(2)[:]
+
+    def export_rows(self, table, since=None, until=None, chunk_size=None):
+        """
+        Generator of the rows of the 'queries', 'results' or 'users' tables read in chunks, with the columns of
+        export.TABLES. Prefer it to the get_* methods, which load whole tables.
+        """
+        from .export import DEFAULT_CHUNK_SIZE, export_rows
+        return export_rows(table, since, until, chunk_size or DEFAULT_CHUNK_SIZE)
+
+    @db_session
+    def get_user_sound_uses(self, catalog=None):
+        """
+        (user id, sound id, uses) tuples of the results still in the history, rolled up ones lost their users. Only the
+        ones of the sounds of catalog if given.
+        """
+        if catalog is None:
+            return select((r.user.id, r.sound.id, count()) for r in ResultHistory)[:]
+        return select((r.user.id, r.sound.id, count()) for r in ResultHistory if r.sound.catalog == catalog)[:]
+
+    @db_session
+    def get_sound_uses(self, catalog=None):
+        """
+        (sound id, midnight of a day, uses) tuples covering every chosen result, counted per sound and day by the
+        database, so their number doesn't grow with the history. Only the ones of the sounds of catalog if given.
+        """
+        if catalog is None:
+            rolled_up = select((u.sound.id, u.day, sum(u.uses)) for u in DailySoundUses)
+            results = select((r.sound.id, r.timestamp.date(), count()) for r in ResultHistory)
+        else:
+            rolled_up = select((u.sound.id, u.day, sum(u.uses)) for u in DailySoundUses if u.sound.catalog == catalog)
+            results = select((r.sound.id, r.timestamp.date(), count()) for r in ResultHistory
+                             if r.sound.catalog == catalog)
+        # Days partly rolled up are in both
+        uses = Counter()
+        for sound_id, day, day_uses in itertools.chain(rolled_up, results):
+            uses[sound_id, day] += day_uses
+        return [(sound_id, datetime.datetime.combine(day, datetime.time()), day_uses)
+                for (sound_id, day), day_uses in uses.items()]
+
+    @db_session
+    def roll_up_history(self, before, batch_size=500):
+        """
+        Adds up to batch_size history rows older than before to the daily rollups and deletes them, in a single
+        transaction. Returns the number of rows rolled up, less than batch_size once nothing is left.
+        """
+        queries = select((q.id, q.user.id, q.timestamp) for q in QueryHistory
+                         if q.timestamp < before).order_by(1)[:batch_size]
+        results = []
+        if len(queries) < batch_size:
+            results = select((r.id, r.user.id, r.sound.id, r.timestamp) for r in ResultHistory
+                             if r.timestamp < before).order_by(1)[:batch_size - len(queries)]
+        if not queries and not results:
+            return 0
+
+        activity = defaultdict(lambda: [0, 0])
+        sound_uses = Counter()
+        for _, user_id, timestamp in queries:
+            activity[timestamp.date(), user_id][0] += 1
+        for _, user_id, sound_id, timestamp in results:
+            activity[timestamp.date(), user_id][1] += 1
+            sound_uses[timestamp.date(), sound_id] += 1
+
+        days = {day for day, _ in activity}
+        user_ids = {user_id for _, user_id in activity}
+        sound_ids = {sound_id for _, sound_id in sound_uses}
+        users = {db_user.id: db_user for db_user in User.select(lambda u: u.id in user_ids)}
+        sounds = {db_sound.id: db_sound for db_sound in Sound.select(lambda s: s.id in sound_ids)}
+        rolled_activity = {(a.day, a.user.id): a for a in
+                           DailyUserActivity.select(lambda a: a.day in days and a.user.id in user_ids)}
+        rolled_uses = {(u.day, u.sound.id): u for u in
+                       DailySoundUses.select(lambda u: u.day in days and u.sound.id in sound_ids)}
+        for (day, user_id), (query_count, result_count) in activity.items():
+            row = rolled_activity.get((day, user_id))
+            if row is None:
+                DailyUserActivity(day=day, user=users[user_id], queries=query_count, results=result_count)
+            else:
+                row.queries += query_count
+                row.results += result_count
+        for (day, sound_id), uses in sound_uses.items():
+            row = rolled_uses.get((day, sound_id))
+            if row is None:
+                DailySoundUses(day=day, sound=sounds[sound_id], uses=uses)
+            else:
+                row.uses += uses
+
+        # Rows are taken in id order, so these are exactly the selected ones
+        if queries:
+            last_id = queries[-1][0]
+            delete(q for q in QueryHistory if q.id <= last_id and q.timestamp < before)
+        if results:
+            last_id = results[-1][0]
+            delete(r for r in ResultHistory if r.id <= last_id and r.timestamp < before)
+        commit()
+        LOG.debug('Rolled up %d queries and %d results.', len(queries), len(results))
+        return len(queries) + len(results)
+
+    @db_session
+    def reclaim_space(self, pages=1000):
+        """
+        Returns up to pages free SQLite pages to the file system when incremental auto vacuum is enabled.
+        Returns the number of pages freed, None when the database can't be vacuumed incrementally.
+        """
+        if db.provider_name != 'sqlite' or db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return None
+        free_pages = db.execute('PRAGMA freelist_count').fetchone()[0]
+        # sqlite3 steps a statement without result columns only once, freeing a single page, executescript runs it
+        # to completion
+        db.get_connection().executescript('PRAGMA incremental_vacuum(%d)' % int(pages))
+        return free_pages - db.execute('PRAGMA freelist_count').fetchone()[0]
 
     @db_session
     def get_results(self):
-        query = ResultHistory.select()
+        query = ResultHistory.select().prefetch(User, Sound)
         results = [object_to_result(db_object) for db_object in query]
-        LOG.debug("get_results: Obtained: %s", str(results))
+        LOG.debug("get_results: Obtained: %s", results)
         return results
 
 
+def upsert_user(user):
+    """
+    Inserts or updates a user dict within a db_session. SQLite does it in a single statement, which can't conflict
+    with the same user inserted meanwhile, other providers through Pony.
+    """
+    fields = user_to_fields(user)
+    if db.provider_name == 'sqlite':
+        db.execute('INSERT INTO User (id, is_bot, first_name, last_name, username, language_code) '
+                   'VALUES ($id, $is_bot, $first_name, $last_name, $username, $language_code) '
+                   'ON CONFLICT(id) DO UPDATE SET is_bot = excluded.is_bot, first_name = excluded.first_name, '
+                   'last_name = excluded.last_name, username = excluded.username, '
+                   'language_code = excluded.language_code', dict(fields, id=user['id']))
+        return
+    db_user = User.get(id=user['id'])
+    if db_user is None:
+        User(id=user['id'], **fields)
+    else:
+        db_user.set(**fields)
+
+
+def random_sound_id():
+    return int(''.join(random.choices(string.digits, k=8)))
+
+
 # MAPPERS
 
 
+def telegram_user_to_dict(user):
+    return {'id': user.id, 'is_bot': user.is_bot, 'first_name': user.first_name, 'last_name': user.last_name,
+            'username': user.username, 'language_code': user.language_code}
+
+def user_to_fields(user):
+    """Entity fields of a user dict, Optional strings are stored as empty strings."""
+    return {'is_bot': user['is_bot'], 'first_name': user['first_name'],
+            'last_name': (user['last_name'] if user['last_name'] is not None else ''),
+            'username': (user['username'] if user['username'] is not None else ''),
+            'language_code': (user['language_code'] if user['language_code'] is not None else '')}
+
+
+def stored_filename(catalog, filename):
+    """Filename column of a sound. It is unique in existing tables, so sounds of other catalogs are prefixed."""
+    return catalog + '/' + filename if catalog else filename
+
+
 def object_to_sound(db_object):
-    return {'id': db_object.id, 'filename': db_object.filename, 'text': db_object.text, 'tags': db_object.tags}
+    filename = db_object.filename[len(db_object.catalog) + 1:] if db_object.catalog else db_object.filename
+    return {'id': db_object.id, 'filename': filename, 'text': db_object.text, 'tags': db_object.tags,
+            'file_id': db_object.file_id or None, 'file_hash': db_object.file_hash or None,
+            'duration': db_object.duration, 'sample_rate': db_object.sample_rate, 'channels': db_object.channels,
+            'size': db_object.size}
 
 
 def object_to_user(db_object):
@@ -191,6 +545,12 @@ def object_to_user(db_object):
             'language_code': (db_object.language_code if db_object.language_code is not '' else None)}
 
 
+def row_to_user(row):
+    id, is_bot, first_name, last_name, username, language_code = row
+    return {'id': id, 'is_bot': bool(is_bot), 'first_name': first_name,
+            'username': username or None, 'last_name': last_name or None, 'language_code': language_code or None}
+
+
 def object_to_query(db_object):
     return {'id': db_object.id, 'user': object_to_user(db_object.user), 'text': db_object.text,
             'timestamp': db_object.timestamp}
@@ -0,0 +1,154 @@
+"""
+Streaming export of the history and the users as CSV or JSON lines, gzipped when the output ends in .gz. Rows are
+read in chunks paginated by id, each chunk in its own short transaction with the users and sounds joined in SQL, so
+memory use doesn't grow with the size of the history.
+
+    python -m persistence.export --sqlite /data/db.sqlite --table results --since 2020-03-01 --output results.csv.gz
+"""
+
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import logging
+import sys
+from . import *
+from .sqlite import parse_sqlite_path
+
+LOG = logging.getLogger('LaVidaModerna_Bot.persistence.export')
+
+DEFAULT_CHUNK_SIZE = 5000
+FORMATS = ('csv', 'jsonl')
+TIME_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M')
+
+# table -> (columns, SQL selecting them from the rows with an id above $last, with {where} extra conditions)
+TABLES = {
+    'queries': (('id', 'timestamp', 'user_id', 'username', 'first_name', 'language_code', 'text'),
+                'SELECT q.id, q.timestamp, q.user, u.username, u.first_name, u.language_code, q.text '
+                'FROM QueryHistory q JOIN User u ON u.id = q.user '
+                'WHERE q.id > $last {where}'
+                'ORDER BY q.id LIMIT $limit'),
+    'results': (('id', 'timestamp', 'user_id', 'username', 'first_name', 'language_code', 'sound_id', 'filename',
+                 'sound_text'),
+                'SELECT r.id, r.timestamp, r.user, u.username, u.first_name, u.language_code, r.sound, s.filename, '
+                's.text '
+                'FROM ResultHistory r JOIN User u ON u.id = r.user JOIN Sound s ON s.id = r.sound '
+                'WHERE r.id > $last {where}'
+                'ORDER BY r.id LIMIT $limit'),
+    'users': (('id', 'is_bot', 'first_name', 'last_name', 'username', 'language_code'),
+              'SELECT id, is_bot, first_name, last_name, username, language_code '
+              'FROM User '
+              'WHERE id > $last {where}'
+              'ORDER BY id LIMIT $limit'),
+}
+# Tables whose rows have a timestamp, prefixed by their alias
+_TIMESTAMPS = {'queries': 'q.timestamp', 'results': 'r.timestamp'}
+
+
+def parse_time(value):
+    """Naive UTC datetime of a date or an ISO date and time."""
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise ValueError('Invalid date: %s' % value)
+
+
+def export_rows(table, since=None, until=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Generator of the rows of table, tuples of its columns in TABLES, from since inclusive to until exclusive if
+    given. Raises ValueError right away for unknown tables and filters.
+    """
+    if table not in TABLES:
+        raise ValueError('Unknown table: %s' % table)
+    if (since or until) and table not in _TIMESTAMPS:
+        raise ValueError('The %s have no time to filter by' % table)
+    sql = TABLES[table][1]
+    conditions = ''
+    if since is not None:
+        conditions += 'AND %s >= $since ' % _TIMESTAMPS[table]
+    if until is not None:
+        conditions += 'AND %s < $until ' % _TIMESTAMPS[table]
+    return _read_chunks(sql.format(where=conditions), {'limit': chunk_size, 'since': since, 'until': until})
+
+
+def _read_chunks(sql, parameters):
+    parameters['last'] = -1
+    while True:
+        # One short transaction per chunk, writers are not held back for the whole export
+        with db_session:
+            rows = db.select(sql, globals=parameters)
+        for row in rows:
+            yield tuple(row)
+        if len(rows) < parameters['limit']:
+            return
+        parameters['last'] = rows[-1][0]
+
+
+def write_rows(rows, columns, output, format='csv'):
+    """Writes rows to the text file output, as CSV with a header or as JSON lines. Returns the rows written."""
+    if format not in FORMATS:
+        raise ValueError('Unknown format: %s' % format)
+    written = 0
+    if format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+    else:
+        for row in rows:
+            output.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + '\n')
+            written += 1
+    return written
+
+
+def open_output(path):
+    """Text file to write path, gzipped when it ends in .gz, stdout for -."""
+    if path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def export(table, path, format='csv', since=None, until=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Exports table to path, returns the rows written."""
+    rows = export_rows(table, since, until, chunk_size)
+    output = open_output(path)
+    try:
+        written = write_rows(rows, TABLES[table][0], output, format)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    LOG.info('Exported %d %s to %s.', written, table, path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exports the history without loading it in memory.")
+    parser.add_argument("--sqlite", type=str, help="SQLite file path, with its options.", required=True)
+    parser.add_argument("--table", help="What to export.", choices=sorted(TABLES), default='results')
+    parser.add_argument("--format", help="Output format.", choices=FORMATS, default='csv')
+    parser.add_argument("--since", type=parse_time, help="First UTC date or time exported.")
+    parser.add_argument("--until", type=parse_time, help="UTC date or time the export stops before.")
+    parser.add_argument("--output", type=str, help="Output file, gzipped if it ends in .gz, - for stdout.",
+                        default='-')
+    parser.add_argument("--chunk-size", type=int, help="Rows read per query.", default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s', stream=sys.stderr)
+
+    filename, options = parse_sqlite_path(args.sqlite)
+    Database('sqlite', filename=filename, sqlite_options=options)
+    try:
+        export(args.table, args.output, args.format, args.since, args.until, args.chunk_size)
+    except ValueError as e:
+        LOG.error(str(e))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
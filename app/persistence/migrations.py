@@ -0,0 +1,34 @@
+"""
+Columns added to entities after their tables were first created. Pony creates missing tables but never alters
+existing ones, so missing columns are added before the mapping is generated.
+"""
+
+import logging
+from pony.orm import db_session
+
+LOG = logging.getLogger('LaVidaModerna_Bot.persistence.migrations')
+
+# (table, column, SQLite definition), Optional(str) attributes are stored as NOT NULL with '' for None
+ADDED_COLUMNS = (
+    ('Sound', 'file_id', "TEXT NOT NULL DEFAULT ''"),
+    ('Sound', 'file_hash', "TEXT NOT NULL DEFAULT ''"),
+    ('Sound', 'duration', 'REAL'),
+    ('Sound', 'sample_rate', 'INTEGER'),
+    ('Sound', 'channels', 'INTEGER'),
+    ('Sound', 'size', 'INTEGER'),
+    ('Sound', 'catalog', "TEXT NOT NULL DEFAULT ''"),
+)
+
+
+def add_missing_columns(db, columns=ADDED_COLUMNS):
+    """Adds the missing columns of already existing tables. Must run after binding and before generate_mapping."""
+    if db.provider_name != 'sqlite':
+        LOG.warning('Columns can only be added automatically on SQLite, check %s are present.',
+                    ', '.join('%s.%s' % (table, column) for table, column, _ in columns))
+        return
+    with db_session:
+        for table, column, definition in columns:
+            existing = {row[1] for row in db.execute('PRAGMA table_info("%s")' % table)}
+            if existing and column not in existing:
+                LOG.info('Adding column %s.%s', table, column)
+                db.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s' % (table, column, definition))
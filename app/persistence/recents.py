@@ -0,0 +1,64 @@
+"""
+Per user recently used sounds kept in memory and maintained from chosen results.
+"""
+
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from .tools import get_latest_used_sounds_from_user
+
+LOG = logging.getLogger('LaVidaModerna_Bot.persistence.recents')
+
+DEFAULT_MAX_USERS = 10000
+DEFAULT_SOUNDS_PER_USER = 3
+
+
+def load_latest_used_sound_ids(user_id, limit):
+    return [sound['id'] for sound in get_latest_used_sounds_from_user(user_id, limit=limit)]
+
+
+class RecentSounds:
+    """
+    Most recently used sound ids of the last max_users active users, newest first. Users not cached are loaded
+    from the database with loader(user_id, limit) and the least recently active user is evicted.
+    """
+
+    def __init__(self, loader=load_latest_used_sound_ids, max_users=DEFAULT_MAX_USERS,
+                 sounds_per_user=DEFAULT_SOUNDS_PER_USER):
+        self.loader = loader
+        self.max_users = max_users
+        self.sounds_per_user = sounds_per_user
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, user_id):
+        with self._lock:
+            recent = self._users.get(user_id)
+            if recent is not None:
+                self._users.move_to_end(user_id)
+                return list(recent)
+        return list(self._load(user_id))
+
+    def add(self, user_id, sound_id):
+        with self._lock:
+            recent = self._users.get(user_id)
+        if recent is None:
+            recent = self._load(user_id)
+        with self._lock:
+            if sound_id in recent:
+                recent.remove(sound_id)
+            recent.appendleft(sound_id)
+
+    def _load(self, user_id):
+        recent = deque(self.loader(user_id, self.sounds_per_user), maxlen=self.sounds_per_user)
+        LOG.debug('Loaded %d recent sounds of user %s', len(recent), user_id)
+        with self._lock:
+            recent = self._users.setdefault(user_id, recent)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return recent
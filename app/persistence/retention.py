@@ -0,0 +1,89 @@
+"""
+History retention: raw query and result rows older than the retention period are added to daily per user and per
+sound rollups and deleted in small batches from a background thread, then the freed pages are returned to the file
+system a few at a time.
+"""
+
+import datetime
+import logging
+import threading
+import time
+
+LOG = logging.getLogger('LaVidaModerna_Bot.persistence.retention')
+
+# The /stats windows and the recently used sounds read the raw rows of the last day
+MIN_DAYS = 2
+DEFAULT_INTERVAL = 60 * 60
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAUSE = 0.2
+DEFAULT_VACUUM_PAGES = 1000
+
+
+def cutoff(days, now=None):
+    """Midnight UTC of the oldest day whose raw rows are kept, so only whole days are rolled up."""
+    now = datetime.datetime.utcnow() if now is None else now
+    return datetime.datetime.combine((now - datetime.timedelta(days=days)).date(), datetime.time())
+
+
+class Retention:
+
+    def __init__(self, database, days, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_PAUSE,
+                 vacuum_pages=DEFAULT_VACUUM_PAGES):
+        if days < MIN_DAYS:
+            raise ValueError('History must be kept at least %d days' % MIN_DAYS)
+        self.database = database
+        self.days = days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.rolled_up = 0
+        self.reclaimed_pages = 0
+        self._stopping = threading.Event()
+
+    def run(self, now=None):
+        """Rolls up every row past the retention period, one transaction per batch. Returns the rows rolled up."""
+        before = cutoff(self.days, now)
+        started = time.time()
+        total = 0
+        while not self._stopping.is_set():
+            rolled_up = self.database.roll_up_history(before, self.batch_size)
+            total += rolled_up
+            if rolled_up < self.batch_size:
+                break
+            # Lets the history writer and the handlers take the write lock between batches
+            self._stopping.wait(self.pause)
+        self.rolled_up += total
+        if total:
+            LOG.info('Rolled up %d history rows older than %s in %.1f seconds.', total, before, time.time() - started)
+            self.vacuum()
+        return total
+
+    def vacuum(self):
+        """Frees up to vacuum_pages pages per pause until no free page is left."""
+        while not self._stopping.is_set():
+            reclaimed = self.database.reclaim_space(self.vacuum_pages)
+            if reclaimed is None:
+                LOG.info('Incremental vacuum is not enabled, the freed space will be reused but not released.')
+                return
+            self.reclaimed_pages += reclaimed
+            if reclaimed < self.vacuum_pages:
+                return
+            self._stopping.wait(self.pause)
+
+    def start(self, interval=DEFAULT_INTERVAL):
+        """Runs now and then every interval seconds from a background thread."""
+
+        def run():
+            while True:
+                try:
+                    self.run()
+                except Exception as e:
+                    LOG.error("Couldn't apply history retention: %s", str(e))
+                if self._stopping.wait(interval):
+                    return
+
+        threading.Thread(target=run, name='Retention', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
@@ -0,0 +1,80 @@
+"""
+SQLite tuning: pragmas applied to every connection and read-only connections for the inline query hot path.
+
+Options are given in the query string of the SQLite path, e.g. ``/data/db.sqlite?tuned`` or
+``/data/db.sqlite?journal_mode=wal&synchronous=normal&mmap_size=67108864&cache_size=-16000&readonly=1``.
+"""
+
+import logging
+import sqlite3
+import threading
+from urllib.parse import parse_qsl, quote
+
+LOG = logging.getLogger('LaVidaModerna_Bot.persistence.sqlite')
+
+PRAGMAS = ('auto_vacuum', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'busy_timeout')
+TUNED_OPTIONS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': '67108864',
+    'cache_size': '-16000',
+    'busy_timeout': '5000',
+    'readonly': '1',
+}
+
+_ALLOWED_VALUES = {
+    'auto_vacuum': ('none', 'full', 'incremental', '0', '1', '2'),
+    'journal_mode': ('delete', 'truncate', 'persist', 'memory', 'wal', 'off'),
+    'synchronous': ('off', 'normal', 'full', 'extra', '0', '1', '2', '3'),
+}
+
+
+def parse_sqlite_path(value):
+    """Splits a --sqlite value in the file path and its tuning options."""
+    if value is None or '?' not in value:
+        return value, {}
+    filename, query = value.split('?', 1)
+    options = {}
+    for key, option in parse_qsl(query, keep_blank_values=True):
+        if key == 'tuned':
+            options.update((k, v) for k, v in TUNED_OPTIONS.items() if k not in options)
+        elif key in PRAGMAS or key == 'readonly':
+            options[key] = option.lower()
+        else:
+            raise ValueError('Unknown SQLite option: %s' % key)
+    for key, allowed in _ALLOWED_VALUES.items():
+        if key in options and options[key] not in allowed:
+            raise ValueError('Invalid SQLite %s: %s' % (key, options[key]))
+    for key in ('mmap_size', 'cache_size', 'busy_timeout'):
+        if key in options and not options[key].lstrip('-').isdigit():
+            raise ValueError('Invalid SQLite %s: %s' % (key, options[key]))
+    return filename, options
+
+
+def apply_pragmas(connection, options):
+    cursor = connection.cursor()
+    for pragma in PRAGMAS:
+        if pragma in options:
+            cursor.execute('PRAGMA %s = %s' % (pragma, options[pragma]))
+
+
+class ReadOnlyConnections:
+    """One read-only connection per thread, so reads never take the write lock nor wait for the writer."""
+
+    def __init__(self, filename, options):
+        self.uri = 'file:%s?mode=ro' % quote(filename)
+        self.options = {key: value for key, value in options.items() if key not in ('auto_vacuum', 'journal_mode')}
+        self._local = threading.local()
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+            apply_pragmas(connection, self.options)
+            connection.execute('PRAGMA query_only = 1')
+            self._local.connection = connection
+            LOG.debug('Opened read-only connection on %s', self.uri)
+        return connection
+
+    def execute(self, sql, parameters=()):
+        return self.connection().execute(sql, parameters).fetchall()
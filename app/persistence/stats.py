@@ -0,0 +1,145 @@
+"""
+In process usage statistics. Seeded once from aggregate queries and kept up to date by the Database write methods,
+so /stats never has to read the history tables.
+"""
+
+import calendar
+import datetime
+import heapq
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+LOG = logging.getLogger('LaVidaModerna_Bot.persistence.stats')
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+WINDOWS = (HOUR, DAY)
+BUCKET_SECONDS = 60
+
+
+def to_epoch(timestamp):
+    """Seconds since epoch of a naive UTC datetime, like the ones stored in the history tables."""
+    return calendar.timegm(timestamp.utctimetuple()) + timestamp.microsecond / 1e6
+
+
+class WindowCounter:
+    """
+    Number of events in the last length seconds, counted in buckets of bucket_seconds. Events are expected in
+    chronological order, a late event is counted in the newest bucket.
+    """
+
+    def __init__(self, length, bucket_seconds=BUCKET_SECONDS):
+        self.length = length
+        self.bucket_seconds = bucket_seconds
+        self._buckets = deque()
+        self._total = 0
+
+    def add(self, epoch, amount=1):
+        bucket = int(epoch // self.bucket_seconds)
+        if self._buckets and self._buckets[-1][0] >= bucket:
+            self._buckets[-1][1] += amount
+        else:
+            self._buckets.append([bucket, amount])
+        self._total += amount
+
+    def total(self, now):
+        oldest = int(now // self.bucket_seconds) - self.length // self.bucket_seconds
+        while self._buckets and self._buckets[0][0] <= oldest:
+            self._total -= self._buckets.popleft()[1]
+        return self._total
+
+
+class ActiveUsers:
+    """Distinct users seen in the last length seconds. Like WindowCounter, expects events in chronological order."""
+
+    def __init__(self, length):
+        self.length = length
+        self._last_seen = OrderedDict()
+
+    def add(self, user_id, epoch):
+        if epoch >= self._last_seen.get(user_id, epoch):
+            self._last_seen[user_id] = epoch
+            self._last_seen.move_to_end(user_id)
+
+    def total(self, now):
+        while self._last_seen:
+            user_id, epoch = next(iter(self._last_seen.items()))
+            if epoch > now - self.length:
+                break
+            self._last_seen.popitem(last=False)
+        return len(self._last_seen)
+
+
+class Statistics:
+
+    def __init__(self, windows=WINDOWS):
+        self.windows = windows
+        self.users = 0
+        self.queries = 0
+        self.results = 0
+        self.sound_uses = Counter()
+        self._window_queries = {window: WindowCounter(window) for window in windows}
+        self._window_results = {window: WindowCounter(window) for window in windows}
+        self._active_users = {window: ActiveUsers(window) for window in windows}
+        self._lock = threading.Lock()
+
+    def load(self, database):
+        """
+        Seeds the counters from the database: aggregate counts plus the events of the longest window, which the
+        database returns in chronological order.
+        """
+        started = time.time()
+        since = datetime.datetime.utcnow() - datetime.timedelta(seconds=max(self.windows))
+        with self._lock:
+            self.users = database.count_users()
+            self.queries = database.count_queries()
+            self.results = database.count_results()
+            self.sound_uses = Counter(database.count_sound_uses())
+            queries = ((timestamp, user_id, self._window_queries)
+                       for user_id, timestamp in database.get_query_times(since))
+            results = ((timestamp, user_id, self._window_results)
+                       for user_id, timestamp in database.get_result_times(since))
+            for timestamp, user_id, counters in heapq.merge(queries, results, key=lambda event: event[0]):
+                self._add_window_event(counters, user_id, to_epoch(timestamp))
+        LOG.info('Statistics loaded in %.3f seconds.', time.time() - started)
+
+    def record_user(self):
+        with self._lock:
+            self.users += 1
+
+    def record_query(self, user_id, timestamp=None):
+        epoch = time.time() if timestamp is None else to_epoch(timestamp)
+        with self._lock:
+            self.queries += 1
+            self._add_window_event(self._window_queries, user_id, epoch)
+
+    def record_result(self, user_id, sound_id, timestamp=None):
+        epoch = time.time() if timestamp is None else to_epoch(timestamp)
+        with self._lock:
+            self.results += 1
+            self.sound_uses[sound_id] += 1
+            self._add_window_event(self._window_results, user_id, epoch)
+
+    def top_sounds(self, n=5):
+        with self._lock:
+            return self.sound_uses.most_common(n)
+
+    def snapshot(self, now=None, top=5):
+        now = time.time() if now is None else now
+        with self._lock:
+            return {
+                'users': self.users,
+                'queries': self.queries,
+                'results': self.results,
+                'window_queries': {window: counter.total(now) for window, counter in self._window_queries.items()},
+                'window_results': {window: counter.total(now) for window, counter in self._window_results.items()},
+                'active_users': {window: users.total(now) for window, users in self._active_users.items()},
+                'top_sounds': self.sound_uses.most_common(top),
+            }
+
+    def _add_window_event(self, counters, user_id, epoch):
+        for window, counter in counters.items():
+            counter.add(epoch)
+            self._active_users[window].add(user_id, epoch)
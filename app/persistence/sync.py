@@ -0,0 +1,45 @@
+"""
+Set based comparison between the sounds stored in the database and the ones described in data.json.
+"""
+
+from collections import namedtuple
+
+# Audio metadata is only present in data.json once catalog.metadata has been run on it
+METADATA_FIELDS = ('duration', 'sample_rate', 'channels', 'size')
+SYNCHRONIZED_FIELDS = ('text', 'tags') + METADATA_FIELDS
+
+
+class SoundDiff(namedtuple('SoundDiff', ['added', 'removed', 'changed'])):
+    """
+    added: data.json sounds missing in the database.
+    removed: enabled database sounds missing in data.json.
+    changed: database sounds updated with their data.json fields, including disabled sounds that came back.
+    """
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self):
+        return '%d added, %d removed, %d changed' % (len(self.added), len(self.removed), len(self.changed))
+
+
+def diff_sounds(db_sounds, json_sounds):
+    """db_sounds must include the disabled ones, as returned by Database.get_all_sounds()."""
+    db_by_filename = {sound['filename']: sound for sound in db_sounds}
+    json_by_filename = {sound['filename']: sound for sound in json_sounds}
+
+    new_filenames = json_by_filename.keys() - db_by_filename.keys()
+    added = [sound for sound in json_sounds if sound['filename'] in new_filenames]
+
+    removed = [db_by_filename[filename] for filename in db_by_filename.keys() - json_by_filename.keys()
+               if not db_by_filename[filename]['disabled']]
+
+    changed = []
+    for filename in db_by_filename.keys() & json_by_filename.keys():
+        db_sound, json_sound = db_by_filename[filename], json_by_filename[filename]
+        if db_sound['disabled'] or any(db_sound.get(field) != json_sound.get(field) for field in SYNCHRONIZED_FIELDS):
+            updated = dict(db_sound, disabled=False)
+            updated.update((field, json_sound.get(field)) for field in SYNCHRONIZED_FIELDS
+                           if field in json_sound or field in db_sound)
+            changed.append(updated)
+    return SoundDiff(added, removed, changed)
@@ -0,0 +1,49 @@
+"""
+Fingerprints of the user profiles last written to the database, so unchanged returning users cost no query.
+"""
+
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_USERS = 100000
+PROFILE_FIELDS = ('is_bot', 'first_name', 'last_name', 'username', 'language_code')
+
+
+def fingerprint(user):
+    return hash(tuple(user[field] for field in PROFILE_FIELDS))
+
+
+class UserFingerprints:
+    """Profile fingerprints of the last max_users users written, evicting the least recently seen one."""
+
+    def __init__(self, max_users=DEFAULT_MAX_USERS):
+        self.max_users = max_users
+        self.hits = 0
+        self.misses = 0
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users)
+
+    def unchanged(self, user):
+        """True when the user dict is known to be stored as is."""
+        with self._lock:
+            stored = self._users.get(user['id'])
+            if stored is not None and stored == fingerprint(user):
+                self._users.move_to_end(user['id'])
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def remember(self, user):
+        with self._lock:
+            self._users[user['id']] = fingerprint(user)
+            self._users.move_to_end(user['id'])
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
@@ -0,0 +1,222 @@
+"""
+Write-behind pipeline for query and result history: handlers enqueue events and a background thread inserts them
+in batches, so inline answers never wait for the database.
+"""
+
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from . import telegram_user_to_dict
+
+LOG = logging.getLogger('LaVidaModerna_Bot.persistence.writebehind')
+
+QUERY = 'query'
+RESULT = 'result'
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP = 'drop'
+OVERFLOW_SPILL = 'spill'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP, OVERFLOW_SPILL)
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+HistoryEvent = namedtuple('HistoryEvent', ['kind', 'user', 'value', 'timestamp'])
+
+
+def query_event(query):
+    return HistoryEvent(QUERY, telegram_user_to_dict(query.from_user), query.query, datetime.datetime.utcnow())
+
+
+def result_event(result):
+    return HistoryEvent(RESULT, telegram_user_to_dict(result.from_user), int(result.result_id),
+                        datetime.datetime.utcnow())
+
+
+def event_to_json(event):
+    return json.dumps({'kind': event.kind, 'user': event.user, 'value': event.value,
+                       'timestamp': event.timestamp.strftime(_TIMESTAMP_FORMAT)})
+
+
+def json_to_event(line):
+    data = json.loads(line)
+    return HistoryEvent(data['kind'], data['user'], data['value'],
+                        datetime.datetime.strptime(data['timestamp'], _TIMESTAMP_FORMAT))
+
+
+class HistoryWriter:
+    """
+    Bounded queue of history events flushed by a background thread every batch_size events or flush_interval
+    seconds, whatever comes first. When the queue is full events are blocked on, dropped or spilled to a file that
+    is replayed once the queue drains. The spill policy also spills the batches the database fails to write.
+    """
+
+    def __init__(self, database, max_size=10000, batch_size=500, flush_interval=1.0, overflow=OVERFLOW_BLOCK,
+                 spill_file=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Invalid overflow policy: %s' % overflow)
+        if overflow == OVERFLOW_SPILL and not spill_file:
+            raise ValueError('A spill file is required by the spill overflow policy')
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_file = spill_file
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_size)
+        self._spill_lock = threading.Lock()
+        # Held while batches are taken and written, reentrant for the spill replays in between
+        self._flush_lock = threading.RLock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='HistoryWriter', daemon=True)
+        self._thread.start()
+        return self
+
+    def add_query(self, query):
+        self.put(query_event(query))
+
+    def add_result(self, result):
+        self.put(result_event(result))
+
+    def put(self, event):
+        if self.overflow == OVERFLOW_BLOCK:
+            self._queue.put(event)
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            if self.overflow == OVERFLOW_DROP:
+                self.dropped += 1
+                LOG.debug('History queue full, dropping %s event.', event.kind)
+            else:
+                self._spill(event)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """
+        Writes every queued and spilled event synchronously, once the batch the background thread may be writing is
+        written.
+        """
+        with self._flush_lock:
+            while True:
+                batch = self._take(block=False)
+                if not batch:
+                    if not self._replay_spill():
+                        return
+                    continue
+                self._write_taken(batch)
+
+    def close(self, timeout=10):
+        """Stops the background thread and writes whatever is still pending."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+        LOG.info('History writer closed: %d written, %d dropped, %d spilled, %d failed.',
+                 self.written, self.dropped, self.spilled, self.failed)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # A batch is never out of the queue and unwritten while flush() runs
+            with self._flush_lock:
+                batch = self._take(block=True)
+                if batch:
+                    self._write_taken(batch)
+            if not batch and self._queue.empty():
+                self._replay_spill()
+
+    def _take(self, block):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                if block:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Writes a batch of events, returns whether it was written."""
+        with self._flush_lock:
+            try:
+                self.database.add_history(batch)
+                self.written += len(batch)
+                return True
+            except Exception as e:
+                self.failed += len(batch)
+                LOG.error("Couldn't write %d history events: %s", len(batch), str(e))
+                return False
+
+    def _write_taken(self, batch):
+        """Writes a batch taken from the queue, the spill policy spills it when it fails."""
+        if not self._write(batch) and self.overflow == OVERFLOW_SPILL:
+            self._respill(batch, ())
+            with self._spill_lock:
+                self.spilled += len(batch)
+
+    def _spill(self, event):
+        with self._spill_lock:
+            with open(self.spill_file, 'a') as spill:
+                spill.write(event_to_json(event) + '\n')
+            self.spilled += 1
+
+    def _replay_spill(self):
+        """
+        Moves spilled events back to the database. Returns whether they were all written, when a batch fails it and
+        the events not replayed yet are spilled again.
+        """
+        if self.spill_file is None:
+            return False
+        replay_file = self.spill_file + '.replay'
+        with self._spill_lock:
+            if not os.path.exists(replay_file):
+                if not os.path.exists(self.spill_file) or os.path.getsize(self.spill_file) == 0:
+                    return False
+                os.replace(self.spill_file, replay_file)
+        LOG.info('Replaying spilled history events from %s', replay_file)
+        batch = []
+        written = True
+        with open(replay_file) as replay:
+            for line in replay:
+                batch.append(json_to_event(line))
+                if len(batch) >= self.batch_size:
+                    written = self._write(batch)
+                    if not written:
+                        break
+                    batch = []
+            if written and batch:
+                written = self._write(batch)
+            if not written:
+                self._respill(batch, replay)
+        os.remove(replay_file)
+        return written
+
+    def _respill(self, batch, lines):
+        """Appends the events of a failed batch, and the spilled lines after it if any, to the spill file."""
+        with self._spill_lock:
+            with open(self.spill_file, 'a') as spill:
+                for event in batch:
+                    spill.write(event_to_json(event) + '\n')
+                spill.writelines(lines)
+        LOG.warning('Spilled %d failed history events to %s until the database is back.', len(batch),
+                    self.spill_file)
@@ -0,0 +1,64 @@
+"""
+Long polling of the updates of bots whose processing runs on a worker pool shared with other bots.
+"""
+
+import logging
+import threading
+import time
+
+LOG = logging.getLogger('LaVidaModerna_Bot.polling')
+
+POLL_TIMEOUT = 20
+POLL_RETRY_PAUSE = 1
+ALLOWED_UPDATES = ['message', 'inline_query', 'chosen_inline_result']
+
+
+class Poller:
+    """
+    Long polls the updates of a telebot bot and hands them to webhook.UpdateWorkers, waiting for a free slot so no
+    update is lost when they are saturated. on_receive is called with every update before it is queued.
+    """
+
+    def __init__(self, telegram_bot, workers, name='Poller', on_receive=None):
+        self.bot = telegram_bot
+        self.workers = workers
+        self.name = name
+        self.on_receive = on_receive
+        self._offset = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """Fetches and queues one batch of updates."""
+        updates = self.bot.get_updates(offset=self._offset, timeout=POLL_TIMEOUT, allowed_updates=ALLOWED_UPDATES)
+        for update in updates:
+            self._offset = update.update_id + 1
+            if self.on_receive is not None:
+                self.on_receive(update)
+            self.workers.submit(self._process, update)
+        return len(updates)
+
+    def run(self):
+        LOG.debug('%s started', self.name)
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                LOG.error('%s: %s polling updates: %s', self.name, type(e).__name__, str(e))
+                time.sleep(POLL_RETRY_PAUSE)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops after the current long poll returns."""
+        self._stopped.set()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+
+    def _process(self, update):
+        self.bot.process_new_updates([update])
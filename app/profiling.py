@@ -0,0 +1,162 @@
+"""
+On demand profiling of the running bot: allocation sites traced with tracemalloc and hot functions found by sampling
+the stacks of every thread. Nothing runs and nothing is traced until a profile is started.
+"""
+
+import linecache
+import logging
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+
+LOG = logging.getLogger('LaVidaModerna_Bot.profiling')
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+DEFAULT_TRACEBACK_FRAMES = 1
+DEFAULT_TOP = 15
+MAX_SECONDS = 10 * 60
+# Functions of the standard library threads block in while waiting for work, their samples are idle
+IDLE_FUNCTIONS = frozenset(('wait', 'select', 'poll', 'accept', 'readinto', 'recv_into', 'serve_forever'))
+
+
+def _location(filename, line, function=None):
+    location = '%s:%d' % (os.path.basename(filename), line)
+    return location + ' ' + function if function else location
+
+
+class AllocationProfiler:
+    """Memory allocated while it runs, grouped by the line allocating it."""
+
+    def __init__(self, frames=DEFAULT_TRACEBACK_FRAMES):
+        self.frames = frames
+        self._started = None
+
+    def start(self):
+        tracemalloc.start(self.frames)
+        self._started = tracemalloc.take_snapshot()
+
+    def stop(self, top=DEFAULT_TOP):
+        """Stops tracing, returns the report of the top allocation sites."""
+        snapshot = tracemalloc.take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, linecache.__file__)]
+        differences = snapshot.filter_traces(filters).compare_to(self._started.filter_traces(filters), 'lineno')
+        lines = ['Traced {traced:.1f} KiB, peak {peak:.1f} KiB'.format(traced=traced / 1024, peak=peak / 1024)]
+        for difference in differences[:top]:
+            frame = difference.traceback[0]
+            lines.append('{size:+.1f} KiB in {count:+d} blocks: {location}'.format(
+                size=difference.size_diff / 1024, count=difference.count_diff,
+                location=_location(frame.filename, frame.lineno)))
+        return '\n'.join(lines)
+
+
+class SamplingProfiler:
+    """
+    Stacks of the other threads sampled every interval seconds from a background thread. A function is hot when it
+    was running, and busy when it was anywhere in the stack, in many samples. Samples of threads waiting for work
+    are only counted as idle.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.idle = 0
+        self.hot = Counter()
+        self.busy = Counter()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+
+    def stop(self, top=DEFAULT_TOP):
+        """Stops sampling, returns the report of the top hot and busy functions."""
+        self._stopping.set()
+        self._thread.join()
+        lines = ['{samples} samples every {interval:g} ms, {idle} more idle'.format(
+            samples=self.samples, interval=self.interval * 1000, idle=self.idle)]
+        for title, counter in (('Hot', self.hot), ('Busy', self.busy)):
+            lines.append(title + ':')
+            lines.extend('{percent:5.1f}% {location}'.format(percent=count * 100 / max(1, self.samples),
+                                                             location=location)
+                         for location, count in counter.most_common(top))
+        return '\n'.join(lines)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                code = frame.f_code
+                if code.co_name in IDLE_FUNCTIONS:
+                    self.idle += 1
+                    continue
+                self.samples += 1
+                self.hot[_location(code.co_filename, frame.f_lineno, code.co_name)] += 1
+                # Recursive functions count once per sample
+                self.busy.update({_location(f.f_code.co_filename, f.f_code.co_firstlineno, f.f_code.co_name)
+                                  for f in _stack(frame)})
+
+
+def _stack(frame):
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+
+
+_lock = threading.Lock()
+# kind -> event stopping its profile early
+_running = {}
+
+
+def profile(kind, seconds, on_report, top=DEFAULT_TOP):
+    """
+    Runs the 'memory' or 'cpu' profiler for seconds, or until stopped, and passes its report to on_report from a
+    background thread. Returns False when a profile of the same kind is already running.
+    """
+    profiler = AllocationProfiler() if kind == 'memory' else SamplingProfiler()
+    stopping = threading.Event()
+    with _lock:
+        if kind in _running:
+            return False
+        _running[kind] = stopping
+    try:
+        profiler.start()
+    except Exception:
+        with _lock:
+            del _running[kind]
+        raise
+    LOG.info('Profiling %s for %g s', kind, seconds)
+
+    def finish():
+        stopping.wait(seconds)
+        try:
+            report = profiler.stop(top)
+        finally:
+            with _lock:
+                del _running[kind]
+        on_report(report)
+
+    threading.Thread(target=finish, name='Profile ' + kind, daemon=True).start()
+    return True
+
+
+def stop(kind):
+    """Ends a running profile before its time, returns False if none was running."""
+    with _lock:
+        stopping = _running.get(kind)
+    if stopping is None:
+        return False
+    stopping.set()
+    return True
+
+
+def running():
+    """Kinds of the profiles running."""
+    with _lock:
+        return sorted(_running)
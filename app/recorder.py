@@ -0,0 +1,151 @@
+"""
+Recording of the raw updates received by the bots, to replay real traffic against other builds with
+tests/replay_updates.py. Updates are appended as compact JSON lines to a gzip file from a background thread, every
+start of a recording adding a new gzip member to it.
+"""
+
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+LOG = logging.getLogger('LaVidaModerna_Bot.recorder')
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_FLUSH_INTERVAL = 5
+# Keys of the users and chats kept by the anonymization, the rest identify them
+_ANONYMOUS_KEYS = ('is_bot', 'language_code', 'type')
+_PERSON_KEYS = ('from', 'chat', 'user')
+
+
+def to_dict(value):
+    """JSON representation of a telebot object, like the ones polling returns, or the value as is."""
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [to_dict(item) for item in value]
+    # Messages keep the JSON they were parsed from
+    raw = getattr(value, 'json', None)
+    if isinstance(raw, dict):
+        return raw
+    if hasattr(value, '__dict__'):
+        return {('from' if key == 'from_user' else key): to_dict(item) for key, item in vars(value).items()
+                if item is not None}
+    return value
+
+
+class Anonymizer:
+    """
+    Replaces the ids of users and chats by keyed hashes, stable for a given key so the same user keeps the same id
+    across a recording, and drops their names.
+    """
+
+    def __init__(self, key=None):
+        self.key = key or os.urandom(16)
+
+    def id(self, value):
+        digest = hmac.new(self.key, str(abs(value)).encode(), hashlib.sha256).digest()
+        anonymous = int.from_bytes(digest[:4], 'big') & 0x7fffffff or 1
+        # Group chats keep their negative ids
+        return -anonymous if value < 0 else anonymous
+
+    def __call__(self, update):
+        if isinstance(update, list):
+            return [self(item) for item in update]
+        if not isinstance(update, dict):
+            return update
+        return {key: self._person(value) if key in _PERSON_KEYS and isinstance(value, dict) else self(value)
+                for key, value in update.items()}
+
+    def _person(self, person):
+        anonymous = {key: person[key] for key in _ANONYMOUS_KEYS if key in person}
+        if 'id' in person:
+            anonymous['id'] = self.id(person['id'])
+        if 'first_name' in person:
+            anonymous['first_name'] = 'User'
+        if 'username' in person:
+            anonymous['username'] = 'user%d' % anonymous.get('id', 0)
+        if 'title' in person:
+            anonymous['title'] = 'Chat'
+        return anonymous
+
+
+class UpdateRecorder:
+    """
+    Appends {"t": epoch, "bot": name, "update": update} lines to path for every recorded update. The receiving
+    threads only queue them, updates are dropped and counted when the writer falls queue_size behind.
+    """
+
+    def __init__(self, path, anonymize=False, queue_size=DEFAULT_QUEUE_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.anonymizer = Anonymizer() if anonymize else None
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+
+    def record(self, update, bot=''):
+        try:
+            self._queue.put_nowait((time.time(), bot, update))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='UpdateRecorder', daemon=True)
+        self._thread.start()
+        LOG.info('Recording updates to %s', self.path)
+        return self
+
+    def close(self):
+        """Writes the updates still queued and closes the file."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            LOG.info('Update recorder closed: %d recorded, %d dropped.', self.recorded, self.dropped)
+
+    def _run(self):
+        with gzip.open(self.path, 'at', encoding='utf-8') as recording:
+            flushed = time.monotonic()
+            while True:
+                try:
+                    entry = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    entry = ()
+                if entry is None:
+                    return
+                if entry:
+                    self._write(recording, *entry)
+                if time.monotonic() - flushed >= self.flush_interval:
+                    # Completes the gzip blocks written so far, in case the process dies
+                    recording.flush()
+                    flushed = time.monotonic()
+
+    def _write(self, recording, timestamp, bot, update):
+        try:
+            update = to_dict(update)
+            if self.anonymizer is not None:
+                update = self.anonymizer(update)
+            entry = {'t': round(timestamp, 3), 'update': update}
+            if bot:
+                entry['bot'] = bot
+            recording.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self.recorded += 1
+        except Exception as e:
+            self.dropped += 1
+            LOG.error("Couldn't record update: %s", e)
+
+
+def read(path):
+    """(epoch, bot name, update dict) of every update recorded in path, in order."""
+    with gzip.open(path, 'rt', encoding='utf-8') as recording:
+        for line in recording:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry['t'], entry.get('bot', ''), entry['update']
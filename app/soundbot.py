@@ -0,0 +1,384 @@
+"""
+One Telegram inline bot serving the sounds of one catalog. Several of them can be hosted in the same process, sharing
+the database, the history writer, the update workers and the metrics registry.
+"""
+
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import telebot
+import telebot.types as types
+import metrics
+import profiling
+import PrettyUptime
+from coalescing import QueryCoalescer
+from persistence import export
+from persistence.recents import RecentSounds
+from persistence.stats import HOUR, DAY, to_epoch
+from persistence.sync import diff_sounds
+from catalog import Catalog, Popularity, Recommendations, VoiceUploader, parse_offset, snapshot
+
+TELEGRAM_INLINE_MAX_RESULTS = 48
+TELEGRAM_METHODS = ('answer_inline_query', 'send_message', 'send_voice', 'send_document')
+HANDLERS = ('send_welcome', 'query_empty', 'query_text', 'on_result', 'send_stats', 'send_uptime', 'send_metrics',
+            'send_profile', 'send_export')
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+TELEGRAM_MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+DEFAULT_PROFILE_SECONDS = 30
+
+
+class SoundBot:
+    """
+    Handlers of a bot configured by args, the parsed arguments of bot.py. name labels its metrics and logs, single
+    bot deployments leave it empty. The catalog is only served after reload_catalog. Received updates are also
+    given to recorder, a recorder.UpdateRecorder, if any.
+    """
+
+    def __init__(self, args, database, history, telegram_bot=None, name='', recorder=None):
+        self.args = args
+        self.name = name
+        self.database = database
+        self.history = history
+        self.recorder = recorder
+        self.log = logging.getLogger('LaVidaModerna_Bot' + ('.' + name if name else ''))
+        self.catalog = None
+        self.uploader = None
+        # Every bot hosted in the process, set by bot.setup, the sounds of any of them can be in the stats
+        self.hosted = [self]
+        self.recents = RecentSounds(loader=functools.partial(database.get_latest_used_sound_ids,
+                                                             catalog=args.catalog_name))
+        self.popularity = Popularity(half_life=args.popularity_half_life * DAY, top_size=TELEGRAM_INLINE_MAX_RESULTS)
+        self.popularity.load((sound_id, to_epoch(timestamp), uses) for sound_id, timestamp, uses
+                             in database.get_sound_uses(catalog=args.catalog_name))
+        self.popularity.start(args.popularity_refresh)
+        self.recommendations = None
+        if args.recommendations_refresh > 0:
+            self.recommendations = Recommendations(top_size=TELEGRAM_INLINE_MAX_RESULTS)
+            self.recommendations.load(database.get_user_sound_uses(catalog=args.catalog_name))
+            self.recommendations.start(args.recommendations_refresh)
+        # Only the last query of a typing burst is recorded
+        self.coalescer = QueryCoalescer(history.add_query, window=args.query_window).start()
+
+        registry = metrics.REGISTRY
+        self.search_hits = registry.counter('bot_search_queries_total', 'Text queries by outcome.', result='hit',
+                                            bot=name)
+        self.search_misses = registry.counter('bot_search_queries_total', 'Text queries by outcome.', result='miss',
+                                              bot=name)
+        registry.gauge('bot_catalog_sounds', 'Sounds being served.', lambda: len(self.catalog), bot=name)
+        for key in ('hits', 'misses', 'size'):
+            registry.gauge('bot_query_cache_' + key, 'Query result cache ' + key + '.',
+                           lambda key=key: self.catalog.cache.info()[key], bot=name)
+        registry.gauge('bot_queries_superseded', 'Inline queries left unanswered because the user typed a newer one.',
+                       lambda: self.coalescer.skipped, bot=name)
+        registry.gauge('bot_queries_coalesced', 'Inline queries not recorded because the user typed a newer one.',
+                       lambda: self.coalescer.coalesced, bot=name)
+
+        # Updates are dispatched from the worker pool shared by every bot
+        self.bot = telegram_bot or telebot.TeleBot(args.token, threaded=False)
+        metrics.instrument(self.bot, 'bot_telegram_request', 'Telegram Bot API call latency.', label='method',
+                           methods=TELEGRAM_METHODS, bot=name)
+        metrics.instrument(self, 'bot_handler', 'Update handler latency.', label='handler', methods=HANDLERS,
+                           bot=name)
+        self.register_handlers()
+        if args.upload_chat:
+            self.uploader = VoiceUploader(self.bot, args.upload_chat, database.set_sound_file, args.bucket,
+                                          sounds_dir=args.sounds_dir, pause=args.upload_pause)
+
+    def register_handlers(self):
+        self.bot.register_message_handler(self.send_welcome, commands=['start'])
+        self.bot.register_inline_handler(self.query_empty, lambda query: query.query == '')
+        self.bot.register_inline_handler(self.query_text, lambda query: query.query)
+        self.bot.register_chosen_inline_handler(self.on_result, lambda chosen_inline_result: True)
+        # Admin commands
+        self.bot.register_message_handler(self.send_stats, commands=['stats'], func=self.message_is_from_host_admin)
+        self.bot.register_message_handler(self.send_uptime, commands=['uptime'], func=self.message_is_from_admin)
+        self.bot.register_message_handler(self.send_metrics, commands=['metrics'], func=self.message_is_from_admin)
+        self.bot.register_message_handler(self.send_profile, commands=['memprofile', 'cpuprofile'],
+                                          func=self.message_is_from_admin)
+        self.bot.register_message_handler(self.send_export, commands=['export'],
+                                          func=self.message_is_from_host_admin)
+
+    def receive(self, update):
+        """Called with every update as it is received, before it waits for a worker."""
+        self.coalescer.receive(update)
+        if self.recorder is not None:
+            self.recorder.record(update, self.name)
+
+    def process_update(self, update):
+        self.bot.process_new_updates([types.Update.de_json(update)])
+
+    def send_welcome(self, message):
+        self.log.debug(message)
+        cid = message.chat.id
+        self.bot.send_message(cid,
+                              "Este bot es inline. Teclea su nombre en una conversación/grupo y podras enviar un "
+                              "mensaje moderno.")
+        self.database.add_or_update_user(message.from_user)
+
+    def query_empty(self, inline_query):
+        self.log.debug(inline_query)
+        if self.coalescer.superseded(inline_query):
+            return
+        offset = parse_offset(inline_query.offset)
+        user_id = inline_query.from_user.id
+        # Sounds recommended to the user go before the popular ones
+        popular_ids = self.popularity.top()
+        if self.recommendations is not None:
+            popular_ids = self.recommendations.recommend(user_id) + popular_ids
+        r, next_offset = self.catalog.default_page(self.recents.get(user_id), offset, self.args.page_size,
+                                                   popular_ids=popular_ids)
+        self.bot.answer_inline_query(inline_query.id, r, is_personal=True, cache_time=5, next_offset=next_offset)
+        if not offset:
+            self.on_query(inline_query)
+
+    def query_text(self, inline_query):
+        self.log.debug(inline_query)
+        # Telegram clients discard the answers to the queries the user kept typing past
+        if self.coalescer.superseded(inline_query):
+            return
+        try:
+            self.log.debug("Querying: %s", inline_query.query)
+            offset = parse_offset(inline_query.offset)
+            r, next_offset = self.catalog.query_page(inline_query.query, offset, self.args.page_size)
+            if self.coalescer.superseded(inline_query):
+                return
+            self.bot.answer_inline_query(inline_query.id, r, cache_time=5, next_offset=next_offset)
+            # Next pages are the same query scrolled further
+            if not offset:
+                (self.search_hits if r else self.search_misses).inc()
+                self.on_query(inline_query)
+        except Exception as e:
+            self.log.error("Query aborted: %s", e)
+
+    def on_result(self, chosen_inline_result):
+        self.log.debug('Chosen result: %s', chosen_inline_result)
+        try:
+            # The query leading to the result is recorded before it
+            self.coalescer.flush(chosen_inline_result.from_user.id)
+            self.history.add_result(chosen_inline_result)
+            self.recents.add(chosen_inline_result.from_user.id, int(chosen_inline_result.result_id))
+            self.popularity.record(int(chosen_inline_result.result_id))
+            if self.recommendations is not None:
+                self.recommendations.record(chosen_inline_result.from_user.id, int(chosen_inline_result.result_id))
+        except Exception as e:
+            self.log.error("Couldn't save result: %s", e)
+
+    def on_query(self, query):
+        self.coalescer.add(query)
+
+    def synchronize_sounds(self):
+        with open(self.args.data) as data_json_file:
+            json_sounds = json.load(data_json_file)["sounds"]
+        self.log.debug("Sounds in data.json (%d)", len(json_sounds))
+
+        catalog_name = self.args.catalog_name
+        diff = diff_sounds(self.database.get_all_sounds(catalog=catalog_name), json_sounds)
+        if diff:
+            self.database.apply_sound_diff(diff, catalog=catalog_name)
+        return self.database.get_sounds(catalog=catalog_name)
+
+    def catalog_version(self):
+        return snapshot.data_version(self.args.data, self.args.bucket,
+                                     self.database.get_sounds_version(catalog=self.args.catalog_name))
+
+    def reload_catalog(self, use_snapshot=False):
+        """Builds the catalog from the synchronized sounds, or loads it from its snapshot if allowed and up to date."""
+        loaded = None
+        if use_snapshot and self.args.catalog_snapshot:
+            loaded = snapshot.load(self.args.catalog_snapshot, self.catalog_version())
+        if loaded is not None:
+            self.catalog = loaded
+            self.log.debug('Catalog loaded from snapshot %s', self.args.catalog_snapshot)
+        else:
+            self.catalog = Catalog(self.synchronize_sounds(), self.args.bucket)
+            if self.args.catalog_snapshot:
+                snapshot.save(self.catalog, self.args.catalog_snapshot, self.catalog_version())
+        self.log.info('Serving %i sounds, %i from Telegram.', len(self.catalog),
+                      sum(1 for sound in self.catalog.sounds if sound['file_id']))
+        if self.uploader is not None:
+            # Reloads again once new uploads are stored, nothing is pending then
+            self.uploader.start(self.catalog.sounds, on_done=lambda uploaded: self.reload_catalog())
+
+    # ADMIN COMMANDS
+
+    def message_is_from_admin(self, message):
+        from_user = message.from_user
+        return from_user.username == self.args.admin
+
+    def message_is_from_host_admin(self, message):
+        """
+        Whether the message comes from the admin of the whole process. The stats and the history are shared by every
+        bot hosted, so the admins of single bots of a --config file are not sent them.
+        """
+        return self.args.host_admin is not None and message.from_user.username == self.args.host_admin
+
+    def sound_text(self, sound_id):
+        """Text of a sound served by any hosted bot, its id if none serves it."""
+        for sound_bot in self.hosted:
+            if sound_bot.catalog is not None and sound_id in sound_bot.catalog.by_id:
+                return sound_bot.catalog.by_id[sound_id]['text']
+        return sound_id
+
+    def send_stats(self, message):
+        self.log.debug(message)
+        cid = message.chat.id
+        uptime = PrettyUptime.get_pretty_python_uptime(custom_name='Bot')
+        stats = self.database.stats.snapshot()
+        cache = self.catalog.cache.info()
+        top_sounds = ''.join('{position}. {text} ({uses})\n'.format(position=position, text=self.sound_text(sound_id),
+                                                                    uses=uses)
+                             for position, (sound_id, uses) in enumerate(stats['top_sounds'], start=1))
+        window_stats = ''.join('*Last {window}:*\n'
+                               '👥 Active users: {active_users}\n'
+                               '🔎 Queries: {queries}\n'
+                               '🔊 Results: {results}\n'.format(window=name,
+                                                                active_users=stats['active_users'][window],
+                                                                queries=stats['window_queries'][window],
+                                                                results=stats['window_results'][window])
+                               for name, window in (('hour', HOUR), ('day', DAY)))
+        self.bot.send_message(cid,
+                              '🤖 {uptime}\n'
+                              '*All time stats{scope}:*\n'
+                              '👥 Users: {num_users}\n'
+                              '🔎 Queries: {num_queries}\n'
+                              '🔊 Results: {num_results}\n'
+                              '{window_stats}'
+                              '*Top sounds:*\n'
+                              '{top_sounds}'
+                              '🗃 Query cache: {cache_hits} hits, {cache_misses} misses\n'.format(
+                                  num_users=stats['users'], num_queries=stats['queries'],
+                                  num_results=stats['results'], window_stats=window_stats, top_sounds=top_sounds,
+                                  cache_hits=cache['hits'], cache_misses=cache['misses'], uptime=uptime,
+                                  scope=' of the {bots} bots'.format(bots=len(self.hosted)) if len(self.hosted) > 1
+                                  else ''),
+                              parse_mode='Markdown')
+
+    def send_uptime(self, message):
+        self.log.debug(message)
+        cid = message.chat.id
+        py_uptime = PrettyUptime.get_pretty_python_uptime(custom_name='Bot')
+        machine_uptime = PrettyUptime.get_pretty_machine_uptime_string()
+        machine_info = PrettyUptime.get_pretty_machine_info()
+        self.bot.send_message(cid,
+                              '💻 {machine_info}\n'
+                              '⌛ {machine_uptime}\n'
+                              '🤖 {py_uptime}\n'
+                              '📈 {resources}\n'
+                              '♻ {gc}\n'
+                              '🗃 {sizes}\n'
+                              .format(machine_info=machine_info, machine_uptime=machine_uptime,
+                                      py_uptime=py_uptime, resources=PrettyUptime.get_pretty_process_resources(),
+                                      gc=PrettyUptime.get_pretty_gc_stats(),
+                                      sizes=PrettyUptime.get_pretty_sizes(self.sizes())))
+
+    def sizes(self):
+        """(name, size) of the catalog and of what the bot keeps in memory."""
+        cache = self.catalog.cache
+        sizes = [('Sounds', len(self.catalog)), ('Query cache', '%d/%d' % (len(cache), cache.max_size)),
+                 ('Recent users', len(self.recents)), ('Pending queries', self.coalescer.pending()),
+                 ('History queue', self.history.pending())]
+        if self.recommendations is not None:
+            sizes += [('Recommended users', len(self.recommendations)),
+                      ('Recommendation cache', len(self.recommendations.cache))]
+        return sizes
+
+    def send_profile(self, message):
+        """/memprofile or /cpuprofile [seconds|stop], the report is sent once the profile ends."""
+        self.log.debug(message)
+        cid = message.chat.id
+        kind = 'memory' if telebot.util.extract_command(message.text) == 'memprofile' else 'cpu'
+        argument = telebot.util.extract_arguments(message.text).strip()
+        if argument == 'stop':
+            if not profiling.stop(kind):
+                self.bot.send_message(cid, 'No {kind} profile running.'.format(kind=kind))
+            return
+        try:
+            seconds = float(argument) if argument else DEFAULT_PROFILE_SECONDS
+        except ValueError:
+            seconds = 0
+        if not 0 < seconds <= profiling.MAX_SECONDS:
+            self.bot.send_message(cid, 'Seconds must be between 0 and {max:d}.'.format(max=profiling.MAX_SECONDS))
+            return
+
+        def on_report(report):
+            try:
+                self.bot.send_message(cid, report[:TELEGRAM_MAX_MESSAGE_LENGTH])
+            except Exception as e:
+                self.log.error("Couldn't send %s profile: %s", kind, e)
+
+        if profiling.profile(kind, seconds, on_report):
+            self.bot.send_message(cid, 'Profiling {kind} for {seconds:g} s.'.format(kind=kind, seconds=seconds))
+        else:
+            self.bot.send_message(cid, 'A {kind} profile is already running.'.format(kind=kind))
+
+    def send_metrics(self, message):
+        self.log.debug(message)
+        cid = message.chat.id
+        lines = []
+        for name, help, kind, family in metrics.REGISTRY.collect():
+            if kind != 'histogram':
+                continue
+            errors = dict(metrics.REGISTRY.family(name[:-len('_seconds')] + '_errors_total'))
+            lines.append('*{help}*'.format(help=help))
+            for labels, histogram in family:
+                if histogram.count:
+                    lines.append('{label}: {count} calls, {errors} errors, {mean:.1f} ms mean, '
+                                 'p95 ≤ {p95:g} ms'.format(
+                        label='/'.join(value for _, value in labels if value), count=histogram.count,
+                        errors=errors[labels].value if labels in errors else 0,
+                        mean=histogram.sum / histogram.count * 1000, p95=histogram.quantile(0.95) * 1000))
+        self.bot.send_message(cid,
+                              '⏱ {py_uptime}\n'
+                              '🔎 Searches: {hits} with results, {misses} without\n'
+                              '{latencies}\n'
+                              .format(py_uptime=PrettyUptime.get_pretty_python_uptime(custom_name='Bot'),
+                                      hits=self.search_hits.value, misses=self.search_misses.value,
+                                      latencies='\n'.join(lines).replace('_', '\\_')),
+                              parse_mode='Markdown')
+
+    def send_export(self, message):
+        """/export [queries|results|users] [csv|jsonl] [since [until]], sent as a gzipped file once written."""
+        self.log.debug(message)
+        cid = message.chat.id
+        arguments = telebot.util.extract_arguments(message.text).split()
+        table = arguments.pop(0) if arguments and arguments[0] in export.TABLES else 'results'
+        format = 'csv'
+        times = []
+        try:
+            for argument in arguments:
+                if argument in export.FORMATS:
+                    format = argument
+                else:
+                    times.append(export.parse_time(argument))
+            if len(times) > 2:
+                raise ValueError('Give at most a start and an end time')
+            since, until = (times + [None, None])[:2]
+            rows = self.database.export_rows(table, since, until)
+        except ValueError as e:
+            self.bot.send_message(cid, '{error}.\nUsage: /export [{tables}] [{formats}] [since [until]]'.format(
+                error=e, tables='|'.join(sorted(export.TABLES)), formats='|'.join(export.FORMATS)))
+            return
+
+        def run():
+            try:
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, '{table}.{format}.gz'.format(table=table, format=format))
+                    with export.open_output(path) as output:
+                        written = export.write_rows(rows, export.TABLES[table][0], output, format)
+                    size = os.path.getsize(path)
+                    if size > TELEGRAM_MAX_DOCUMENT_SIZE:
+                        self.bot.send_message(cid, 'The export of {rows} {table} takes {size:.1f} MiB, too big to be '
+                                                   'sent. Use persistence.export instead.'.format(
+                                                       rows=written, table=table, size=size / 1024 / 1024))
+                        return
+                    with open(path, 'rb') as document:
+                        self.bot.send_document(cid, document, caption='{rows} {table}'.format(rows=written,
+                                                                                             table=table))
+            except Exception as e:
+                self.log.error("Couldn't export %s: %s", table, e)
+
+        # Exports can take long, the update workers are not kept waiting
+        threading.Thread(target=run, name='Export ' + table, daemon=True).start()
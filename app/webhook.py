@@ -0,0 +1,161 @@
+"""
+Embedded HTTP server receiving Telegram updates through a webhook and handing them to a bounded worker pool, which
+bots receiving their updates by long polling can share.
+"""
+
+import json
+import logging
+import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+LOG = logging.getLogger('LaVidaModerna_Bot.webhook')
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_BACKPRESSURE_TIMEOUT = 5
+
+
+def _update_id(update):
+    return update.get('update_id') if isinstance(update, dict) else getattr(update, 'update_id', None)
+
+
+class UpdateWorkers:
+    """Runs process(update) on worker threads, with at most queue_size updates waiting for a free one."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='UpdateWorker')
+
+    def submit(self, process, update, timeout=None):
+        """Queues an update. Returns False if no slot freed up in timeout seconds, waits for one if it is None."""
+        if not self._slots.acquire(timeout=timeout):
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        self._executor.submit(self._process, process, update)
+        return True
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _process(self, process, update):
+        try:
+            process(update)
+        except Exception as e:
+            self.failed += 1
+            LOG.error("Couldn't process update %s: %s", _update_id(update), str(e))
+        finally:
+            self._slots.release()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class WebhookServer:
+    """
+    Accepts POSTed updates on path and runs process_update(update_dict) on a pool of worker threads. At most
+    queue_size updates wait for a free worker, further requests wait up to backpressure_timeout seconds and are then
+    answered with 503 so Telegram retries them later.
+
+    Bots sharing the server get a path each with add_route, and a shared UpdateWorkers can be given as pool.
+    """
+
+    def __init__(self, process_update=None, host='0.0.0.0', port=8443, path='/', secret_token=None,
+                 workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 backpressure_timeout=DEFAULT_BACKPRESSURE_TIMEOUT, certificate=None, private_key=None, pool=None):
+        self.routes = {}
+        self.backpressure_timeout = backpressure_timeout
+        self.pool = pool or UpdateWorkers(workers, queue_size)
+        if process_update is not None:
+            self.add_route(path, process_update, secret_token)
+        self._server = _ThreadingHTTPServer((host, port), self._handler_class())
+        if certificate:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certificate, private_key)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def accepted(self):
+        return self.pool.accepted
+
+    @property
+    def rejected(self):
+        return self.pool.rejected
+
+    @property
+    def failed(self):
+        return self.pool.failed
+
+    def add_route(self, path, process_update, secret_token=None, on_receive=None):
+        """
+        Updates POSTed on path are processed by process_update, if they carry secret_token when given. on_receive is
+        called with them on the request thread, before they wait for a worker.
+        """
+        self.routes[path] = (process_update, secret_token, on_receive)
+
+    def serve_forever(self):
+        LOG.info('Webhook listening on port %d paths %s', self.port, ', '.join(sorted(self.routes)))
+        self._server.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='WebhookServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self.pool.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, update, process_update):
+        """Queues an update for the workers. Returns False if the pool stayed saturated for backpressure_timeout."""
+        if not self.pool.submit(process_update, update, timeout=self.backpressure_timeout):
+            LOG.warning('Worker pool saturated, rejecting update %s', update.get('update_id'))
+            return False
+        return True
+
+    def _handler_class(self):
+        webhook = self
+
+        class UpdateHandler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                if self.path not in webhook.routes:
+                    return self._reply(404)
+                process_update, secret_token, on_receive = webhook.routes[self.path]
+                if secret_token and self.headers.get(SECRET_TOKEN_HEADER) != secret_token:
+                    return self._reply(403)
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    update = json.loads(self.rfile.read(length).decode('utf-8'))
+                except ValueError:
+                    return self._reply(400)
+                if on_receive is not None:
+                    on_receive(update)
+                self._reply(200 if webhook.submit(update, process_update) else 503)
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                LOG.debug('%s - %s', self.address_string(), format % args)
+
+        return UpdateHandler
@@ -0,0 +1,202 @@
+"""
+Load generation benchmark for the inline handlers of bot.py.
+
+Synthetic users type the tags of a sound one keystroke at a time, starting from the empty query, and sometimes
+choose a result. The resulting updates drive query_empty, query_text and on_result against a stub Telegram API and a
+scratch SQLite database, and every history batch written by the persistence layer is timed too.
+
+    python -m tests.benchmark_handlers --sounds 100 1000 100000 --save tests/baselines/handlers.json
+    python -m tests.benchmark_handlers --baseline tests/baselines/handlers.json
+
+Each catalog size runs in its own process, the bot and its persistence layer are set up once per process.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'app')
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+SYLLABLES = ('ca', 'pa', 'cha', 'o', 'ju', 'lio', 'mo', 'der', 'na', 'vi', 'da', 'es', 'pa', 'ña', 'ra', 'dio',
+             'que', 'ti', 'to', 'el', 'la', 'si', 'no', 'gri', 'to', 'fa', 'rray', 'bro', 'ma', 'zo', 'rro')
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(latencies, elapsed=None):
+    """Throughput and latency percentiles in milliseconds of a list of latencies in seconds."""
+    latencies = sorted(latencies)
+    busy = sum(latencies)
+    return {
+        'count': len(latencies),
+        'throughput': len(latencies) / (elapsed or busy) if latencies and (elapsed or busy) else 0,
+        'p50': percentile(latencies, 0.5) * 1000 if latencies else 0,
+        'p95': percentile(latencies, 0.95) * 1000 if latencies else 0,
+        'p99': percentile(latencies, 0.99) * 1000 if latencies else 0,
+    }
+
+
+def random_word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+
+
+def synthetic_catalog(size, seed=0):
+    rng = random.Random(seed)
+    vocabulary = [random_word(rng) for _ in range(max(50, size // 4))]
+    sounds = []
+    for number in range(size):
+        words = rng.sample(vocabulary, rng.randint(2, 6))
+        sounds.append({'filename': 'sound%d.ogg' % number, 'text': ' '.join(words).capitalize(),
+                       'tags': ' '.join(words)})
+    return {'title': 'Benchmark', 'sounds': sounds}
+
+
+def synthetic_updates(sounds, users, sessions, choose_ratio=0.6, seed=0):
+    """Update dicts of sessions typing sessions: empty query, keystrokes and sometimes the chosen result."""
+    rng = random.Random(seed)
+    updates = []
+    update_id = 0
+    for session in range(sessions):
+        user = {'id': rng.randint(1, users), 'is_bot': False, 'first_name': 'User', 'language_code': 'es'}
+        user['username'] = 'user%d' % user['id']
+        target = rng.choice(sounds)
+        words = target['tags'].split()[:rng.randint(1, 2)]
+        typed = ' '.join(words)
+        texts = [''] + [typed[:length] for length in range(1, len(typed) + 1) if not typed[:length].endswith(' ')]
+        for text in texts:
+            update_id += 1
+            updates.append({'update_id': update_id, 'inline_query': {
+                'id': str(update_id), 'from': user, 'query': text, 'offset': '', 'chat_type': 'sender'}})
+        if rng.random() < choose_ratio:
+            update_id += 1
+            updates.append({'update_id': update_id, 'chosen_inline_result': {
+                'result_id': str(target['id']), 'from': user, 'query': typed}})
+    return updates
+
+
+def run_size(size, users, sessions, results):
+    sys.path.insert(0, APP_DIR)
+    import telebot
+    import telebot.types as types
+    import bot
+    from tests.stub_telegram import StubTelegram
+
+    with tempfile.TemporaryDirectory() as directory:
+        data_file = os.path.join(directory, 'data.json')
+        with open(data_file, 'w') as data:
+            json.dump(synthetic_catalog(size), data)
+        stub = StubTelegram().install()
+        started = time.perf_counter()
+        bot.setup(bot.parse_args(['--token', '0:benchmark', '--verbosity', 'WARN', '--data', data_file,
+                                  '--sqlite', os.path.join(directory, 'db.sqlite'),
+                                  '--history-spill-file', os.path.join(directory, 'history.spill')]),
+                  telegram_bot=telebot.TeleBot('0:benchmark', threaded=False))
+        setup_time = time.perf_counter() - started
+        sound_bot = bot.bots[0]
+
+        latencies = defaultdict(list)
+        add_history = bot.database.add_history
+
+        def timed_add_history(events):
+            batch_started = time.perf_counter()
+            add_history(events)
+            latencies['add_history'].append(time.perf_counter() - batch_started)
+
+        bot.database.add_history = timed_add_history
+
+        sounds = sound_bot.catalog.sounds
+        updates = [types.Update.de_json(update) for update in synthetic_updates(sounds, users, sessions)]
+        started = time.perf_counter()
+        for update in updates:
+            if update.chosen_inline_result is not None:
+                handler, argument = sound_bot.on_result, update.chosen_inline_result
+            elif update.inline_query.query:
+                handler, argument = sound_bot.query_text, update.inline_query
+            else:
+                handler, argument = sound_bot.query_empty, update.inline_query
+            handler_started = time.perf_counter()
+            handler(argument)
+            latencies[handler.__name__].append(time.perf_counter() - handler_started)
+        elapsed = time.perf_counter() - started
+        sound_bot.coalescer.stop()
+        bot.history.close()
+        stub.uninstall()
+
+    report = {name: summarize(values) for name, values in latencies.items()}
+    report['all_updates'] = summarize([value for name, values in latencies.items() if name != 'add_history'
+                                       for value in values], elapsed)
+    report['setup'] = {'seconds': setup_time}
+    report['telegram'] = {'calls': dict(stub.calls), 'bytes_sent': stub.bytes_sent}
+    results.put(report)
+
+
+def print_report(title, report, baseline=None, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """Prints a report, returns the names of the handlers whose p95 regressed more than threshold."""
+    print('\n%s, setup %.2f s' % (title, report['setup']['seconds']))
+    print('{:<14}{:>8}{:>12}{:>10}{:>10}{:>10}{:>12}'.format('handler', 'calls', 'calls/s', 'p50 ms', 'p95 ms',
+                                                             'p99 ms', 'p95 change'))
+    regressions = []
+    for name, stats in sorted(report.items()):
+        if 'p95' not in stats:
+            continue
+        change = ''
+        if baseline and name in baseline and baseline[name]['p95']:
+            ratio = stats['p95'] / baseline[name]['p95'] - 1
+            change = '{:+.0%}'.format(ratio)
+            if ratio > threshold:
+                regressions.append(name)
+                change += ' !'
+        print('{:<14}{:>8}{:>12.0f}{:>10.3f}{:>10.3f}{:>10.3f}{:>12}'.format(
+            name, stats['count'], stats['throughput'], stats['p50'], stats['p95'], stats['p99'], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the inline handlers.")
+    parser.add_argument("--sounds", type=int, nargs='+', help="Catalog sizes to benchmark.", default=DEFAULT_SIZES)
+    parser.add_argument("--users", type=int, help="Distinct synthetic users.", default=1000)
+    parser.add_argument("--sessions", type=int, help="Typing sessions per catalog size.", default=2000)
+    parser.add_argument("--save", type=str, help="Store the results as a baseline in this JSON file.")
+    parser.add_argument("--baseline", type=str, help="Compare the results with this baseline JSON file.")
+    parser.add_argument("--threshold", type=float, help="p95 increase over the baseline reported as regression.",
+                        default=DEFAULT_REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    context = multiprocessing.get_context('spawn')
+    reports = {}
+    regressions = []
+    for size in args.sounds:
+        results = context.Queue()
+        process = context.Process(target=run_size, args=(size, args.users, args.sessions, results))
+        process.start()
+        reports[str(size)] = results.get()
+        process.join()
+        regressions += ['%s (%d sounds)' % (name, size) for name in
+                        print_report('Catalog of %d sounds' % size, reports[str(size)], baseline.get(str(size)),
+                                     args.threshold)]
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as save_file:
+            json.dump(reports, save_file, indent=2, sort_keys=True)
+    if regressions:
+        print('\nRegressions: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
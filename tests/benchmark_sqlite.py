@@ -0,0 +1,112 @@
+"""
+Microbenchmark: latency of the inline query reads (user lookup and recently used sounds) while history rows are
+being written by another thread, with the default SQLite settings and with the tuned mode.
+
+    python tests/benchmark_sqlite.py [--users 500] [--rows 50000] [--reads 3000]
+
+Each mode runs in its own process, the persistence layer can only be bound once per process.
+"""
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'app')
+
+MODES = (
+    ('default', ''),
+    ('tuned', '?tuned'),
+)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_mode(sqlite_path, users, rows, reads, results):
+    sys.path.insert(0, APP_DIR)
+    from persistence import Database
+    from persistence.sqlite import parse_sqlite_path
+    from persistence.writebehind import HistoryEvent, RESULT
+
+    filename, options = parse_sqlite_path(sqlite_path)
+    database = Database('sqlite', filename=filename, sqlite_options=options)
+
+    sound_ids = list(range(1, 201))
+    database.apply_sound_diff(_seed_diff(sound_ids))
+    sound_ids = [sound['id'] for sound in database.get_sounds()]
+    user_dicts = [{'id': user_id, 'is_bot': False, 'first_name': 'user', 'last_name': None,
+                   'username': 'user%d' % user_id, 'language_code': 'es'} for user_id in range(1, users + 1)]
+
+    def event(timestamp):
+        return HistoryEvent(RESULT, random.choice(user_dicts), random.choice(sound_ids), timestamp)
+
+    start = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+    for offset in range(0, rows, 1000):
+        database.add_history([event(start + datetime.timedelta(seconds=offset + i)) for i in range(1000)])
+
+    stop = threading.Event()
+    writes = [0]
+
+    def write_load():
+        # One transaction per event, like the handlers did before the write-behind queue
+        while not stop.is_set():
+            database.add_history([event(datetime.datetime.utcnow())])
+            writes[0] += 1
+
+    writer = threading.Thread(target=write_load, daemon=True)
+    writer.start()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(reads):
+        user_id = random.randint(1, users)
+        read_started = time.perf_counter()
+        database.get_user(id=user_id)
+        database.get_latest_used_sound_ids(user_id)
+        latencies.append(time.perf_counter() - read_started)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    writer.join()
+
+    latencies.sort()
+    results.put({'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95),
+                 'p99': percentile(latencies, 0.99), 'max': latencies[-1], 'writes_per_second': writes[0] / elapsed})
+
+
+def _seed_diff(sound_ids):
+    from persistence.sync import SoundDiff
+    added = [{'filename': 'sound%d.ogg' % sound_id, 'text': 'Sound %d' % sound_id, 'tags': 'sound %d' % sound_id}
+             for sound_id in sound_ids]
+    return SoundDiff(added, [], [])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--reads", type=int, default=3000)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    print('{:<10}{:>10}{:>10}{:>10}{:>10}{:>12}'.format('mode', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'writes/s'))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, options in MODES:
+            results = context.Queue()
+            path = os.path.join(directory, name + '.sqlite') + options
+            process = context.Process(target=run_mode, args=(path, args.users, args.rows, args.reads, results))
+            process.start()
+            result = results.get()
+            process.join()
+            print('{:<10}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}{:>12.0f}'.format(
+                name, result['p50'] * 1000, result['p95'] * 1000, result['p99'] * 1000, result['max'] * 1000,
+                result['writes_per_second']))
+
+
+if __name__ == '__main__':
+    main()
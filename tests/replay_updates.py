@@ -0,0 +1,158 @@
+"""
+Replay of the updates recorded by bot.py --record-updates through the handlers of bot.py, against a stub Telegram API
+and a scratch SQLite database. Reports the latency of every handler and the history written, so builds can be
+compared on real traffic.
+
+    python -m tests.replay_updates updates.gz --data app/data.json --speed 10 --save tests/baselines/replay.json
+    python -m tests.replay_updates updates.gz --data app/data.json --speed 10 --baseline tests/baselines/replay.json
+
+Updates are received at their recorded pace sped up --speed times, or as fast as the workers take them with 0, and
+processed by --workers threads like in production. Chosen results of sounds missing from the data JSON, whose ids
+are only known to the recording database, are mapped onto its sounds.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from tests.benchmark_handlers import APP_DIR, DEFAULT_REGRESSION_THRESHOLD, print_report, summarize
+
+
+def handler_name(update):
+    """Handler of bot.py processing an update dict."""
+    if 'chosen_inline_result' in update:
+        return 'on_result'
+    if 'inline_query' in update:
+        return 'query_text' if update['inline_query'].get('query') else 'query_empty'
+    return 'message'
+
+
+def load_updates(path, bot_name=''):
+    """(epoch, update) of the updates of a bot recorded in path."""
+    sys.path.insert(0, APP_DIR)
+    import recorder
+    return [(timestamp, update) for timestamp, name, update in recorder.read(path) if name == bot_name]
+
+
+def remap_results(updates, sound_ids):
+    """Maps the chosen results of unknown sounds onto sound_ids, the same unknown sound always onto the same one."""
+    known = set(sound_ids)
+    for _, update in updates:
+        chosen = update.get('chosen_inline_result')
+        if chosen and int(chosen['result_id']) not in known:
+            chosen['result_id'] = str(sound_ids[int(chosen['result_id']) % len(sound_ids)])
+
+
+def replay(updates, data_file, speed=1.0, workers=4, query_window=None):
+    sys.path.insert(0, APP_DIR)
+    import telebot
+    import bot
+    from webhook import UpdateWorkers
+    from tests.stub_telegram import StubTelegram
+
+    with tempfile.TemporaryDirectory() as directory:
+        stub = StubTelegram().install()
+        started = time.perf_counter()
+        arguments = ['--token', '0:replay', '--verbosity', 'WARN', '--data', data_file, '--catalog-snapshot', '',
+                     '--sqlite', os.path.join(directory, 'db.sqlite'),
+                     '--history-spill-file', os.path.join(directory, 'history.spill')]
+        if query_window is not None:
+            arguments += ['--query-window', str(query_window)]
+        bot.setup(bot.parse_args(arguments), telegram_bot=telebot.TeleBot('0:replay', threaded=False))
+        setup_time = time.perf_counter() - started
+        sound_bot = bot.bots[0]
+        remap_results(updates, [sound['id'] for sound in sound_bot.catalog.sounds])
+
+        latencies = defaultdict(list)
+        written = Counter()
+        add_history = bot.database.add_history
+
+        def counted_add_history(events):
+            batch_started = time.perf_counter()
+            add_history(events)
+            latencies['add_history'].append(time.perf_counter() - batch_started)
+            written['batches'] += 1
+            written.update(event.kind for event in events)
+
+        bot.database.add_history = counted_add_history
+
+        def process(update):
+            update_started = time.perf_counter()
+            sound_bot.process_update(update)
+            latencies[handler_name(update)].append(time.perf_counter() - update_started)
+
+        pool = UpdateWorkers(workers, queue_size=workers * 16)
+        first = updates[0][0] if updates else 0
+        started = time.perf_counter()
+        for timestamp, update in updates:
+            if speed:
+                delay = (timestamp - first) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            sound_bot.receive(update)
+            pool.submit(process, update)
+        pool.shutdown()
+        elapsed = time.perf_counter() - started
+        sound_bot.coalescer.stop()
+        bot.history.close()
+        stub.uninstall()
+
+    report = {name: summarize(values) for name, values in latencies.items()}
+    report['all_updates'] = summarize([value for name, values in latencies.items() if name != 'add_history'
+                                       for value in values], elapsed)
+    report['setup'] = {'seconds': setup_time}
+    report['history'] = dict(written)
+    report['coalescing'] = {'superseded': sound_bot.coalescer.skipped, 'coalesced': sound_bot.coalescer.coalesced}
+    report['telegram'] = {'calls': dict(stub.calls), 'bytes_sent': stub.bytes_sent}
+    return report
+
+
+def print_writes(report, baseline=None):
+    print('History written: {batches} batches, {query} queries, {result} results'.format(
+        **dict({'batches': 0, 'query': 0, 'result': 0}, **report['history'])))
+    print('Superseded queries: {superseded}, coalesced: {coalesced}'.format(**report['coalescing']))
+    if baseline and 'history' in baseline:
+        print('Baseline history: {batches} batches, {query} queries, {result} results'.format(
+            **dict({'batches': 0, 'query': 0, 'result': 0}, **baseline['history'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay of recorded updates through the handlers.")
+    parser.add_argument("recording", type=str, help="File written by bot.py --record-updates.")
+    parser.add_argument("--data", type=str, help="Data JSON of the sounds.", default=os.path.join(APP_DIR, 'data.json'))
+    parser.add_argument("--bot", type=str, help="Name of the bot whose updates are replayed.", default='')
+    parser.add_argument("--speed", type=float, help="Times faster than recorded, 0 replays as fast as possible.",
+                        default=1)
+    parser.add_argument("--workers", type=int, help="Threads handling updates.", default=4)
+    parser.add_argument("--query-window", type=float, help="--query-window of bot.py.")
+    parser.add_argument("--save", type=str, help="Store the results as a baseline in this JSON file.")
+    parser.add_argument("--baseline", type=str, help="Compare the results with this baseline JSON file.")
+    parser.add_argument("--threshold", type=float, help="p95 increase over the baseline reported as regression.",
+                        default=DEFAULT_REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    updates = load_updates(args.recording, args.bot)
+    report = replay(updates, args.data, speed=args.speed, workers=args.workers, query_window=args.query_window)
+    regressions = print_report('Replay of %d updates' % len(updates), report, baseline, args.threshold)
+    print_writes(report, baseline)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as save_file:
+            json.dump(report, save_file, indent=2, sort_keys=True)
+    if regressions:
+        print('\nRegressions: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
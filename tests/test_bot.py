@@ -0,0 +1,150 @@
+import datetime
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+import telebot
+from tests.stub_telegram import StubTelegram
+
+# bot.py is run from the app directory and imports its modules as top level ones
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'app'))
+import bot
+from persistence.writebehind import HistoryEvent, RESULT
+
+ENVIRONMENT = [value for name, value in vars(bot).items() if name.startswith('_ENV_')]
+
+
+def message(username, text):
+    return {'update_id': 1, 'message': {
+        'message_id': 1, 'date': 0, 'chat': {'id': 7, 'type': 'private'}, 'text': text,
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}],
+        'from': {'id': 7, 'is_bot': False, 'first_name': 'Admin', 'username': username}}}
+
+
+class BotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.environment = mock.patch.dict(os.environ)
+        self.environment.start()
+        for key in ENVIRONMENT:
+            os.environ.pop(key, None)
+
+    def tearDown(self):
+        self.environment.stop()
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def parse(self, bots, *argv):
+        with open(self.path('bots.json'), 'w') as config:
+            json.dump({'bots': bots}, config)
+        return bot.parse_args(['--config', self.path('bots.json'), '--admin', 'host'] + list(argv))
+
+
+class BotArgumentsTest(BotTestCase):
+
+    def test_single_bot(self):
+        args = bot.parse_args(['--token', '0:single', '--admin', 'host'])
+        self.assertEqual(len(args.bots), 1)
+        single = args.bots[0]
+        self.assertEqual((single.name, single.token, single.catalog_name, single.admin, single.host_admin),
+                         ('', '0:single', '', 'host', 'host'))
+        self.assertEqual((single.catalog_snapshot, single.webhook_path), ('data.json.snapshot', '/'))
+
+    def test_config_bots_override_the_shared_arguments(self):
+        args = self.parse([{'name': 'lvm', 'token': '0:lvm'},
+                           {'name': 'other', 'token': '0:other', 'admin': 'other_admin', 'bucket': 'https://other/',
+                            'catalog_name': 'shows'}], '--bucket', 'https://lvm/')
+        lvm, other = args.bots
+        self.assertEqual((lvm.name, lvm.token, lvm.catalog_name, lvm.bucket, lvm.admin),
+                         ('lvm', '0:lvm', 'lvm', 'https://lvm/', 'host'))
+        self.assertEqual((other.name, other.token, other.catalog_name, other.bucket, other.admin),
+                         ('other', '0:other', 'shows', 'https://other/', 'other_admin'))
+        self.assertEqual({lvm.host_admin, other.host_admin}, {'host'})
+
+    def test_invalid_configs_are_rejected(self):
+        for bots in ([{'name': 'lvm', 'token': '0:lvm', 'workers': 2}],
+                     [{'name': 'lvm', 'token': '0:lvm'}, {'name': 'lvm', 'token': '0:other'}],
+                     [{'token': '0:lvm'}],
+                     [{'name': '', 'token': '0:lvm'}],
+                     [{'name': 'lvm'}],
+                     [{'name': 'lvm', 'token': '0:lvm', 'webhook_path': '/other'},
+                      {'name': 'other', 'token': '0:other'}]):
+            with self.subTest(bots=bots), self.assertLogs('LaVidaModerna_Bot', 'CRITICAL'):
+                self.assertRaises(SystemExit, self.parse, bots)
+
+    def test_every_bot_gets_its_webhook(self):
+        args = self.parse([{'name': 'lvm', 'token': '0:lvm'},
+                           {'name': 'other', 'token': '0:other', 'webhook_path': '/hook',
+                            'webhook_url': 'https://other.example.com/hook'}],
+                          '--mode', 'webhook', '--webhook-url', 'https://example.com/bots/')
+        lvm, other = args.bots
+        self.assertEqual((lvm.webhook_path, lvm.webhook_url), ('/lvm', 'https://example.com/bots/lvm'))
+        self.assertEqual((other.webhook_path, other.webhook_url), ('/hook', 'https://other.example.com/hook'))
+
+    def test_snapshots_are_named_after_their_bot(self):
+        bots = [{'name': 'lvm', 'token': '0:lvm'}, {'name': 'other', 'token': '0:other'}]
+        self.assertEqual([bot_args.catalog_snapshot for bot_args in self.parse(bots).bots],
+                         ['data.json.snapshot.lvm', 'data.json.snapshot.other'])
+        self.assertEqual([bot_args.catalog_snapshot for bot_args in
+                          self.parse(bots, '--catalog-snapshot', '/data/catalog.snapshot').bots],
+                         ['/data/catalog.snapshot.lvm', '/data/catalog.snapshot.other'])
+        bots[1]['catalog_snapshot'] = '/data/other.snapshot'
+        self.assertEqual([bot_args.catalog_snapshot for bot_args in
+                          self.parse(bots, '--catalog-snapshot', '').bots], ['', '/data/other.snapshot'])
+
+
+class SoundBotAdminTest(BotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        bot.load_dependencies()
+        self.stub = StubTelegram().install()
+        self.stub.keep_requests = True
+        bots = []
+        for name, text in (('lvm', 'Capitan'), ('other', 'Otro show')):
+            with open(self.path(name + '.json'), 'w') as data:
+                json.dump({'sounds': [{'filename': name + '.ogg', 'text': text, 'tags': name}]}, data)
+            bots.append({'name': name, 'token': '0:' + name, 'admin': name + '_admin', 'data': self.path(name + '.json'),
+                         'catalog_snapshot': ''})
+        args = self.parse(bots, '--query-window', '0', '--recommendations-refresh', '0')
+        self.database = bot.Database('sqlite')
+        self.history = bot.HistoryWriter(self.database)
+        self.bots = [bot.SoundBot(bot_args, self.database, self.history, telegram_bot=telebot.TeleBot(
+            bot_args.token, threaded=False), name='test_' + bot_args.name) for bot_args in args.bots]
+        for sound_bot in self.bots:
+            sound_bot.hosted = self.bots
+            sound_bot.reload_catalog()
+
+    def tearDown(self):
+        for sound_bot in self.bots:
+            sound_bot.popularity.stop()
+        self.stub.uninstall()
+        super().tearDown()
+
+    def sent(self, method):
+        return [params for name, params, _ in self.stub.requests if name == method]
+
+    def test_stats_and_exports_of_every_bot_are_only_sent_to_the_host_admin(self):
+        lvm, other = self.bots
+        user = {'id': 9701, 'is_bot': False, 'first_name': 'user', 'last_name': None, 'username': None,
+                'language_code': None}
+        self.database.add_history([HistoryEvent(RESULT, user, lvm.catalog.sounds[0]['id'],
+                                                datetime.datetime.utcnow())])
+        for command in ('/stats', '/export results'):
+            other.process_update(message('other_admin', command))
+        self.assertEqual(self.sent('sendMessage'), [])
+        self.assertFalse(other.message_is_from_host_admin(telebot.types.Message.de_json(
+            message(None, '/stats')['message'])))
+
+        other.process_update(message('other_admin', '/uptime'))
+        self.assertEqual(len(self.sent('sendMessage')), 1)
+        other.process_update(message('host', '/stats'))
+        stats = self.sent('sendMessage')[-1]['text']
+        self.assertIn('of the 2 bots', stats)
+        # Sounds of the other bots are named too
+        self.assertIn('1. Capitan (1)', stats)
@@ -0,0 +1,83 @@
+import json
+import unittest
+from app.catalog import *
+from tests.test_search import SOUNDS
+
+BUCKET = 'https://example.com/sounds/'
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_eviction_and_counters(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.info(), {'size': 2, 'max_size': 2, 'hits': 2, 'misses': 1})
+        cache.clear()
+        self.assertEqual(cache.info(), {'size': 0, 'max_size': 2, 'hits': 0, 'misses': 0})
+
+    def test_expiration(self):
+        cache = LRUCache(2, ttl=0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = Catalog(SOUNDS, BUCKET)
+
+    def test_prepared_results(self):
+        result = json.loads(self.catalog.results[1].to_json())
+        self.assertEqual(result['voice_url'], BUCKET + 'a.ogg')
+        self.assertEqual(result['title'], 'Capachao')
+        self.assertEqual(json.loads(self.catalog.recent_results[1].to_json())['title'], RECENT_PREFIX + 'Capachao')
+
+    def test_query_is_cached_by_normalized_text(self):
+        first = self.catalog.query('Capa', 48)
+        self.assertEqual([r.result.id for r in first], [3, 1, 2, 5])
+        self.assertEqual(self.catalog.query(' capa!', 48), first)
+        self.assertEqual(self.catalog.cache.hits, 1)
+        self.assertEqual(self.catalog.cache.misses, 1)
+
+    def test_query_pages(self):
+        results, next_offset = self.catalog.query_page('capa', 0, 3)
+        self.assertEqual([r.result.id for r in results], [3, 1, 2])
+        self.assertEqual(next_offset, '3')
+        ranked = self.catalog.ranked('capa')
+        self.assertEqual(len(ranked), 4)
+        results, next_offset = self.catalog.query_page('capa', 3, 3)
+        self.assertEqual([r.result.id for r in results], [5])
+        self.assertEqual(next_offset, '')
+        self.assertEqual(self.catalog.query_page('capa', 6, 3), ([], ''))
+        self.assertEqual(self.catalog.query_page('nothing', 0, 3), ([], ''))
+
+    def test_default_pages_reach_every_sound(self):
+        shown = []
+        offset = ''
+        while True:
+            results, offset = self.catalog.default_page([3], parse_offset(offset), 2, popular_ids=(5,))
+            shown += [r.result.id for r in results]
+            if not offset:
+                break
+        self.assertEqual(shown, [3, 5] + [sound['id'] for sound in SOUNDS if sound['id'] not in (3, 5)])
+        self.assertEqual(parse_offset('bad'), 0)
+        self.assertEqual(parse_offset('-4'), 0)
+
+    def test_default_results(self):
+        results = self.catalog.default_results([3], 3)
+        self.assertEqual([r.result.title for r in results], [RECENT_PREFIX + 'El capa', 'Capachao', 'Pero capachao'])
+
+    def test_default_results_with_popular_sounds(self):
+        results = self.catalog.default_results([3], 4, popular_ids=(5, 3, 404, 1))
+        self.assertEqual([r.result.id for r in results], [3, 5, 1, 2])
+        self.assertEqual(results[0].result.title, RECENT_PREFIX + 'El capa')
+
+
+if __name__ == '__main__':
+    unittest.main()
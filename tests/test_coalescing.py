@@ -0,0 +1,91 @@
+import time
+import unittest
+import telebot.types as types
+from app.coalescing import QueryCoalescer, inline_query_of
+
+
+def inline_update(update_id, user_id, text):
+    return {'update_id': update_id,
+            'inline_query': {'id': str(update_id), 'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+                             'query': text, 'offset': ''}}
+
+
+def inline_query(update_id, user_id, text):
+    return types.Update.de_json(inline_update(update_id, user_id, text)).inline_query
+
+
+class QueryCoalescerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.recorded = []
+        self.coalescer = None
+
+    def tearDown(self):
+        if self.coalescer:
+            self.coalescer.stop()
+
+    def start(self, window):
+        self.coalescer = QueryCoalescer(lambda query: self.recorded.append(query.query), window=window).start()
+
+    def test_inline_query_of_updates(self):
+        self.assertEqual(inline_query_of(inline_update(1, 7, 'capa')), (7, '1'))
+        self.assertEqual(inline_query_of(types.Update.de_json(inline_update(2, 7, 'capa'))), (7, '2'))
+        self.assertIsNone(inline_query_of({'update_id': 3}))
+        self.assertIsNone(inline_query_of(types.Update.de_json({'update_id': 3})))
+
+    def test_queries_superseded_by_the_same_user_are_skipped(self):
+        self.start(window=60)
+        for update_id, user_id, text in ((1, 7, 'c'), (2, 7, 'ca'), (3, 8, 'ho')):
+            self.coalescer.receive(inline_update(update_id, user_id, text))
+        self.assertTrue(self.coalescer.superseded(inline_query(1, 7, 'c')))
+        self.assertFalse(self.coalescer.superseded(inline_query(2, 7, 'ca')))
+        self.assertFalse(self.coalescer.superseded(inline_query(3, 8, 'ho')))
+        self.assertEqual(self.coalescer.skipped, 1)
+
+    def test_only_the_last_query_of_a_burst_is_recorded(self):
+        self.start(window=0.05)
+        for update_id, text in enumerate(('c', 'ca', 'cap', 'capa')):
+            self.coalescer.add(inline_query(update_id, 7, text))
+        self.coalescer.add(inline_query(10, 8, 'ho'))
+        deadline = time.monotonic() + 5
+        while len(self.recorded) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(self.recorded), ['capa', 'ho'])
+        self.assertEqual((self.coalescer.coalesced, self.coalescer.pending()), (3, 0))
+
+    def test_flush_and_stop_record_pending_queries(self):
+        self.start(window=60)
+        self.coalescer.add(inline_query(1, 7, 'capa'))
+        self.coalescer.add(inline_query(2, 8, 'ho'))
+        self.coalescer.flush(7)
+        self.assertEqual(self.recorded, ['capa'])
+        self.coalescer.stop()
+        self.coalescer = None
+        self.assertEqual(self.recorded, ['capa', 'ho'])
+
+    def test_users_who_stopped_typing_are_forgotten(self):
+        self.start(window=0.05)
+        for user_id in range(1000):
+            self.coalescer.receive(inline_update(user_id, user_id, 'capa'))
+            if user_id % 2:
+                self.coalescer.add(inline_query(user_id, user_id, 'capa'))
+                self.coalescer.flush(user_id)
+        self.assertEqual(self.coalescer.pending(), 0)
+        deadline = time.monotonic() + 5
+        while self.coalescer._latest and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.coalescer._latest, {})
+        self.assertEqual(len(self.recorded), 500)
+
+    def test_no_window_records_everything(self):
+        self.start(window=0)
+        self.coalescer.receive(inline_update(1, 7, 'c'))
+        self.coalescer.receive(inline_update(2, 7, 'ca'))
+        self.assertFalse(self.coalescer.superseded(inline_query(1, 7, 'c')))
+        self.coalescer.add(inline_query(1, 7, 'c'))
+        self.coalescer.add(inline_query(2, 7, 'ca'))
+        self.assertEqual(self.recorded, ['c', 'ca'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import csv
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from app.persistence import *
+from app.persistence.export import *
+from app.persistence.writebehind import HistoryEvent, QUERY, RESULT
+
+DAY = datetime.datetime(2020, 3, 2, 12)
+
+
+class ExportTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db = Database(provider='sqlite')
+        user = {'id': 9601, 'is_bot': False, 'first_name': 'export', 'last_name': None, 'username': 'exporter',
+                'language_code': 'es'}
+        cls.db.add_sound(9601, 'export.ogg', 'Export', 'tags')
+        cls.db.add_history([HistoryEvent(QUERY, user, 'e', DAY), HistoryEvent(QUERY, user, 'ex', DAY),
+                            HistoryEvent(QUERY, user, 'exp', DAY + datetime.timedelta(days=1)),
+                            HistoryEvent(RESULT, user, 9601, DAY), HistoryEvent(RESULT, user, 9601, DAY)])
+
+    @classmethod
+    def tearDownClass(cls):
+        with db_session:
+            delete(q for q in QueryHistory if q.user.id == 9601)
+            delete(r for r in ResultHistory if r.user.id == 9601)
+            User[9601].delete()
+            Sound[9601].delete()
+
+    def test_pages_through_time_ranges(self):
+        rows = [row for row in self.db.export_rows('queries', since=DAY, chunk_size=2) if row[2] == 9601]
+        self.assertEqual([row[-1] for row in rows], ['e', 'ex', 'exp'])
+        self.assertEqual(rows[0][3:6], ('exporter', 'export', 'es'))
+        rows = [row for row in export_rows('queries', since=parse_time('2020-03-02'), until=parse_time('2020-03-03'),
+                                           chunk_size=1) if row[2] == 9601]
+        self.assertEqual([row[-1] for row in rows], ['e', 'ex'])
+        self.assertEqual(len([row for row in export_rows('results', until=DAY) if row[2] == 9601]), 0)
+        users = {row[0]: row for row in export_rows('users', chunk_size=1)}
+        self.assertEqual(users[9601][2:], ('export', '', 'exporter', 'es'))
+
+    def test_rejects_bad_exports(self):
+        self.assertRaises(ValueError, export_rows, 'sounds')
+        self.assertRaises(ValueError, export_rows, 'users', since=DAY)
+        self.assertRaises(ValueError, parse_time, 'yesterday')
+
+    def test_writes_compressed_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.csv.gz')
+            self.assertEqual(main(['--sqlite', os.path.join(directory, 'unused.sqlite'), '--table', 'results',
+                                   '--since', '2020-03-02', '--until', '2020-03-03', '--output', path]), 0)
+            with gzip.open(path, 'rt', encoding='utf-8', newline='') as exported:
+                rows = list(csv.reader(exported))
+            self.assertEqual(rows[0], list(TABLES['results'][0]))
+            self.assertEqual([row[6:] for row in rows[1:] if row[2] == '9601'], [['9601', 'export.ogg', 'Export']] * 2)
+
+            path = os.path.join(directory, 'queries.jsonl.gz')
+            export('queries', path, format='jsonl', since=DAY)
+            with gzip.open(path, 'rt', encoding='utf-8') as exported:
+                queries = [json.loads(line) for line in exported]
+            self.assertEqual([query['text'] for query in queries if query['user_id'] == 9601], ['e', 'ex', 'exp'])
+
+
+if __name__ == '__main__':
+    unittest.main()
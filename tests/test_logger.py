@@ -0,0 +1,100 @@
+import json
+import logging
+import threading
+import unittest
+from unittest import mock
+from app import logger
+
+
+class Capture(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.threads = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+        self.threads.append(threading.current_thread().name)
+
+
+class Formatted:
+    """Argument recording the thread it was formatted on."""
+
+    def __init__(self):
+        self.thread = None
+
+    def __str__(self):
+        self.thread = threading.current_thread().name
+        return 'formatted'
+
+
+class AsyncLoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.capture = Capture()
+        self.handlers = logger.logger.handlers[:]
+        logger.logger.handlers = [self.capture]
+        # Handlers of the root logger, like the capture of pytest, would format records on the logging thread
+        self.propagate = logger.logger.propagate
+        logger.logger.propagate = False
+
+    def tearDown(self):
+        logger.stop_async()
+        logger.logger.handlers = self.handlers
+        logger.logger.propagate = self.propagate
+
+    def test_records_are_formatted_and_written_by_the_writer(self):
+        logger.start_async(queue_size=10)
+        argument = Formatted()
+        logger.logger.warning('Lazy %s', argument)
+        logger.stop_async()
+        self.assertEqual(self.capture.messages, ['Lazy formatted'])
+        self.assertNotEqual(self.capture.threads[0], threading.current_thread().name)
+        self.assertEqual(argument.thread, self.capture.threads[0])
+        self.assertEqual(logger.logger.handlers, [self.capture])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = logger.AsyncHandler(queue_size=1)
+        record = logging.LogRecord('test', logging.INFO, __file__, 1, 'message', (), None)
+        handler.emit(record)
+        handler.emit(record)
+        self.assertEqual((handler.queue.qsize(), handler.dropped), (1, 1))
+
+
+class FiltersTest(unittest.TestCase):
+
+    def record(self, level=logging.DEBUG):
+        return logging.LogRecord('test', level, __file__, 1, 'message', (), None)
+
+    def test_sample(self):
+        sample = logger.SampleFilter(3)
+        self.assertEqual([sample.filter(self.record()) for _ in range(6)], [True, False, False, True, False, False])
+        self.assertTrue(sample.filter(self.record(logging.WARNING)))
+        self.assertEqual(sample.filtered, 4)
+
+    def test_rate_limit(self):
+        with mock.patch('app.logger.time.monotonic', return_value=100.0) as monotonic:
+            rate_limit = logger.RateLimitFilter(2)
+            self.assertEqual([rate_limit.filter(self.record()) for _ in range(3)], [True, True, False])
+            self.assertTrue(rate_limit.filter(self.record(logging.ERROR)))
+            monotonic.return_value = 100.5
+            self.assertEqual([rate_limit.filter(self.record()) for _ in range(2)], [True, False])
+        self.assertEqual(rate_limit.filtered, 2)
+
+
+class JsonFormatterTest(unittest.TestCase):
+
+    def test_json_line(self):
+        record = logging.LogRecord('LaVidaModerna_Bot', logging.INFO, __file__, 1, 'Serving %d sounds', (3,), None)
+        record.created = 0
+        record.msecs = 5
+        record.fields = {'bot': 'test'}
+        entry = json.loads(logger.JsonFormatter().format(record))
+        self.assertEqual(entry['time'], '1970-01-01T00:00:00.005Z')
+        self.assertEqual((entry['level'], entry['logger'], entry['message'], entry['bot']),
+                         ('INFO', 'LaVidaModerna_Bot', 'Serving 3 sounds', 'test'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import json
+import os
+import unittest
+from app.catalog import Catalog
+from app.catalog.metadata import *
+from app.persistence.sync import diff_sounds
+
+SOUNDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'LaVidaModerna')
+
+
+class MetadataTest(unittest.TestCase):
+
+    def test_read_metadata(self):
+        metadata = read_metadata(os.path.join(SOUNDS_DIR, 'allRight.ogg'))
+        self.assertEqual((metadata.filename, metadata.duration, metadata.sample_rate, metadata.channels,
+                          metadata.size), ('allRight.ogg', 0.797, 48000, 1, 8033))
+
+    def test_off_spec_files_are_flagged(self):
+        metadata = read_metadata(os.path.join(SOUNDS_DIR, 'zorra.ogg'))
+        self.assertEqual(metadata.channels, 2)
+        self.assertIn('2 channels', metadata.issues)
+
+    def test_invalid_files(self):
+        self.assertRaises(InvalidAudio, parse, b'RIFF' + bytes(60))
+        with open(os.path.join(SOUNDS_DIR, 'allRight.ogg'), 'rb') as sound_file:
+            data = bytearray(sound_file.read())
+        data[28:36] = b'OpusFake'
+        self.assertRaises(InvalidAudio, parse, data)
+
+    def test_read_all_in_process_pool(self):
+        paths = [os.path.join(SOUNDS_DIR, name) for name in ('allRight.ogg', 'zorra.ogg', 'missing.ogg')]
+        metadata = read_all(paths, workers=2)
+        self.assertEqual([entry.filename for entry in metadata], ['allRight.ogg', 'zorra.ogg', 'missing.ogg'])
+        self.assertEqual(metadata[0], read_metadata(paths[0]))
+        self.assertIsNone(metadata[2].duration)
+        self.assertTrue(metadata[2].issues[0].startswith('unreadable'))
+
+        sounds = [{'filename': 'allRight.ogg', 'text': 'All right', 'tags': 'all right'},
+                  {'filename': 'missing.ogg', 'text': 'Missing', 'tags': 'missing'}]
+        self.assertEqual(apply_metadata(sounds, metadata), 1)
+        self.assertEqual(apply_metadata(sounds, metadata), 0)
+        self.assertEqual(sounds[0]['duration'], 0.797)
+        self.assertNotIn('duration', sounds[1])
+
+    def test_metadata_reaches_results(self):
+        db_sound = {'id': 1, 'filename': 'a.ogg', 'text': 'A', 'tags': 'a', 'disabled': False, 'duration': None,
+                    'sample_rate': None, 'channels': None, 'size': None}
+        json_sound = {'filename': 'a.ogg', 'text': 'A', 'tags': 'a', 'duration': 2.6, 'sample_rate': 48000,
+                      'channels': 1, 'size': 1000}
+        changed, = diff_sounds([db_sound], [json_sound]).changed
+        self.assertEqual(changed['duration'], 2.6)
+        result = json.loads(Catalog([changed], 'https://example.com/').results[1].to_json())
+        self.assertEqual(result['voice_duration'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
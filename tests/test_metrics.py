@@ -0,0 +1,89 @@
+import unittest
+import urllib.error
+import urllib.request
+
+from app.metrics import *
+
+
+class Service:
+
+    def ok(self, value):
+        return value
+
+    def fail(self):
+        raise ValueError('failed')
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_histogram_buckets_and_quantile(self):
+        histogram = Histogram(buckets=(0.01, 0.1, 1))
+        for value in (0.005, 0.05, 0.05, 0.5, 5):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.sum, 5.605)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(1), float('inf'))
+        self.assertIsNone(Histogram().quantile(0.5))
+
+    def test_registry_returns_same_metric_for_same_labels(self):
+        counter = self.registry.counter('calls_total', 'Calls.', handler='a')
+        self.assertIs(counter, self.registry.counter('calls_total', 'Calls.', handler='a'))
+        self.assertIsNot(counter, self.registry.counter('calls_total', 'Calls.', handler='b'))
+        with self.assertRaises(ValueError):
+            self.registry.histogram('calls_total', 'Calls.')
+
+    def test_stopwatch_phases(self):
+        stopwatch = Stopwatch()
+        first = stopwatch.lap('imports')
+        second = stopwatch.lap('catalog')
+        self.assertEqual([phase for phase, _ in stopwatch.phases], ['imports', 'catalog'])
+        self.assertAlmostEqual(stopwatch.total, first + second)
+        self.assertRegex(str(stopwatch), r'^imports \d+ ms, catalog \d+ ms$')
+
+    def test_instrument_counts_calls_and_errors(self):
+        service = instrument(Service(), 'service', 'Service latency.', label='method', registry=self.registry)
+        self.assertEqual(service.ok(3), 3)
+        self.assertEqual(service.ok.__name__, 'ok')
+        with self.assertRaises(ValueError):
+            service.fail()
+        histograms = dict(self.registry.family('service_seconds'))
+        errors = dict(self.registry.family('service_errors_total'))
+        self.assertEqual(histograms[(('method', 'ok'),)].count, 1)
+        self.assertEqual(histograms[(('method', 'fail'),)].count, 1)
+        self.assertEqual(errors[(('method', 'ok'),)].value, 0)
+        self.assertEqual(errors[(('method', 'fail'),)].value, 1)
+
+    def test_exposition_format(self):
+        self.registry.counter('queries_total', 'Queries.', result='hit').inc(2)
+        self.registry.gauge('sounds', 'Sounds served.', lambda: 124)
+        self.registry.histogram('latency_seconds', 'Latency.', handler='q"1').observe(0.002)
+        text = self.registry.exposition()
+        self.assertIn('# TYPE queries_total counter\nqueries_total{result="hit"} 2\n', text)
+        self.assertIn('# HELP sounds Sounds served.\n# TYPE sounds gauge\nsounds 124\n', text)
+        self.assertIn('latency_seconds_bucket{handler="q\\"1",le="0.001"} 0\n', text)
+        self.assertIn('latency_seconds_bucket{handler="q\\"1",le="0.0025"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{handler="q\\"1",le="+Inf"} 1\n', text)
+        self.assertIn('latency_seconds_count{handler="q\\"1"} 1\n', text)
+
+    def test_server(self):
+        self.registry.counter('requests_total', 'Requests.').inc()
+        server = MetricsServer(port=0, registry=self.registry).start()
+        try:
+            url = 'http://127.0.0.1:%d' % server.port
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertEqual(response.headers['Content-Type'], CONTENT_TYPE)
+                self.assertIn(b'requests_total 1\n', response.read())
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url + '/other')
+            self.assertEqual(error.exception.code, 404)
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
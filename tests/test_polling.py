@@ -0,0 +1,59 @@
+import threading
+import unittest
+from unittest import mock
+import telebot.types as types
+from app.polling import Poller
+from app.webhook import UpdateWorkers
+
+
+class FakeBot:
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.offsets = []
+        self.processed = []
+        self.done = threading.Event()
+
+    def get_updates(self, offset=None, timeout=None, allowed_updates=None):
+        self.offsets.append(offset)
+        if not self.batches:
+            self.done.set()
+            return []
+        batch = self.batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return [types.Update.de_json({'update_id': update_id}) for update_id in batch]
+
+    def process_new_updates(self, updates):
+        self.processed.extend(update.update_id for update in updates)
+
+
+class PollerTest(unittest.TestCase):
+
+    def test_bots_share_the_workers(self):
+        workers = UpdateWorkers(workers=2, queue_size=1)
+        bots = [FakeBot([[1, 2], [3]]), FakeBot([[10]])]
+        pollers = [Poller(bot, workers) for bot in bots]
+        for poller in pollers:
+            while poller.poll():
+                pass
+        workers.shutdown()
+        self.assertEqual(sorted(bots[0].processed), [1, 2, 3])
+        self.assertEqual(bots[0].offsets, [None, 3, 4])
+        self.assertEqual(bots[1].processed, [10])
+        self.assertEqual(workers.accepted, 4)
+
+    def test_errors_are_retried(self):
+        workers = UpdateWorkers(workers=1, queue_size=1)
+        bot = FakeBot([ConnectionError('lost connection'), [1]])
+        with mock.patch('app.polling.POLL_RETRY_PAUSE', 0):
+            poller = Poller(bot, workers).start()
+            self.assertTrue(bot.done.wait(5))
+        poller.stop()
+        workers.shutdown()
+        self.assertEqual(bot.processed, [1])
+        self.assertEqual(bot.offsets[:3], [None, None, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
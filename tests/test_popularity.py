@@ -0,0 +1,35 @@
+import unittest
+from app.catalog.popularity import *
+
+DAY = 24 * 60 * 60
+NOW = 1600000000.0
+
+
+class PopularityTest(unittest.TestCase):
+
+    def test_recent_uses_weigh_more(self):
+        popularity = Popularity(half_life=DAY, top_size=2)
+        popularity.load([(1, NOW - 3 * DAY, 5), (2, NOW, 1), (3, NOW - DAY, 1)])
+        self.assertAlmostEqual(popularity.score(1, now=NOW), 5 / 8)
+        self.assertAlmostEqual(popularity.score(3, now=NOW), 1 / 2)
+        self.assertEqual(popularity.top(), (2, 1))
+
+    def test_snapshot_only_changes_on_refresh(self):
+        popularity = Popularity(half_life=DAY)
+        popularity.load([(1, NOW, 1)])
+        popularity.record(2, NOW)
+        popularity.record(2, NOW)
+        self.assertEqual(popularity.top(), (1,))
+        self.assertEqual(popularity.refresh(), (2, 1))
+
+    def test_rebase_keeps_scores(self):
+        popularity = Popularity(half_life=1)
+        popularity.load([(1, NOW, 1)])
+        later = NOW + 2000
+        popularity.record(2, later)
+        self.assertAlmostEqual(popularity.score(2, now=later), 1)
+        self.assertEqual(popularity.refresh(), (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import queue
+import threading
+import unittest
+from app import PrettyUptime
+from app.profiling import *
+
+
+def busy_loop(stopping):
+    total = 0
+    while not stopping.is_set():
+        total += sum(range(1000))
+    return total
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def test_cpu_profile_finds_hot_functions(self):
+        stopping = threading.Event()
+        worker = threading.Thread(target=busy_loop, args=(stopping,))
+        worker.start()
+        reports = queue.Queue()
+        try:
+            self.assertTrue(profile('cpu', 0.2, reports.put))
+            self.assertFalse(profile('cpu', 0.2, reports.put))
+            report = reports.get(timeout=5)
+        finally:
+            stopping.set()
+            worker.join()
+        self.assertIn('busy_loop', report)
+        self.assertEqual(running(), [])
+
+    def test_memory_profile_stopped_early(self):
+        reports = queue.Queue()
+        self.assertTrue(profile('memory', 60, reports.put))
+        self.assertEqual(running(), ['memory'])
+        allocated = [bytearray(1024) for _ in range(100)]
+        self.assertTrue(stop('memory'))
+        report = reports.get(timeout=5)
+        self.assertIn('test_profiling.py', report)
+        self.assertFalse(stop('memory'))
+        self.assertEqual(len(allocated), 100)
+
+    def test_process_diagnostics(self):
+        self.assertGreater(PrettyUptime.get_resident_memory(), 0)
+        self.assertIn('Threads', PrettyUptime.get_pretty_process_resources())
+        self.assertIn('gen2', PrettyUptime.get_pretty_gc_stats())
+        self.assertEqual(PrettyUptime.get_pretty_sizes([('Sounds', 3), ('Users', 2)]), 'Sounds: 3, Users: 2')
+
+
+if __name__ == '__main__':
+    unittest.main()
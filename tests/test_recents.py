@@ -0,0 +1,68 @@
+import datetime
+import unittest
+from app.persistence import *
+from app.persistence import tools
+from app.persistence.recents import *
+
+
+class RecentSoundsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loaded = []
+
+        def loader(user_id, limit):
+            self.loaded.append(user_id)
+            return [user_id * 10 + i for i in range(limit)]
+
+        self.recents = RecentSounds(loader, max_users=2, sounds_per_user=3)
+
+    def test_loads_missing_users_once(self):
+        self.assertEqual(self.recents.get(1), [10, 11, 12])
+        self.assertEqual(self.recents.get(1), [10, 11, 12])
+        self.assertEqual(self.loaded, [1])
+
+    def test_add_moves_sound_to_front(self):
+        self.recents.add(1, 12)
+        self.recents.add(1, 99)
+        self.assertEqual(self.recents.get(1), [99, 12, 10])
+        self.assertEqual(self.loaded, [1])
+
+    def test_evicts_least_recently_active_user(self):
+        self.recents.get(1)
+        self.recents.get(2)
+        self.recents.get(1)
+        self.recents.get(3)
+        self.assertEqual(len(self.recents), 2)
+        self.recents.get(2)
+        self.assertEqual(self.loaded, [1, 2, 3, 2])
+
+
+class LatestUsedSoundsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db = Database(provider='sqlite')
+
+    def test_latest_used_sounds_from_user(self):
+        start = datetime.datetime(2018, 1, 1)
+        with db_session:
+            user = User(id=9101, is_bot=False, first_name='recent')
+            sounds = [Sound(id=9100 + i, filename='recent%d.ogg' % i, text='text', tags='tags', disabled=False)
+                      for i in range(4)]
+            for minutes, sound in [(0, 0), (1, 1), (2, 0), (3, 2), (4, 3)]:
+                ResultHistory(user=user, sound=sounds[sound], timestamp=start + datetime.timedelta(minutes=minutes))
+            sounds[3].disabled = True
+        try:
+            recent = tools.get_latest_used_sounds_from_user(9101, limit=3)
+            self.assertEqual([sound['id'] for sound in recent], [9102, 9100, 9101])
+            self.assertEqual(load_latest_used_sound_ids(9101, 2), [9102, 9100])
+            self.assertEqual(tools.get_latest_used_sounds_from_user(9102), [])
+        finally:
+            with db_session:
+                delete(r for r in ResultHistory if r.user.id == 9101)
+                delete(s for s in Sound if s.id >= 9100 and s.id < 9104)
+                User[9101].delete()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import datetime
+import unittest
+from app.catalog.recommendations import *
+from app.persistence import *
+from app.persistence.writebehind import HistoryEvent, RESULT
+
+USES = {1: {10: 3, 11: 1}, 2: {10: 1, 11: 2, 12: 1}, 3: {12: 5, 13: 1}, 4: {14: 1}}
+
+
+class RecommendationsTest(unittest.TestCase):
+
+    def test_co_usage_neighbors(self):
+        model = CoUsageModel.build(USES, neighbors=3)
+        self.assertEqual(model.sound_ids.tolist(), [10, 11, 12, 13, 14])
+        # 12 was chosen by 2 users, 1 of them chose 13 too, and sounds aren't their own neighbors
+        self.assertEqual(model.neighbors[2].tolist(), [3, 0, 1])
+        self.assertAlmostEqual(float(model.weights[2][0]), 0.5 ** 0.5, places=6)
+        self.assertEqual(model.neighbors[4].tolist(), [5, 5, 5])
+
+    def test_users_are_paired_in_chunks(self):
+        model = CoUsageModel.build(USES, neighbors=3)
+        for chunk_pairs in (1, 4, 9):
+            chunked = CoUsageModel.build(USES, neighbors=3, chunk_pairs=chunk_pairs)
+            self.assertEqual(chunked.neighbors.tolist(), model.neighbors.tolist())
+            self.assertEqual(chunked.weights.tolist(), model.weights.tolist())
+
+    def test_recommends_sounds_used_together(self):
+        recommendations = Recommendations(top_size=3)
+        recommendations.load((user_id, sound_id, uses) for user_id, sounds in USES.items()
+                             for sound_id, uses in sounds.items())
+        self.assertEqual(recommendations.recommend(1), (12,))
+        self.assertEqual(recommendations.recommend(3), (10, 11))
+        self.assertEqual(recommendations.recommend(99), ())
+
+    def test_records_update_the_user_before_the_model(self):
+        recommendations = Recommendations(top_size=3)
+        recommendations.load([(4, 14, 1), (5, 10, 1), (5, 11, 1)])
+        self.assertEqual(recommendations.recommend(4), ())
+        recommendations.record(4, 10)
+        self.assertEqual(recommendations.recommend(4), (11,))
+        # 14 is only related to 10 once rebuilt
+        self.assertEqual(recommendations.recommend(5), ())
+        recommendations.rebuild()
+        self.assertEqual(recommendations.recommend(5), (14,))
+
+    def test_user_sound_uses(self):
+        db = Database(provider='sqlite')
+        now = datetime.datetime.utcnow()
+        user = {'id': 9501, 'is_bot': False, 'first_name': 'recommendations', 'last_name': None, 'username': None,
+                'language_code': None}
+        db.add_sound(9501, 'recommendations.ogg', 'text', 'tags')
+        db.add_history([HistoryEvent(RESULT, user, 9501, now), HistoryEvent(RESULT, user, 9501, now)])
+        try:
+            self.assertIn((9501, 9501, 2), db.get_user_sound_uses())
+            self.assertNotIn((9501, 9501, 2), db.get_user_sound_uses(catalog='other'))
+            # Results are counted per day for the popularity
+            self.assertIn((9501, datetime.datetime.combine(now.date(), datetime.time()), 2), db.get_sound_uses())
+        finally:
+            with db_session:
+                delete(r for r in ResultHistory if r.user.id == 9501)
+                User[9501].delete()
+                Sound[9501].delete()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import unittest
+import telebot.types as types
+from app.recorder import *
+
+UPDATE_FILE = os.path.join(os.path.dirname(__file__), 'data', 'inline_query_update.json')
+
+
+class UpdateRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(UPDATE_FILE) as update_file:
+            self.update = json.load(update_file)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'updates.gz')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_polled_updates_are_recorded_as_received(self):
+        recorded = to_dict(types.Update.de_json(self.update))
+        self.assertEqual(recorded['inline_query']['query'], 'capa')
+        self.assertEqual(recorded['inline_query']['from']['username'], 'ignatius_test')
+        self.assertEqual(types.Update.de_json(recorded).inline_query.from_user.id,
+                         self.update['inline_query']['from']['id'])
+
+    def test_records_are_appended(self):
+        for _ in range(2):
+            recorder = UpdateRecorder(self.path).start()
+            recorder.record(self.update)
+            recorder.record(types.Update.de_json(self.update), 'other')
+            recorder.close()
+            self.assertEqual((recorder.recorded, recorder.dropped), (2, 0))
+        entries = list(read(self.path))
+        self.assertEqual([bot for _, bot, _ in entries], ['', 'other', '', 'other'])
+        self.assertEqual(entries[0][2], self.update)
+        self.assertEqual(entries[1][2]['inline_query']['id'], self.update['inline_query']['id'])
+
+    def test_anonymization(self):
+        anonymizer = Anonymizer(b'key')
+        user = self.update['inline_query']['from']
+        anonymous = anonymizer(self.update)['inline_query']
+        self.assertEqual(anonymous['query'], 'capa')
+        self.assertNotEqual(anonymous['from']['id'], user['id'])
+        self.assertEqual(anonymous['from']['id'], anonymizer.id(user['id']))
+        self.assertEqual(anonymous['from']['username'], 'user%d' % anonymous['from']['id'])
+        self.assertEqual(anonymous['from']['first_name'], 'User')
+        self.assertNotEqual(Anonymizer(b'other').id(user['id']), anonymous['from']['id'])
+        self.assertLess(anonymizer.id(-100123), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import datetime
+import unittest
+from app.persistence import *
+from app.persistence.retention import *
+from app.persistence.writebehind import HistoryEvent, QUERY, RESULT
+
+
+class RetentionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db = Database(provider='sqlite')
+
+    def test_cutoff_is_midnight(self):
+        self.assertEqual(cutoff(2, now=datetime.datetime(2020, 3, 3, 15, 30)), datetime.datetime(2020, 3, 1))
+        self.assertRaises(ValueError, Retention, self.db, 1)
+
+    def test_rolls_up_and_deletes_old_rows(self):
+        now = datetime.datetime.utcnow()
+        old = datetime.datetime.combine((now - datetime.timedelta(days=40)).date(), datetime.time(12))
+        user = {'id': 9301, 'is_bot': False, 'first_name': 'retention', 'last_name': None, 'username': None,
+                'language_code': None}
+        self.db.add_sound(9301, 'retention.ogg', 'text', 'tags')
+        queries, results, uses = self.db.count_queries(), self.db.count_results(), self.db.count_sound_uses()
+        self.db.add_history([HistoryEvent(QUERY, user, 'r', old), HistoryEvent(QUERY, user, 're', old),
+                             HistoryEvent(RESULT, user, 9301, old),
+                             HistoryEvent(RESULT, user, 9301, old + datetime.timedelta(days=1)),
+                             HistoryEvent(QUERY, user, 'ret', now), HistoryEvent(RESULT, user, 9301, now)])
+        try:
+            retention = Retention(self.db, days=30, batch_size=2, pause=0)
+            self.assertEqual(retention.run(), 4)
+            self.assertEqual(retention.run(), 0)
+            with db_session:
+                self.assertEqual(select(q.text for q in QueryHistory if q.user.id == 9301)[:], ['ret'])
+                self.assertEqual(count(r for r in ResultHistory if r.user.id == 9301), 1)
+                self.assertEqual(sorted((a.day, a.queries, a.results) for a in User[9301].daily_activity),
+                                 [(old.date(), 2, 1), (old.date() + datetime.timedelta(days=1), 0, 1)])
+            self.assertEqual(self.db.count_queries(), queries + 3)
+            self.assertEqual(self.db.count_results(), results + 3)
+            self.assertEqual(self.db.count_sound_uses()[9301], 3)
+            self.assertEqual(sorted((timestamp, count) for sound_id, timestamp, count in self.db.get_sound_uses()
+                                    if sound_id == 9301),
+                             [(datetime.datetime.combine(old.date(), datetime.time()), 1),
+                              (datetime.datetime.combine(old.date(), datetime.time()) + datetime.timedelta(days=1), 1),
+                              (datetime.datetime.combine(now.date(), datetime.time()), 1)])
+            # In memory databases can't be vacuumed incrementally
+            self.assertIsNone(self.db.reclaim_space())
+        finally:
+            with db_session:
+                delete(a for a in DailyUserActivity if a.user.id == 9301)
+                delete(u for u in DailySoundUses if u.sound.id == 9301)
+                delete(q for q in QueryHistory if q.user.id == 9301)
+                delete(r for r in ResultHistory if r.user.id == 9301)
+                User[9301].delete()
+                Sound[9301].delete()
+        self.assertEqual(self.db.count_sound_uses().get(9301), uses.get(9301))
+
+
+if __name__ == '__main__':
+    unittest.main()
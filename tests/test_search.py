@@ -0,0 +1,49 @@
+import unittest
+from app.catalog.search import *
+
+SOUNDS = [
+    {'id': 1, 'filename': 'a.ogg', 'text': 'Capachao', 'tags': 'capachao julio'},
+    {'id': 2, 'filename': 'b.ogg', 'text': 'Pero capachao', 'tags': 'pero capachao'},
+    {'id': 3, 'filename': 'c.ogg', 'text': 'El capa', 'tags': 'el capa ignatius'},
+    {'id': 4, 'filename': 'd.ogg', 'text': '¡España!', 'tags': 'Españita julio'},
+    {'id': 5, 'filename': 'e.ogg', 'text': 'Escapar', 'tags': 'escapar'},
+]
+
+
+class SearchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.index = SearchIndex(SOUNDS)
+
+    def ids(self, text, limit=None):
+        return [sound['id'] for sound in self.index.search(text, limit=limit)]
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('¡Españita,  JULIO!'), ['espanita', 'julio'])
+
+    def test_ranking(self):
+        # whole word, then prefix, then substring
+        self.assertEqual(self.ids('capa'), [3, 1, 2, 5])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.ids('capachao pero'), [2])
+        self.assertEqual(self.ids('jul capa'), [1])
+        self.assertEqual(self.ids('capa nothing'), [])
+
+    def test_normalized_query(self):
+        self.assertEqual(self.ids('ESPAÑ'), [4])
+        self.assertEqual(self.ids('¡Julio!'), [1, 4])
+
+    def test_short_and_long_fragments(self):
+        self.assertEqual(self.ids('ig'), [3])
+        self.assertEqual(self.ids('natius'), [3])
+        self.assertEqual(self.ids('xyzw'), [])
+
+    def test_empty_query_and_limit(self):
+        self.assertEqual(self.ids(' ,. '), [])
+        self.assertEqual(self.ids('a', limit=2), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
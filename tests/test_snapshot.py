@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+from app.catalog import Catalog, snapshot
+from tests.test_search import SOUNDS
+
+BUCKET = 'https://example.com/sounds/'
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = os.path.join(self.directory.name, 'data.json')
+        self.path = os.path.join(self.directory.name, 'catalog.snapshot')
+        with open(self.data, 'w') as data_file:
+            data_file.write('{"sounds": []}')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_version_depends_on_data_and_parts(self):
+        version = snapshot.data_version(self.data, BUCKET, 'sounds')
+        self.assertEqual(version, snapshot.data_version(self.data, BUCKET, 'sounds'))
+        self.assertNotEqual(version, snapshot.data_version(self.data, BUCKET, 'other sounds'))
+        with open(self.data, 'w') as data_file:
+            data_file.write('{"sounds": [{}]}')
+        self.assertNotEqual(version, snapshot.data_version(self.data, BUCKET, 'sounds'))
+
+    def test_loaded_catalog_answers_like_the_built_one(self):
+        catalog = Catalog(SOUNDS, BUCKET)
+        catalog.query('capachao', 10)
+        snapshot.save(catalog, self.path, 'v1')
+
+        loaded = snapshot.load(self.path, 'v1')
+        self.assertEqual(loaded.sounds, catalog.sounds)
+        self.assertEqual(loaded.results[1].to_json(), catalog.results[1].to_json())
+        self.assertEqual([result.to_json() for result in loaded.query('capachao', 10)],
+                         [result.to_json() for result in catalog.query('capachao', 10)])
+        self.assertEqual(loaded.cache.info()['misses'], 1)
+
+    def test_outdated_missing_or_corrupt_snapshot_is_not_loaded(self):
+        self.assertIsNone(snapshot.load(self.path, 'v1'))
+        snapshot.save(Catalog(SOUNDS, BUCKET), self.path, 'v1')
+        self.assertIsNone(snapshot.load(self.path, 'v2'))
+        with open(self.path, 'wb') as snapshot_file:
+            snapshot_file.write(b'not a snapshot')
+        with self.assertLogs('LaVidaModerna_Bot.catalog.snapshot', 'WARNING'):
+            self.assertIsNone(snapshot.load(self.path, 'v1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from app.persistence import row_to_user
+from app.persistence.sqlite import *
+
+
+class ParseSqlitePathTest(unittest.TestCase):
+
+    def test_plain_path(self):
+        self.assertEqual(parse_sqlite_path('/data/db.sqlite'), ('/data/db.sqlite', {}))
+        self.assertEqual(parse_sqlite_path(None), (None, {}))
+
+    def test_tuned_preset_can_be_overridden(self):
+        filename, options = parse_sqlite_path('/data/db.sqlite?synchronous=FULL&tuned')
+        self.assertEqual(filename, '/data/db.sqlite')
+        self.assertEqual(options, dict(TUNED_OPTIONS, synchronous='full'))
+
+    def test_invalid_options(self):
+        self.assertRaises(ValueError, parse_sqlite_path, 'db.sqlite?journal=wal')
+        self.assertRaises(ValueError, parse_sqlite_path, 'db.sqlite?journal_mode=fast')
+        self.assertRaises(ValueError, parse_sqlite_path, 'db.sqlite?mmap_size=big')
+
+
+class ReadOnlyConnectionsTest(unittest.TestCase):
+
+    def test_reads_and_refuses_writes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'db.sqlite')
+            connection = sqlite3.connect(filename)
+            apply_pragmas(connection, {'journal_mode': 'wal'})
+            connection.execute('CREATE TABLE User (id INTEGER, is_bot BOOLEAN, first_name TEXT, last_name TEXT, '
+                               'username TEXT, language_code TEXT)')
+            connection.execute("INSERT INTO User VALUES (1, 0, 'first', '', 'user', 'es')")
+            connection.commit()
+
+            reader = ReadOnlyConnections(filename, TUNED_OPTIONS)
+            rows = reader.execute('SELECT * FROM User WHERE id = ?', (1,))
+            self.assertEqual(row_to_user(rows[0]), {'id': 1, 'is_bot': False, 'first_name': 'first',
+                                                    'last_name': None, 'username': 'user', 'language_code': 'es'})
+            self.assertRaises(sqlite3.OperationalError, reader.execute, 'DELETE FROM User')
+            reader.connection().close()
+            connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import datetime
+import unittest
+from app.persistence import *
+from app.persistence.stats import *
+from app.persistence.writebehind import HistoryEvent, QUERY, RESULT
+
+NOW = 1600000000.0
+
+
+class WindowTest(unittest.TestCase):
+
+    def test_window_counter_expires_old_buckets(self):
+        counter = WindowCounter(HOUR)
+        counter.add(NOW - 2 * HOUR)
+        counter.add(NOW - 30 * 60)
+        counter.add(NOW, amount=2)
+        self.assertEqual(counter.total(NOW), 3)
+        self.assertEqual(counter.total(NOW + 45 * 60), 2)
+        self.assertEqual(counter.total(NOW + 2 * HOUR), 0)
+
+    def test_active_users(self):
+        users = ActiveUsers(HOUR)
+        users.add(3, NOW - 3 * HOUR)
+        users.add(1, NOW - 2 * HOUR)
+        users.add(2, NOW - 10)
+        users.add(1, NOW)
+        self.assertEqual(users.total(NOW), 2)
+        self.assertEqual(users.total(NOW + HOUR - 5), 1)
+
+
+class FakeDatabase:
+
+    def count_users(self):
+        return 10
+
+    def count_queries(self):
+        return 100
+
+    def count_results(self):
+        return 20
+
+    def count_sound_uses(self):
+        return {1: 15, 2: 5}
+
+    def get_query_times(self, since):
+        return [(2, datetime.datetime.utcnow() - datetime.timedelta(hours=2)), (1, datetime.datetime.utcnow())]
+
+    def get_result_times(self, since):
+        return [(1, datetime.datetime.utcnow())]
+
+
+class StatisticsTest(unittest.TestCase):
+
+    def test_load_and_record(self):
+        stats = Statistics()
+        stats.load(FakeDatabase())
+        stats.record_user()
+        stats.record_query(3)
+        stats.record_result(3, 2)
+        stats.record_result(3, 2)
+        snapshot = stats.snapshot()
+        self.assertEqual((snapshot['users'], snapshot['queries'], snapshot['results']), (11, 101, 22))
+        self.assertEqual(snapshot['window_queries'], {HOUR: 2, DAY: 3})
+        self.assertEqual(snapshot['window_results'], {HOUR: 3, DAY: 3})
+        self.assertEqual(snapshot['active_users'], {HOUR: 2, DAY: 3})
+        self.assertEqual(snapshot['top_sounds'], [(1, 15), (2, 7)])
+
+    def test_database_keeps_statistics(self):
+        db = Database(provider='sqlite')
+        db.add_sound(9201, 'stats.ogg', 'text', 'tags')
+        users, queries, results = db.count_users(), db.count_queries(), db.count_results()
+        stats = db.stats.snapshot()
+        self.assertEqual((stats['users'], stats['queries'], stats['results']), (users, queries, results))
+
+        now = datetime.datetime.utcnow()
+        user = {'id': 9201, 'is_bot': False, 'first_name': 'stats', 'last_name': None, 'username': None,
+                'language_code': None}
+        db.add_history([HistoryEvent(QUERY, user, 'st', now), HistoryEvent(RESULT, user, 9201, now)])
+        stats = db.stats.snapshot()
+        self.assertEqual((stats['users'], stats['queries'], stats['results']), (users + 1, queries + 1, results + 1))
+        self.assertEqual(db.count_users(), users + 1)
+        self.assertEqual(db.count_results(since=now - datetime.timedelta(seconds=1)), 1)
+        self.assertEqual(db.count_sound_uses()[9201], 1)
+        with db_session:
+            delete(q for q in QueryHistory if q.user.id == 9201)
+            delete(r for r in ResultHistory if r.user.id == 9201)
+            User[9201].delete()
+            Sound[9201].delete()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from app.catalog.watcher import FileWatcher
+from app.persistence import *
+from app.persistence.sync import *
+
+
+def db_sound(id, filename, text='text', tags='tags', disabled=False):
+    return {'id': id, 'filename': filename, 'text': text, 'tags': tags, 'disabled': disabled}
+
+
+def json_sound(filename, text='text', tags='tags'):
+    return {'filename': filename, 'text': text, 'tags': tags}
+
+
+class DiffSoundsTest(unittest.TestCase):
+
+    def test_diff(self):
+        db_sounds = [db_sound(1, 'same.ogg'), db_sound(2, 'gone.ogg'), db_sound(3, 'retagged.ogg'),
+                     db_sound(4, 'back.ogg', disabled=True), db_sound(5, 'still_gone.ogg', disabled=True)]
+        json_sounds = [json_sound('new_b.ogg'), json_sound('same.ogg'), json_sound('retagged.ogg', tags='new tags'),
+                       json_sound('back.ogg'), json_sound('new_a.ogg')]
+        diff = diff_sounds(db_sounds, json_sounds)
+        self.assertEqual([sound['filename'] for sound in diff.added], ['new_b.ogg', 'new_a.ogg'])
+        self.assertEqual(diff.removed, [db_sounds[1]])
+        self.assertEqual(sorted(diff.changed, key=lambda sound: sound['id']),
+                         [db_sound(3, 'retagged.ogg', tags='new tags'), db_sound(4, 'back.ogg')])
+        self.assertEqual(str(diff), '2 added, 1 removed, 2 changed')
+
+    def test_no_changes(self):
+        self.assertFalse(diff_sounds([db_sound(1, 'same.ogg')], [json_sound('same.ogg')]))
+
+
+class ApplySoundDiffTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db = Database(provider='sqlite')
+
+    def sync(self, json_sounds):
+        mine = [sound for sound in self.db.get_all_sounds() if sound['filename'].startswith('sync_')]
+        self.db.apply_sound_diff(diff_sounds(mine, json_sounds))
+        return {sound['filename']: sound for sound in self.db.get_all_sounds()
+                if sound['filename'].startswith('sync_')}
+
+    def test_apply_sound_diff(self):
+        sounds = self.sync([json_sound('sync_a.ogg'), json_sound('sync_b.ogg')])
+        self.assertEqual(sorted(sounds), ['sync_a.ogg', 'sync_b.ogg'])
+        self.assertNotEqual(sounds['sync_a.ogg']['id'], sounds['sync_b.ogg']['id'])
+
+        sounds = self.sync([json_sound('sync_a.ogg', text='new text')])
+        self.assertEqual(sounds['sync_a.ogg']['text'], 'new text')
+        self.assertTrue(sounds['sync_b.ogg']['disabled'])
+
+        sounds = self.sync([json_sound('sync_a.ogg', text='new text'), json_sound('sync_b.ogg')])
+        self.assertFalse(sounds['sync_b.ogg']['disabled'])
+        with db_session:
+            delete(s for s in Sound if s.filename.startswith('sync_'))
+
+    def test_catalogs_are_synchronized_separately(self):
+        try:
+            self.db.apply_sound_diff(diff_sounds([], [json_sound('sync_shared.ogg')]))
+            self.db.apply_sound_diff(diff_sounds([], [json_sound('sync_shared.ogg', text='other')]), catalog='other')
+            other = self.db.get_all_sounds(catalog='other')
+            self.assertEqual([(sound['filename'], sound['text']) for sound in other], [('sync_shared.ogg', 'other')])
+            self.assertNotIn(other[0]['id'], [sound['id'] for sound in self.db.get_sounds()])
+            self.assertNotEqual(self.db.get_sounds_version(catalog='other'), self.db.get_sounds_version())
+            self.assertFalse(diff_sounds(other, [json_sound('sync_shared.ogg', text='other')]))
+        finally:
+            with db_session:
+                delete(s for s in Sound if 'sync_' in s.filename)
+
+
+class FileWatcherTest(unittest.TestCase):
+
+    def test_check_detects_changes(self):
+        changes = []
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data.json')
+            with open(path, 'w') as data:
+                data.write('{}')
+            watcher = FileWatcher(path, lambda: changes.append(path))
+            self.assertFalse(watcher.check())
+            with open(path, 'w') as data:
+                data.write('{"sounds": []}')
+            self.assertTrue(watcher.check())
+            self.assertFalse(watcher.check())
+        self.assertEqual(changes, [path])
+
+
+if __name__ == '__main__':
+    unittest.main()
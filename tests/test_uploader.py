@@ -0,0 +1,105 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import pony.orm
+import telebot
+
+from app.catalog import *
+from app.catalog.uploader import file_hash
+from app.persistence import Database, Sound, db_session
+from app.persistence.migrations import add_missing_columns
+from tests.stub_telegram import StubTelegram
+
+BUCKET = 'https://example.com/sounds/'
+
+
+class VoiceUploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name in ('a.ogg', 'b.ogg'):
+            with open(os.path.join(self.directory.name, name), 'wb') as sound_file:
+                sound_file.write(name.encode())
+        self.stub = StubTelegram().install()
+        self.stub.keep_requests = True
+        self.stored = {}
+        self.uploader = VoiceUploader(telebot.TeleBot('0:test', threaded=False), 42,
+                                      lambda *stored: self.stored.__setitem__(stored[0], stored[1:]), BUCKET,
+                                      sounds_dir=self.directory.name, pause=0)
+        self.sounds = [{'id': 1, 'filename': 'a.ogg', 'text': 'A', 'tags': 'a', 'file_id': None, 'file_hash': None},
+                       {'id': 2, 'filename': 'b.ogg', 'text': 'B', 'tags': 'b', 'file_id': 'old',
+                        'file_hash': file_hash(b'b.ogg')}]
+
+    def tearDown(self):
+        self.stub.uninstall()
+        self.directory.cleanup()
+
+    def test_uploads_only_new_or_changed_sounds(self):
+        self.assertEqual(self.uploader.warm_up(self.sounds), 1)
+        self.assertEqual(self.stored, {1: ('voice1', file_hash(b'a.ogg'))})
+        self.assertEqual(self.stub.calls['sendVoice'], 1)
+        self.assertEqual(self.stub.calls['deleteMessage'], 1)
+        method, params, files = self.stub.requests[0]
+        self.assertEqual(str(params['chat_id']), '42')
+        self.assertEqual(files['voice'], b'a.ogg')
+
+        with open(os.path.join(self.directory.name, 'b.ogg'), 'wb') as sound_file:
+            sound_file.write(b'new b')
+        self.sounds[0].update(file_id='voice1', file_hash=file_hash(b'a.ogg'))
+        self.assertEqual(self.uploader.warm_up(self.sounds), 1)
+        self.assertEqual(self.stored[2], ('voice2', file_hash(b'new b')))
+        self.assertEqual(self.uploader.warm_up([dict(self.sounds[1], file_id='voice2', file_hash=file_hash(b'new b'))]),
+                         0)
+
+    def test_background_warm_up_calls_on_done(self):
+        done = threading.Event()
+        uploaded = []
+        self.uploader.start(self.sounds, on_done=lambda count: (uploaded.append(count), done.set()))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(uploaded, [1])
+
+    def test_cached_results(self):
+        catalog = Catalog([dict(self.sounds[0], file_id='voice1'), self.sounds[1]], BUCKET)
+        self.assertEqual(json.loads(catalog.results[1].to_json())['voice_file_id'], 'voice1')
+        self.assertEqual(json.loads(catalog.results[1].to_json())['type'], 'voice')
+        self.assertEqual(json.loads(Catalog([dict(self.sounds[0])], BUCKET).results[1].to_json())['voice_url'],
+                         BUCKET + 'a.ogg')
+
+
+class SoundFileTest(unittest.TestCase):
+
+    def test_set_sound_file(self):
+        db = Database(provider='sqlite')
+        db.add_sound(9401, 'upload.ogg', 'text', 'tags')
+        try:
+            self.assertIsNone(db.get_sound(id=9401)['file_id'])
+            db.set_sound_file(9401, 'file', 'hash')
+            self.assertEqual(db.get_sound(id=9401)['file_id'], 'file')
+            self.assertEqual(db.get_sound(id=9401)['file_hash'], 'hash')
+        finally:
+            with db_session:
+                Sound[9401].delete()
+
+    def test_add_missing_columns(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'old.sqlite')
+            connection = sqlite3.connect(filename)
+            connection.execute('CREATE TABLE "Sound" ("id" INTEGER PRIMARY KEY, "filename" TEXT NOT NULL)')
+            connection.execute("INSERT INTO Sound VALUES (1, 'a.ogg')")
+            connection.commit()
+            old_db = pony.orm.Database()
+            old_db.bind(provider='sqlite', filename=filename)
+            add_missing_columns(old_db)
+            add_missing_columns(old_db)
+            self.assertEqual(connection.execute('SELECT * FROM Sound').fetchall(),
+                             [(1, 'a.ogg', '', '', None, None, None, None, '')])
+            old_db.disconnect()
+            connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
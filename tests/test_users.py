@@ -0,0 +1,80 @@
+import datetime
+import unittest
+from unittest import mock
+from app.persistence import *
+from app.persistence.users import *
+from app.persistence.writebehind import HistoryEvent, QUERY
+
+
+def user(user_id, username='user'):
+    return {'id': user_id, 'is_bot': False, 'first_name': 'first', 'last_name': None, 'username': username,
+            'language_code': 'es'}
+
+
+class UserFingerprintsTest(unittest.TestCase):
+
+    def test_unchanged_and_eviction(self):
+        users = UserFingerprints(max_users=2)
+        self.assertFalse(users.unchanged(user(1)))
+        users.remember(user(1))
+        users.remember(user(2))
+        self.assertTrue(users.unchanged(user(1)))
+        self.assertFalse(users.unchanged(user(1, username='renamed')))
+        users.remember(user(3))
+        self.assertEqual(len(users), 2)
+        self.assertFalse(users.unchanged(user(2)))
+        self.assertTrue(users.unchanged(user(1)))
+        users.forget(1)
+        self.assertFalse(users.unchanged(user(1)))
+
+
+class UserUpsertTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db = Database(provider='sqlite')
+
+    def tearDown(self):
+        with db_session:
+            delete(q for q in QueryHistory if q.user.id >= 9501 and q.user.id < 9510)
+            delete(u for u in User if u.id >= 9501 and u.id < 9510)
+
+    def test_returning_users_skip_the_database(self):
+        users = self.db.count_users()
+        self.assertEqual(self.db.add_or_update_user(user(9501)), user(9501))
+        self.assertEqual(self.db.count_users(), users + 1)
+        hits = self.db.users.hits
+        self.assertIsNone(self.db.add_or_update_user(user(9501)))
+        self.assertEqual(self.db.users.hits, hits + 1)
+
+        self.assertEqual(self.db.add_or_update_user(user(9501, username='renamed')), user(9501, username='renamed'))
+        self.assertEqual(self.db.get_user(id=9501), user(9501, username='renamed'))
+        self.assertEqual(self.db.count_users(), users + 1)
+
+    def test_users_inserted_meanwhile_are_updated(self):
+        with db_session:
+            db.execute("INSERT INTO User (id, is_bot, first_name, last_name, username, language_code) "
+                       "VALUES (9503, 0, 'inserted', '', '', '')")
+        self.assertEqual(self.db.add_or_update_user(user(9503)), user(9503))
+        self.assertEqual(self.db.get_user(id=9503), user(9503))
+
+    def test_history_batches_update_changed_profiles(self):
+        now = datetime.datetime.utcnow()
+        self.db.add_history([HistoryEvent(QUERY, user(9502), 'a', now)])
+        self.assertTrue(self.db.users.unchanged(user(9502)))
+        self.db.add_history([HistoryEvent(QUERY, user(9502, username='renamed'), 'ab', now)])
+        self.assertEqual(self.db.get_user(id=9502), user(9502, username='renamed'))
+        with db_session:
+            self.assertEqual(count(q for q in QueryHistory if q.user.id == 9502), 2)
+
+    def test_history_batches_update_users_added_meanwhile(self):
+        self.db.add_or_update_user(user(9504))
+        self.db.users.forget(9504)
+        # As if /start stored the user after the batch looked it up
+        with mock.patch.object(User, 'select', return_value=[]):
+            self.db.add_history([HistoryEvent(QUERY, user(9504, username='renamed'), 'a', datetime.datetime.utcnow())])
+        self.assertEqual(self.db.get_user(id=9504), user(9504, username='renamed'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+import unittest
+import urllib.error
+import urllib.request
+import telebot.types as types
+from app.webhook import *
+
+UPDATE_FILE = os.path.join(os.path.dirname(__file__), 'data', 'inline_query_update.json')
+
+
+class WebhookServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.processed = []
+        self.release = threading.Event()
+        self.release.set()
+        self.server = None
+
+    def tearDown(self):
+        self.release.set()
+        if self.server:
+            self.server.stop()
+
+    def process_update(self, update):
+        self.release.wait(5)
+        self.processed.append(types.Update.de_json(update))
+
+    def start(self, **kwargs):
+        self.server = WebhookServer(self.process_update, host='127.0.0.1', port=0, path='/hook', **kwargs).start()
+
+    def post(self, body, path='/hook', headers=None):
+        request = urllib.request.Request('http://127.0.0.1:%d%s' % (self.server.port, path), data=body,
+                                         headers=headers or {}, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    def test_recorded_update_is_processed(self):
+        self.start()
+        with open(UPDATE_FILE, 'rb') as update:
+            self.assertEqual(self.post(update.read()), 200)
+        self.server.stop()
+        self.server = None
+        self.assertEqual(len(self.processed), 1)
+        self.assertEqual(self.processed[0].inline_query.query, 'capa')
+        self.assertEqual(self.processed[0].inline_query.from_user.username, 'ignatius_test')
+
+    def test_rejects_bad_requests(self):
+        self.start(secret_token='secret')
+        body = json.dumps({'update_id': 1}).encode()
+        self.assertEqual(self.post(body, headers={SECRET_TOKEN_HEADER: 'wrong'}), 403)
+        self.assertEqual(self.post(body, path='/other', headers={SECRET_TOKEN_HEADER: 'secret'}), 404)
+        self.assertEqual(self.post(b'not json', headers={SECRET_TOKEN_HEADER: 'secret'}), 400)
+
+    def test_routes_share_the_workers(self):
+        other = []
+        self.start(workers=1, queue_size=0)
+        self.server.add_route('/other', other.append, secret_token='secret')
+        body = json.dumps({'update_id': 1}).encode()
+        self.assertEqual(self.post(body, path='/other'), 403)
+        self.assertEqual(self.post(body, path='/other', headers={SECRET_TOKEN_HEADER: 'secret'}), 200)
+        self.assertEqual(self.post(body), 200)
+        self.server.stop()
+        self.server = None
+        self.assertEqual(other, [{'update_id': 1}])
+        self.assertEqual(len(self.processed), 1)
+
+    def test_backpressure_when_saturated(self):
+        self.release.clear()
+        self.start(workers=1, queue_size=1, backpressure_timeout=0.1)
+        body = json.dumps({'update_id': 1}).encode()
+        self.assertEqual(self.post(body), 200)
+        self.assertEqual(self.post(body), 200)
+        self.assertEqual(self.post(body), 503)
+        self.assertEqual((self.server.accepted, self.server.rejected), (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import datetime
+import os
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from app.persistence import *
+from app.persistence.writebehind import *
+
+
+def telegram_user(id):
+    return SimpleNamespace(id=id, is_bot=False, first_name='first name', last_name=None, username='user%d' % id,
+                           language_code='es')
+
+
+class RecordingDatabase:
+
+    def __init__(self):
+        self.batches = []
+
+    def add_history(self, events):
+        self.batches.append(list(events))
+
+    def events(self):
+        return [event for batch in self.batches for event in batch]
+
+
+class FailingDatabase(RecordingDatabase):
+
+    def __init__(self):
+        super().__init__()
+        self.failing = False
+
+    def add_history(self, events):
+        if self.failing:
+            raise OSError('database is down')
+        super().add_history(events)
+
+
+class SlowDatabase(RecordingDatabase):
+
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+
+    def add_history(self, events):
+        self.writing.set()
+        time.sleep(0.1)
+        super().add_history(events)
+
+
+class HistoryWriterTest(unittest.TestCase):
+
+    def test_batches_by_size(self):
+        database = RecordingDatabase()
+        writer = HistoryWriter(database, batch_size=3, flush_interval=60)
+        for i in range(7):
+            writer.add_query(SimpleNamespace(from_user=telegram_user(1), query='q%d' % i))
+        writer.flush()
+        self.assertEqual([len(batch) for batch in database.batches], [3, 3, 1])
+        self.assertEqual(database.events()[0].kind, QUERY)
+        self.assertEqual(database.events()[0].user['username'], 'user1')
+
+    def test_background_flush_by_time(self):
+        database = RecordingDatabase()
+        writer = HistoryWriter(database, batch_size=100, flush_interval=0.05).start()
+        writer.add_result(SimpleNamespace(from_user=telegram_user(1), result_id='42'))
+        deadline = time.monotonic() + 5
+        while not database.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        writer.close()
+        self.assertEqual(database.events()[0].value, 42)
+        self.assertEqual(writer.written, 1)
+
+    def test_drop_when_full(self):
+        database = RecordingDatabase()
+        writer = HistoryWriter(database, max_size=2, overflow=OVERFLOW_DROP)
+        for i in range(5):
+            writer.add_query(SimpleNamespace(from_user=telegram_user(1), query='q%d' % i))
+        writer.close()
+        self.assertEqual(writer.dropped, 3)
+        self.assertEqual([event.value for event in database.events()], ['q0', 'q1'])
+
+    def test_spill_when_full(self):
+        database = RecordingDatabase()
+        with tempfile.TemporaryDirectory() as directory:
+            spill_file = os.path.join(directory, 'history.spill')
+            writer = HistoryWriter(database, max_size=2, overflow=OVERFLOW_SPILL, spill_file=spill_file)
+            for i in range(5):
+                writer.add_query(SimpleNamespace(from_user=telegram_user(1), query='q%d' % i))
+            self.assertEqual(writer.spilled, 3)
+            writer.close()
+            self.assertFalse(os.listdir(directory))
+        self.assertEqual(sorted(event.value for event in database.events()), ['q0', 'q1', 'q2', 'q3', 'q4'])
+
+    def test_events_are_spilled_while_the_database_fails(self):
+        database = FailingDatabase()
+        with tempfile.TemporaryDirectory() as directory:
+            spill_file = os.path.join(directory, 'history.spill')
+            writer = HistoryWriter(database, max_size=1, batch_size=2, overflow=OVERFLOW_SPILL, spill_file=spill_file)
+            for i in range(6):
+                writer.add_query(SimpleNamespace(from_user=telegram_user(1), query='q%d' % i))
+            self.assertEqual(writer.spilled, 5)
+            database.failing = True
+            writer.flush()
+            self.assertEqual(os.listdir(directory), ['history.spill'])
+            # The queued event too, not only the spilled ones
+            with open(spill_file) as spill:
+                self.assertEqual(len(spill.readlines()), 6)
+            self.assertEqual(writer.spilled, 6)
+            database.failing = False
+            writer.close()
+            self.assertFalse(os.listdir(directory))
+        self.assertEqual(sorted(event.value for event in database.events()), ['q0', 'q1', 'q2', 'q3', 'q4', 'q5'])
+        self.assertEqual((writer.written, writer.failed), (6, 3))
+
+    def test_flush_waits_for_the_batch_being_written(self):
+        database = SlowDatabase()
+        writer = HistoryWriter(database, flush_interval=0.01).start()
+        try:
+            writer.add_query(SimpleNamespace(from_user=telegram_user(1), query='q'))
+            self.assertTrue(database.writing.wait(5))
+            writer.flush()
+            self.assertEqual([event.value for event in database.events()], ['q'])
+        finally:
+            writer.close()
+
+    def test_event_json_round_trip(self):
+        event = HistoryEvent(RESULT, {'id': 1}, 3, datetime.datetime(2018, 5, 1, 12, 30, 0, 15))
+        self.assertEqual(json_to_event(event_to_json(event)), event)
+
+
+class AddHistoryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db = Database(provider='sqlite')
+
+    def test_add_history_batch(self):
+        self.db.add_sound(9001, 'writebehind.ogg', 'text', 'tags')
+        now = datetime.datetime.utcnow()
+        user = {'id': 9001, 'is_bot': False, 'first_name': 'new', 'last_name': None, 'username': None,
+                'language_code': None}
+        self.db.add_history([HistoryEvent(QUERY, user, 'wri', now),
+                             HistoryEvent(RESULT, user, 9001, now),
+                             HistoryEvent(RESULT, user, 123456, now)])
+        self.assertEqual(self.db.get_user(id=9001), user)
+        with db_session:
+            self.assertEqual(select(q for q in QueryHistory if q.user.id == 9001).count(), 1)
+            self.assertEqual(select(r for r in ResultHistory if r.user.id == 9001).count(), 1)
+            delete(q for q in QueryHistory if q.user.id == 9001)
+            delete(r for r in ResultHistory if r.user.id == 9001)
+            User[9001].delete()
+            Sound[9001].delete()
+
+
+if __name__ == '__main__':
+    unittest.main()